@@ -0,0 +1,75 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        run_batch script
+    * Description:   Creates the layers and the Excel files of the communes
+    *                of a manifest without the QGIS GUI
+    * Specific lib:  none
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+
+    Example (OSGeo4W shell):
+        python-qgis-ltr run_batch.py communes.json --procs 4
+
+    Manifest (JSON):
+        {
+            "conf": {"lot_attname_led": "LOT_NUM"},
+            "communes": [
+                {
+                    "name": "Commune 1",
+                    "parc_src": "commune1/cadastre.gpkg|layername=Parcelles",
+                    "lot_src": "commune1/lots.shp",
+                    "out_dir": "commune1/chasse",
+                    "conf": {"dist_max_spb": 3}
+                }
+            ]
+        }
+"""
+
+
+import argparse
+import importlib
+import os
+import sys
+
+from qgis.core import QgsApplication
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hunting lots layers and Excel files of many communes")
+    parser.add_argument("manifest", help="JSON manifest of the communes")
+    parser.add_argument("--procs", type=int, default=0, help="number of communes run at the same time (0: number of CPU)")
+    parser.add_argument("--report-dir", help="directory of the consolidated report (default: dir of the manifest)")
+    args = parser.parse_args()
+
+    # The plugin is imported as a package (name of its directory)
+    plugin_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.path.dirname(plugin_dir))
+    batch = importlib.import_module(os.path.basename(plugin_dir) + ".sgm_hunting_batch")
+
+    qgs = QgsApplication([], False)
+    qgs.initQgis()
+    try:
+        report = batch.run_batch(args.manifest, args.report_dir, args.procs)
+    finally:
+        qgs.exitQgis()
+    print(f"{report['nb_ok']} ok, {report['nb_error']} error(s), {report['wall_s']} s")
+    sys.exit(1 if report['nb_error'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        run_bench script
+    * Description:   Runs the benchmark of the plugin without the QGIS GUI
+    *                (python of the QGIS install, standalone QgsApplication)
+    * Specific lib:  none
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+
+    Example (OSGeo4W shell):
+        python-qgis-ltr run_bench.py out_dir --sizes 1000 10000 100000 --lots 30
+"""
+
+
+import argparse
+import importlib
+import json
+import os
+import sys
+
+from qgis.core import QgsApplication
+
+
+def conf_value(txt):
+    '''
+        Returns the value of a --set parameter (JSON value, text otherwise)
+    '''
+    try:
+        return json.loads(txt)
+    except ValueError:
+        return txt
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the stages of PrepaParcLot and ExportXl")
+    parser.add_argument("out_dir", help="directory of the synthetic data and of the results")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="numbers of parcels of the synthetic cadastres")
+    parser.add_argument("--lots", type=int, default=30, help="number of hunting lots")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random generator")
+    parser.add_argument("--workers", type=int, help="number of worker processes (nb_workers_spb)")
+    parser.add_argument("--no-export", action="store_true", help="does not run ExportXl")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="parameter of sgm_hunting_conf.json (ex: grid_size_spb=0.01)")
+    args = parser.parse_args()
+
+    conf_over = {}
+    for kv in args.set:
+        k, v = kv.split("=", 1)
+        conf_over[k] = conf_value(v)
+    if args.workers is not None:
+        conf_over['nb_workers_spb'] = args.workers
+
+    # The plugin is imported as a package (name of its directory)
+    plugin_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.path.dirname(plugin_dir))
+    bench = importlib.import_module(os.path.basename(plugin_dir) + ".sgm_hunting_bench")
+
+    qgs = QgsApplication([], False)
+    qgs.initQgis()
+    try:
+        res = bench.run_bench(args.out_dir, args.sizes, args.lots, conf_over, args.seed, not args.no_export)
+        for pipeline, stages in res['scaling'].items():
+            for stage, curve in stages.items():
+                print(f"{pipeline}.{stage}: exponent {curve['exponent']}")
+    finally:
+        qgs.exitQgis()
+
+
+if __name__ == '__main__':
+    main()
@@ -25,7 +25,7 @@
 from qgis.PyQt.QtCore import  QCoreApplication
 from qgis.PyQt.QtWidgets import QAction, QMenu
 from qgis.PyQt.QtGui import QIcon
-from qgis.core import QgsProject
+from qgis.core import QgsProject, QgsApplication
 from qgis.utils import iface
 
 import os.path
@@ -34,6 +34,7 @@ from .sgm_hunting_globalvars import *
 from .sgm_hunting_prepaparclot import PrepaParcLot
 from .sgm_hunting_crerapport import ExportXl
 from .sgm_hunting_conf import Conf
+from .sgm_hunting_provider import HuntingProvider
 
 # Imports resources (for icons)
 from . import sgm_hunting_rc
@@ -44,18 +45,30 @@ class SgmHunting:
     # Initialization
     def __init__(self, iface):
         self.iface = iface
-        self.canvas = self.iface.mapCanvas()
+        # No iface with qgis_process (Processing provider only)
+        self.canvas = self.iface.mapCanvas() if self.iface else None
         self.project = QgsProject.instance()
         self.selectiae_window = None
         
         # Initializes plugin directory
         self.plugin_dir = os.path.dirname(__file__)
+        self.provider = None
+
+
+    def initProcessing(self):
+        '''
+            Adds the Processing provider of the plugin (also called by qgis_process)
+        '''
+        self.provider = HuntingProvider()
+        QgsApplication.processingRegistry().addProvider(self.provider)
 
 
     def initGui(self):
         '''
             Initialization of menu and toolbar
         '''
+        self.initProcessing()
+
         # Adds specific menu to QGIS menu
         self.sgm_menu = QMenu(QCoreApplication.translate("Hunting", mnu_title_txt))
         self.iface.mainWindow().menuBar().insertMenu(self.iface.firstRightStandardMenu().menuAction(), self.sgm_menu)
@@ -97,6 +110,9 @@ class SgmHunting:
         '''
             Removes the plugin menu item and icon from QGIS GUI
         '''
+        if self.provider:
+            QgsApplication.processingRegistry().removeProvider(self.provider)
+            self.provider = None
         if self.sgm_menu != None:
             self.iface.mainWindow().menuBar().removeAction(self.sgm_menu.menuAction())
             self.sgm_menu.deleteLater()
@@ -0,0 +1,345 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        Processing algorithms
+    * Description:   Stages of the creation of the layers and Excel export
+    *                as Processing algorithms (Model Builder, batch, qgis_process)
+    * Specific lib:  openpyxl (XlExportJob)
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+from qgis.core import (QgsProcessing, QgsProcessingAlgorithm, QgsProcessingException,
+                        QgsProcessingParameterFeatureSource, QgsProcessingParameterVectorLayer,
+                        QgsProcessingParameterField, QgsProcessingParameterNumber,
+                        QgsProcessingParameterBoolean, QgsProcessingParameterString,
+                        QgsProcessingParameterFeatureSink, QgsProcessingParameterFileDestination,
+                        QgsFeature, QgsFeatureRequest, QgsFeatureSink, QgsGeometry, QgsWkbTypes)
+from qgis.PyQt.QtGui import QIcon
+
+import os.path
+
+from .sgm_hunting_globalvars import *
+from .sgm_hunting_globalfnc import *
+from .sgm_hunting_snap import LotSnapper
+from .sgm_hunting_overlay import LotOverlay
+from .sgm_hunting_prorata import ParcLotSink
+from .sgm_hunting_lotstats import LotAggregate
+from .sgm_hunting_lotunion import LotPieces, union_pieces
+from .sgm_hunting_xlexportjob import XlExportJob
+
+
+class HuntingAlgorithm(QgsProcessingAlgorithm):
+    '''
+        Base of the algorithms of the plugin
+        The parameters of sgm_hunting_conf.json are declared with add_conf_param:
+        name of the parameter = key without its widget suffix, in capital letters,
+        type given by the suffix, default value read from the json file
+    '''
+
+    alg_name = ''
+    alg_txt = ('', '')
+
+    def __init__(self):
+        super().__init__()
+        self.plugin_dir = os.path.dirname(__file__)
+        self.conf_keys = []
+
+
+    def name(self):
+        return self.alg_name
+
+
+    def displayName(self):
+        return self.alg_txt[0]
+
+
+    def shortHelpString(self):
+        return self.alg_txt[1]
+
+
+    def group(self):
+        return alg_group_txt
+
+
+    def groupId(self):
+        return 'huntinglots'
+
+
+    def icon(self):
+        return QIcon(os.path.join(self.plugin_dir, 'icons', 'sgm_hunting.png'))
+
+
+    def flags(self):
+        # The algorithms only use their own sources and writers (no project, no iface):
+        # they can run in a background thread and in parallel in the batch interface
+        return super().flags() & ~QgsProcessingAlgorithm.FlagNoThreading
+
+
+    def createInstance(self):
+        return type(self)()
+
+
+    def add_conf_param(self, key, label, parent=None):
+        '''
+            Adds the parameter of a key of sgm_hunting_conf.json
+            parent: name of the layer parameter of a field name parameter
+        '''
+        conf, conf_path = read_jsparams(self.plugin_dir, "sgm_hunting_conf", "params")
+        name = key[:-4].upper()
+        dflt = conf.get(key)
+        if parent:
+            param = QgsProcessingParameterField(name, label, dflt, parent)
+        elif key.endswith('_spb'):
+            num_type = QgsProcessingParameterNumber.Integer if isinstance(dflt, int) else QgsProcessingParameterNumber.Double
+            param = QgsProcessingParameterNumber(name, label, num_type, dflt, False, 0)
+        elif key.endswith('_chk'):
+            param = QgsProcessingParameterBoolean(name, label, dflt)
+        else:
+            param = QgsProcessingParameterString(name, label, dflt)
+        self.addParameter(param)
+        self.conf_keys.append(key)
+
+
+    def conf_values(self, parameters, context):
+        '''
+            Returns the values of the conf parameters, keyed as in sgm_hunting_conf.json
+        '''
+        conf = {}
+        for key in self.conf_keys:
+            name = key[:-4].upper()
+            param = self.parameterDefinition(name)
+            if isinstance(param, QgsProcessingParameterField):
+                vals = self.parameterAsFields(parameters, name, context)
+                conf[key] = vals[0] if vals else ''
+            elif key.endswith('_chk'):
+                conf[key] = self.parameterAsBoolean(parameters, name, context)
+            elif key.endswith('_spb'):
+                conf[key] = self.parameterAsDouble(parameters, name, context)
+            else:
+                conf[key] = self.parameterAsString(parameters, name, context)
+        return conf
+
+
+    def source(self, parameters, name, context):
+        '''
+            Returns the feature source of a parameter (raises an error if not valid)
+        '''
+        src = self.parameterAsSource(parameters, name, context)
+        if src is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, name))
+        return src
+
+
+class SnapLotsAlgorithm(HuntingAlgorithm):
+    '''
+        Snaps the lots on the parcels (LotSnapper)
+    '''
+
+    alg_name = 'snaplots'
+    alg_txt = alg_snap_txt
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource('PARCELS', alg_param_txt['PARCELS'],
+                                                                [QgsProcessing.TypeVectorPolygon]))
+        self.addParameter(QgsProcessingParameterFeatureSource('LOTS', alg_param_txt['LOTS'],
+                                                                [QgsProcessing.TypeVectorPolygon]))
+        self.add_conf_param('dist_max_spb', alg_param_txt['DIST_MAX'])
+        self.addParameter(QgsProcessingParameterFeatureSink('OUTPUT', alg_param_txt['SNAPPED'],
+                                                            QgsProcessing.TypeVectorPolygon))
+
+
+    def processAlgorithm(self, parameters, context, feedback):
+        parc_src = self.source(parameters, 'PARCELS', context)
+        lot_src = self.source(parameters, 'LOTS', context)
+        dist_max = self.conf_values(parameters, context)['dist_max_spb']
+        (sink, dest_id) = self.parameterAsSink(parameters, 'OUTPUT', context, lot_src.fields(),
+                                                QgsWkbTypes.multiType(lot_src.wkbType()), lot_src.sourceCrs())
+        lots = [lot for lot in lot_src.getFeatures() if lot.hasGeometry()]
+        snapper = LotSnapper(parc_src, parc_src.sourceCrs(), lot_src.sourceCrs(), dist_max, context.transformContext())
+        if dist_max > 0:
+            snapper.load_ref([lot.geometry() for lot in lots])
+        for lot_id, lot in enumerate(lots):
+            if feedback.isCanceled():
+                break
+            geom = snapper.snap(lot.geometry()) if dist_max > 0 else QgsGeometry(lot.geometry())
+            geom.convertToMultiType()
+            obj = QgsFeature(lot)
+            obj.setGeometry(geom)
+            sink.addFeature(obj, QgsFeatureSink.FastInsert)
+            feedback.setProgress((lot_id + 1) * 100 / len(lots))
+        return {'OUTPUT': dest_id}
+
+
+class SplitParcelsAlgorithm(HuntingAlgorithm):
+    '''
+        Splits the parcels by the lots and calculates the hunting surfaces
+        (LotOverlay and ParcLotSink)
+    '''
+
+    alg_name = 'splitparcels'
+    alg_txt = alg_split_txt
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource('PARCELS', alg_param_txt['PARCELS'],
+                                                                [QgsProcessing.TypeVectorPolygon]))
+        self.addParameter(QgsProcessingParameterFeatureSource('LOTS', alg_param_txt['SNAPPED'],
+                                                                [QgsProcessing.TypeVectorPolygon]))
+        self.add_conf_param('lot_attname_led', alg_param_txt['LOT_ATTNAME'], 'LOTS')
+        self.add_conf_param('grid_size_spb', alg_param_txt['GRID_SIZE'])
+        self.add_conf_param('sliver_area_spb', alg_param_txt['SLIVER_AREA'])
+        self.add_conf_param('sliver_width_spb', alg_param_txt['SLIVER_WIDTH'])
+        self.add_conf_param('sliver_merge_chk', alg_param_txt['SLIVER_MERGE'])
+        self.add_conf_param('largest_rem_chk', alg_param_txt['LARGEST_REM'])
+        self.addParameter(QgsProcessingParameterFeatureSink('OUTPUT', alg_param_txt['PARCLOT'],
+                                                            QgsProcessing.TypeVectorPolygon))
+
+
+    def processAlgorithm(self, parameters, context, feedback):
+        parc_src = self.source(parameters, 'PARCELS', context)
+        lot_src = self.source(parameters, 'LOTS', context)
+        conf = self.conf_values(parameters, context)
+        lot_attname = conf['lot_attname_led']
+        lot_flds = lot_src.fields()
+        if lot_flds.indexFromName(lot_attname) == -1:
+            raise QgsProcessingException(alg_fld_err_txt.format(lot_attname))
+        for fld_name in (surfgeo_fldname, contparc_fldname):
+            if parc_src.fields().indexFromName(fld_name) == -1:
+                raise QgsProcessingException(alg_fld_err_txt.format(fld_name))
+        # The lots are few: materialized to be loaded as a layer by the overlay
+        lot_lyr = lot_src.materialize(QgsFeatureRequest(), feedback)
+        overlay = LotOverlay(conf['grid_size_spb'], conf['sliver_area_spb'], conf['sliver_width_spb'],
+                                conf['sliver_merge_chk'])
+        overlay.load_lyr(lot_lyr, lot_attname, parc_src.sourceCrs(), context.transformContext())
+        in_flds = merge_fields(parc_src.fields(), [lot_flds.at(lot_flds.indexFromName(lot_attname))])
+        (sink, dest_id) = self.parameterAsSink(parameters, 'OUTPUT', context, ParcLotSink.out_fields(in_flds),
+                                                QgsWkbTypes.multiType(parc_src.wkbType()), parc_src.sourceCrs())
+        parclot_sink = ParcLotSink(in_flds, lot_attname, None, None, None, None,
+                                    largest_rem=conf['largest_rem_chk'], writer=sink)
+        request = QgsFeatureRequest(overlay.extent)
+        request.setInvalidGeometryCheck(QgsFeatureRequest.GeometrySkipInvalid)
+        nb_obj = max(parc_src.featureCount(), 1)
+        try:
+            for obj_id, parc in enumerate(parc_src.getFeatures(request)):
+                if feedback.isCanceled():
+                    break
+                parc_atts = parc.attributes()
+                for piece_geom, lot_val in overlay.split(parc.geometry()):
+                    parclot_sink.add_piece(piece_geom, parc_atts + [lot_val], obj_id)
+                if obj_id % 1000 == 0:
+                    feedback.setProgress(obj_id * 100 / nb_obj)
+        finally:
+            parclot_sink.close()
+        if overlay.nb_sliv_dropped or overlay.nb_sliv_merged:
+            feedback.pushInfo(sliver_msg_txt.format(overlay.nb_sliv_dropped, overlay.nb_sliv_merged))
+        return {'OUTPUT': dest_id}
+
+
+class CalcLotsAlgorithm(HuntingAlgorithm):
+    '''
+        Creates the calculated lots (union of the parcel pieces of each lot)
+        with the totals by lot
+    '''
+
+    alg_name = 'calclots'
+    alg_txt = alg_calc_txt
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource('PARCLOTS', alg_param_txt['PARCLOT'],
+                                                                [QgsProcessing.TypeVectorPolygon]))
+        self.add_conf_param('lot_attname_led', alg_param_txt['LOT_ATTNAME'], 'PARCLOTS')
+        self.add_conf_param('grid_size_spb', alg_param_txt['GRID_SIZE'])
+        self.addParameter(QgsProcessingParameterFeatureSink('OUTPUT', alg_param_txt['NWLOTS'],
+                                                            QgsProcessing.TypeVectorPolygon))
+
+
+    def processAlgorithm(self, parameters, context, feedback):
+        parclot_src = self.source(parameters, 'PARCLOTS', context)
+        conf = self.conf_values(parameters, context)
+        lot_attname = conf['lot_attname_led']
+        flds = parclot_src.fields()
+        fld_ids = [flds.indexFromName(n) for n in [lot_attname] + add_fldnames]
+        if -1 in fld_ids:
+            raise QgsProcessingException(alg_fld_err_txt.format(', '.join([lot_attname] + add_fldnames)))
+        # One scan: pieces and totals by lot
+        lot_pieces = LotPieces()
+        lot_agg = LotAggregate()
+        request = QgsFeatureRequest()
+        request.setSubsetOfAttributes(fld_ids)
+        for obj in parclot_src.getFeatures(request):
+            if feedback.isCanceled():
+                return {}
+            lot_val = obj.attribute(fld_ids[0])
+            lot_agg.add(lot_val, py_val(obj.attribute(fld_ids[1])) or 0, py_val(obj.attribute(fld_ids[2])) or 0)
+            if obj.hasGeometry():
+                lot_pieces.lots.setdefault(lot_val, []).append(bytes(obj.geometry().asWkb()))
+        nwlots_flds = merge_fields([flds.at(fld_ids[0])], LotAggregate.fields())
+        (sink, dest_id) = self.parameterAsSink(parameters, 'OUTPUT', context, nwlots_flds,
+                                                QgsWkbTypes.multiType(parclot_src.wkbType()), parclot_src.sourceCrs())
+        lot_vals = lot_pieces.lot_values()
+        for i, lot_val in enumerate(lot_vals):
+            if feedback.isCanceled():
+                break
+            nw_obj = QgsFeature(nwlots_flds)
+            nw_obj.setGeometry(geom_from_wkb(union_pieces(lot_pieces.lots.pop(lot_val), conf['grid_size_spb'])))
+            nw_obj.setAttributes([lot_val] + lot_agg.get(lot_val).values())
+            sink.addFeature(nw_obj, QgsFeatureSink.FastInsert)
+            feedback.setProgress((i + 1) * 100 / len(lot_vals))
+        return {'OUTPUT': dest_id}
+
+
+class ExportXlAlgorithm(HuntingAlgorithm):
+    '''
+        Creates the Excel file of the parcels by lot (XlExportJob)
+        The format of the export is given by the extension of the output file
+        XlExportJob reads the layers themselves (not feature sources): the algorithm
+        runs in the main thread
+    '''
+
+    alg_name = 'exportxl'
+    alg_txt = alg_export_txt
+
+    def flags(self):
+        return super().flags() | QgsProcessingAlgorithm.FlagNoThreading
+
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterVectorLayer('PARCLOTS', alg_param_txt['PARCLOT'],
+                                                            [QgsProcessing.TypeVectorPolygon]))
+        self.addParameter(QgsProcessingParameterVectorLayer('NWLOTS', alg_param_txt['NWLOTS'],
+                                                            [QgsProcessing.TypeVectorPolygon]))
+        self.add_conf_param('lot_attname_led', alg_param_txt['LOT_ATTNAME'], 'NWLOTS')
+        self.add_conf_param('att_export_led', alg_param_txt['ATT_EXPORT'])
+        self.add_conf_param('hd_export_led', alg_param_txt['HD_EXPORT'])
+        self.addParameter(QgsProcessingParameterFileDestination('OUTPUT', alg_param_txt['XLSX'], export_file_filter))
+
+
+    def processAlgorithm(self, parameters, context, feedback):
+        parclot_lyr = self.parameterAsVectorLayer(parameters, 'PARCLOTS', context)
+        nwlot_lyr = self.parameterAsVectorLayer(parameters, 'NWLOTS', context)
+        for name, lyr in (('PARCLOTS', parclot_lyr), ('NWLOTS', nwlot_lyr)):
+            if lyr is None:
+                raise QgsProcessingException(self.invalidSourceError(parameters, name))
+        xl_filepath = self.parameterAsFileOutput(parameters, 'OUTPUT', context)
+        conf = self.conf_values(parameters, context)
+        # Format of the export given by the extension of the output file
+        ext = os.path.splitext(xl_filepath)[1].lower()
+        conf['export_fmt_cmb'] = next((fmt for fmt, fmt_ext in export_fmts.items() if fmt_ext == ext), 'xlsx')
+        job = XlExportJob(parclot_lyr, nwlot_lyr, xl_filepath, conf, feedback.pushInfo, feedback.pushDebugInfo)
+        job.run()
+        return {'OUTPUT': job.xl_filepath}
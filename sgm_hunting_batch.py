@@ -0,0 +1,218 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        Batch
+    * Description:   Creation of the layers and of the Excel file for many
+    *                communes (manifest), in worker processes, without GUI
+    * Specific lib:  openpyxl (XlExportJob)
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+from qgis.core import QgsApplication, QgsVectorLayer, QgsProcessingFeedback
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import codecs
+import csv
+import datetime
+import json
+import os
+import time
+import traceback
+
+from .sgm_hunting_globalvars import *
+from .sgm_hunting_globalfnc import *
+from .sgm_hunting_parclotjob import ParcLotJob
+from .sgm_hunting_xlexportjob import XlExportJob
+from .sgm_hunting_instrument import plugin_version
+
+
+# QGIS application of a worker process (see init_worker)
+worker_qgs = None
+
+
+class BatchFeedback(QgsProcessingFeedback):
+    '''
+        Feedback of a commune: the messages are kept to be written in the log of the commune
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.msgs = []
+
+
+    def pushInfo(self, info):
+        self.msgs.append(f"{datetime.datetime.now():%H:%M:%S} {info}")
+
+
+    def log_msg(self, msg):
+        '''
+            Adds a message of the Excel export
+        '''
+        self.pushInfo(msg)
+
+
+def init_worker():
+    '''
+        Starts QGIS (without GUI) in a worker process
+    '''
+    global worker_qgs
+    if QgsApplication.instance() is None:
+        worker_qgs = QgsApplication([], False)
+        worker_qgs.initQgis()
+
+
+def read_manifest(manifest_path):
+    '''
+        Reads the manifest of the communes (JSON):
+        {
+            "conf": {common parameters of sgm_hunting_conf.json},
+            "communes": [
+                {"name": ..., "parc_src": ..., "lot_src": ..., "out_dir": ..., "conf": {parameters of the commune}},
+                ...
+            ]
+        }
+        parc_src and lot_src are OGR uris (path|layername=...), the relative paths are
+        relative to the manifest
+        Two communes can not have the same name nor the same out_dir (their
+        files would overwrite each other)
+        Returns the common parameters and the list of the communes
+    '''
+    with codecs.open(manifest_path, encoding='utf-8', mode='r') as json_file:
+        manifest = json.load(json_file)
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    communes = []
+    used = {'name': set(), 'out_dir': set()}
+    for com_id, com in enumerate(manifest.get('communes', [])):
+        for k in ('parc_src', 'lot_src', 'out_dir'):
+            if not com.get(k):
+                raise ValueError(batch_err_txt.format(com.get('name', com_id + 1), k))
+            path, sep, opts = com[k].partition('|')
+            com[k] = os.path.join(base_dir, path) + sep + opts
+        com.setdefault('name', os.path.basename(os.path.normpath(com['out_dir'])))
+        for k, val in (('name', com['name']), ('out_dir', os.path.normcase(os.path.abspath(com['out_dir'])))):
+            if val in used[k]:
+                raise ValueError(batch_dup_txt.format(com_id + 1, k, com['name']))
+            used[k].add(val)
+        communes.append(com)
+    return manifest.get('conf', {}), communes
+
+
+def run_commune(com, conf):
+    '''
+        Creates the layers (GPKG) and the Excel file of a commune in its output dir
+        (run in a worker process: the arguments and the result are plain python objects)
+        Returns the status, the files and the measures of the stages
+        Never raises: an error of a commune must not stop the others
+    '''
+    res = {'name': com['name'], 'status': 'error', 'error': '', 'wall_s': None, 'gpkg': None, 'xlsx': None, 'stages': {}}
+    feedback = BatchFeedback()
+    wall = time.perf_counter()
+    try:
+        os.makedirs(com['out_dir'], exist_ok=True)
+        parc_lyr = QgsVectorLayer(com['parc_src'], parc_lyrname, 'ogr')
+        lot_lyr = QgsVectorLayer(com['lot_src'], conf['lot_lyrname_led'], 'ogr')
+        for lyr in (parc_lyr, lot_lyr):
+            if not lyr.isValid():
+                raise IOError(lyr.source())
+        gpkg_path = os.path.join(com['out_dir'], gpkg_fname + ".gpkg")
+        res['gpkg'] = gpkg_path
+        job = ParcLotJob(parc_lyr, lot_lyr, gpkg_path, conf, feedback)
+        ok = job.run()
+        res['stages']['PrepaParcLot'] = job.run_log.spans
+        if not ok:
+            res['status'] = 'canceled'
+            return res
+        parclot_lyr = QgsVectorLayer(job.parclot_uri, conf['parclot_lyrname_led'], 'ogr')
+        nwlots_lyr = QgsVectorLayer(job.nwlots_uri, conf['nwlots_lyrname_led'], 'ogr')
+        xl_filepath = os.path.join(com['out_dir'], f"{conf['export_fname_led']}.xlsx")
+        xl_job = XlExportJob(parclot_lyr, nwlots_lyr, xl_filepath, conf, feedback.log_msg, feedback.log_msg)
+        xl_job.run()
+        res['stages']['ExportXl'] = xl_job.run_log.spans
+        res['xlsx'] = xl_job.xl_filepath
+        res['status'] = 'ok'
+    except Exception as e:
+        res['error'] = str(e)
+        feedback.pushInfo(traceback.format_exc())
+    finally:
+        res['wall_s'] = round(time.perf_counter() - wall, 3)
+        try:
+            with open(os.path.join(com['out_dir'], batch_log_name), 'w', encoding='utf-8') as log_file:
+                log_file.write('\n'.join(feedback.msgs) + '\n')
+        except OSError:
+            pass
+    return res
+
+
+def run_batch(manifest_path, report_dir=None, nb_procs=0, send_msg=print):
+    '''
+        Runs all the communes of the manifest in a pool of nb_procs worker processes
+        (0: number of CPU) and writes the consolidated report (batch_json_name,
+        batch_csv_name) in report_dir (default: dir of the manifest)
+        Each commune uses batch_nb_workers worker processes of its own, unless
+        nb_workers_spb is set in the manifest
+        Returns the report
+    '''
+    plugin_dir = os.path.dirname(__file__)
+    dflt_conf, conf_path = read_jsparams(plugin_dir, "sgm_hunting_conf", "params")
+    dflt_conf['nb_workers_spb'] = batch_nb_workers
+    common_conf, communes = read_manifest(manifest_path)
+    dflt_conf.update(common_conf)
+    report_dir = report_dir or os.path.dirname(os.path.abspath(manifest_path))
+    os.makedirs(report_dir, exist_ok=True)
+    start = datetime.datetime.now()
+    wall = time.perf_counter()
+    results = []
+    nb_procs = min(get_nb_workers(nb_procs), max(len(communes), 1))
+    with ProcessPoolExecutor(max_workers=nb_procs, mp_context=get_mp_context(), initializer=init_worker) as executor:
+        futures = {}
+        for com_id, com in enumerate(communes):
+            conf = dict(dflt_conf)
+            conf.update(com.get('conf', {}))
+            futures[executor.submit(run_commune, com, conf)] = com_id
+        for future in as_completed(futures):
+            com_id = futures[future]
+            try:
+                res = future.result()
+            except Exception as e:
+                # Worker process lost (crash of QGIS, memory...)
+                res = {'name': communes[com_id]['name'], 'status': 'error', 'error': str(e), 'wall_s': None,
+                        'gpkg': None, 'xlsx': None, 'stages': {}}
+            results.append((com_id, res))
+            send_msg(f"{len(results)}/{len(communes)} {res['name']}: {res['status']} {res['error']}".rstrip())
+    # Report in the order of the manifest
+    results = [res for com_id, res in sorted(results, key=lambda r: r[0])]
+    report = {  'version': plugin_version(),
+                'manifest': os.path.abspath(manifest_path),
+                'start': start.isoformat(timespec='seconds'),
+                'wall_s': round(time.perf_counter() - wall, 3),
+                'nb_procs': nb_procs,
+                'nb_ok': sum(1 for res in results if res['status'] == 'ok'),
+                'nb_error': sum(1 for res in results if res['status'] != 'ok'),
+                'communes': results
+                }
+    with open(os.path.join(report_dir, batch_json_name), 'w', encoding='utf-8') as json_file:
+        json.dump(report, json_file, ensure_ascii=False, indent=2, default=str)
+    with open(os.path.join(report_dir, batch_csv_name), 'w', encoding='utf-8', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['name', 'status', 'error', 'wall_s', 'prepaparclot_s', 'exportxl_s', 'gpkg', 'xlsx'])
+        for res in results:
+            stg_s = [round(sum(span['wall_s'] for span in res['stages'].get(pipeline, [])), 3)
+                        for pipeline in ('PrepaParcLot', 'ExportXl')]
+            writer.writerow([res['name'], res['status'], res['error'], res['wall_s']] + stg_s + [res['gpkg'], res['xlsx']])
+    return report
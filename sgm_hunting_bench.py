@@ -0,0 +1,148 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        Benchmark
+    * Description:   Measures of the stages of PrepaParcLot and ExportXl
+    *                on synthetic cadastres of increasing sizes (headless)
+    * Specific lib:  openpyxl (XlExportJob)
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+from qgis.core import Qgis, QgsVectorLayer, QgsProcessingFeedback
+
+import csv
+import json
+import math
+import os
+import platform
+
+from .sgm_hunting_globalvars import *
+from .sgm_hunting_globalfnc import *
+from .sgm_hunting_synth import synth_cadastre
+from .sgm_hunting_parclotjob import ParcLotJob
+from .sgm_hunting_xlexportjob import XlExportJob
+from .sgm_hunting_instrument import plugin_version
+
+
+def scaling_exp(sizes, times):
+    '''
+        Returns the scaling exponent k of times ~ sizes^k (least squares
+        on the log-log curve), None if there are less than 2 usable points
+    '''
+    pts = [(math.log(n), math.log(t)) for n, t in zip(sizes, times) if n > 0 and t and t > 0]
+    if len(pts) < 2:
+        return None
+    mx = sum(x for x, y in pts) / len(pts)
+    my = sum(y for x, y in pts) / len(pts)
+    var = sum((x - mx) ** 2 for x, y in pts)
+    if var == 0:
+        return None
+    return round(sum((x - mx) * (y - my) for x, y in pts) / var, 3)
+
+
+def load_lyr(gpkg_path, lyr_name):
+    '''
+        Returns a layer of a GPKG (raises an error if not valid)
+    '''
+    lyr = QgsVectorLayer(gpkg_path + '|layername=' + lyr_name, lyr_name, 'ogr')
+    if not lyr.isValid():
+        raise IOError(f"{gpkg_path}: {lyr_name}")
+    return lyr
+
+
+def bench_size(out_dir, nb_parc, nb_lots, conf, seed=0, export=True, send_msg=print):
+    '''
+        Runs PrepaParcLot (and ExportXl if export) on a synthetic cadastre of nb_parc parcels
+        Returns the measures of the stages of each job
+    '''
+    size_dir = os.path.join(out_dir, f"parc_{nb_parc}")
+    os.makedirs(size_dir, exist_ok=True)
+    src_path = os.path.join(size_dir, "cadastre_synth.gpkg")
+    gpkg_path = os.path.join(size_dir, "parcelles_lots.gpkg")
+    # Always a full run: no previous GPKG, no cache of the snapped lots
+    for path in (src_path, gpkg_path, os.path.splitext(gpkg_path)[0] + snapcache_suffix + '.gpkg'):
+        if os.path.exists(path):
+            os.remove(path)
+    send_msg(f"{nb_parc} parcels: synthetic cadastre")
+    synth_cadastre(src_path, nb_parc, nb_lots, conf['lot_lyrname_led'], conf['lot_attname_led'], seed)
+    parc_lyr = load_lyr(src_path, synth_parc_lyrname)
+    lot_lyr = load_lyr(src_path, conf['lot_lyrname_led'])
+    result = {'nb_parc': nb_parc, 'nb_lots': lot_lyr.featureCount(), 'stages': {}}
+    send_msg(f"{nb_parc} parcels: PrepaParcLot")
+    job = ParcLotJob(parc_lyr, lot_lyr, gpkg_path, conf, QgsProcessingFeedback())
+    job.run()
+    result['stages']['PrepaParcLot'] = job.run_log.spans
+    if export:
+        send_msg(f"{nb_parc} parcels: ExportXl")
+        xl_job = XlExportJob(load_lyr(gpkg_path, conf['parclot_lyrname_led']),
+                                load_lyr(gpkg_path, conf['nwlots_lyrname_led']),
+                                os.path.join(size_dir, "export.xlsx"),
+                                conf)
+        xl_job.run()
+        result['stages']['ExportXl'] = xl_job.run_log.spans
+    return result
+
+
+def run_bench(out_dir, sizes, nb_lots, conf_over=None, seed=0, export=True, send_msg=print):
+    '''
+        Runs the benchmark for each size (number of parcels) and writes the results
+        (bench_json_name, bench_csv_name) in out_dir
+        conf_over: values of the parameters replacing the values of sgm_hunting_conf.json
+        Returns the results
+    '''
+    plugin_dir = os.path.dirname(__file__)
+    conf, conf_path = read_jsparams(plugin_dir, "sgm_hunting_conf", "params")
+    conf.update(conf_over or {})
+    # Each size is measured from scratch
+    conf['incremental_chk'] = False
+    os.makedirs(out_dir, exist_ok=True)
+    results = [bench_size(out_dir, nb_parc, nb_lots, conf, seed, export, send_msg) for nb_parc in sorted(sizes)]
+    # Scaling curves: wall time of each stage by number of parcels
+    scaling = {}
+    for res in results:
+        for pipeline, spans in res['stages'].items():
+            for span in spans:
+                curve = scaling.setdefault(pipeline, {}).setdefault(span['stage'], {'nb_parc': [], 'wall_s': []})
+                curve['nb_parc'].append(res['nb_parc'])
+                curve['wall_s'].append(span['wall_s'])
+    for pipeline in scaling.values():
+        for curve in pipeline.values():
+            curve['exponent'] = scaling_exp(curve['nb_parc'], curve['wall_s'])
+    bench = {   'version': plugin_version(),
+                'qgis': Qgis.QGIS_VERSION,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'nb_workers': get_nb_workers(conf['nb_workers_spb']),
+                'seed': seed,
+                'conf': conf,
+                'results': results,
+                'scaling': scaling
+                }
+    with open(os.path.join(out_dir, bench_json_name), 'w', encoding='utf-8') as json_file:
+        json.dump(bench, json_file, ensure_ascii=False, indent=2, default=str)
+    with open(os.path.join(out_dir, bench_csv_name), 'w', encoding='utf-8', newline='') as csv_file:
+        csv_flds = ['nb_parc', 'nb_lots', 'pipeline', 'stage', 'status', 'wall_s', 'cpu_s', 'peak_rss_delta_mb', 'nb_in', 'nb_out']
+        writer = csv.DictWriter(csv_file, csv_flds, extrasaction='ignore')
+        writer.writeheader()
+        for res in results:
+            for pipeline, spans in res['stages'].items():
+                for span in spans:
+                    writer.writerow(dict(span, nb_parc=res['nb_parc'], nb_lots=res['nb_lots'], pipeline=pipeline))
+    return bench
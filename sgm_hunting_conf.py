@@ -109,6 +109,9 @@ class ParamConf(QDialog, gui_dlg_conf):
         # Fill values
         for k, v in self.old_params.items():
             set_txt_qobj(self.__dict__[k], v)
+        # The incremental export is only available with one file by lot
+        self.export_split_chk.toggled.connect(self.export_incr_chk.setEnabled)
+        self.export_incr_chk.setEnabled(self.export_split_chk.isChecked())
         # Delete Widget on close event
         self.setAttribute(Qt.WA_DeleteOnClose)
 
@@ -7,7 +7,7 @@
     * Module:        CreRapport class
     * Description:   Class to do the job for creating XL lists
     *                the report
-    * Specific lib:  openpyxl
+    * Specific lib:  openpyxl (XlExportJob)
     * First release: 2023-09-05
     * Last release:  2023-09-07
     * Copyright:     (C)2023 SIGMOE
@@ -28,21 +28,12 @@ from qgis.PyQt import uic
 from qgis.PyQt.QtCore import Qt, pyqtSignal
 from qgis.PyQt.QtWidgets import QMessageBox, QWidget, qApp
 from qgis.PyQt.QtGui import QTextCursor
-from qgis.core import QgsExpression, QgsFeatureRequest
-
-from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
-from openpyxl.styles import (NamedStyle,
-                             PatternFill,
-                             Border,
-                             Side,
-                             Alignment,
-                             Font)
 
 import os.path
 
 from .sgm_hunting_globalvars import *
 from .sgm_hunting_globalfnc import *
+from .sgm_hunting_xlexportjob import XlExportJob
 
 
 gui_dlg_hunting_msg, _ = uic.loadUiType(
@@ -87,52 +78,24 @@ class ExportXl:
                                     alert_lyr_msg_txt[1].format(self.parclot_lyrname, self.nwlots_lyrname)
                                     )
         else:
-            parclot_lyr = parclot_lyr_m[0]
-            nwlot_lyr = nwlot_lyr_m[0]
-            # Finds the list of Lots
-            lot_lst = get_fldval_sorted(nwlot_lyr, self.lot_attname)
-            # Initializes progressbar
-            self.feedback.pg_bar.setMaximum(1 + len(lot_lst))
+            # Initializes progressbar (one step by lot)
+            self.feedback.pg_bar.setMaximum(1 + nwlot_lyr_m[0].featureCount())
             self.pgb_val = 0
             xl_filepath = os.path.join(self.export_rep, f"{self.export_fname}.xlsx")
+            job = XlExportJob(  parclot_lyr_m[0],
+                                nwlot_lyr_m[0],
+                                xl_filepath,
+                                self.conf,
+                                self.send_msg,
+                                self.feedback.update_log
+                                )
             try: 
-                self.send_msg(exportxl_msg_txt[0])
-                wb = Workbook()
-                wb.remove(wb.active)
-                self.ws = None
-                # One XL sheet per lot
-                for lot in lot_lst:
-                    exp_s = "\"" + self.lot_attname + "\"= '" + lot + "'"
-                    p_exp = QgsExpression(exp_s)
-                    parc_fts = parclot_lyr.getFeatures(QgsFeatureRequest(p_exp))
-                    ws_name = f"Lot {lot}"
-                    self.send_msg(exportxl_msg_txt[1].format(ws_name))
-                    self.ws = wb.create_sheet(ws_name)
-                    # Fills the header
-                    hd_fld_exp = self.att_export[1:-1].split("','")
-                    hd_text = self.hd_export.split(",")
-                    nb_col = len(hd_text)
-                    for col, hd_txt in enumerate(hd_text):
-                        self.fill_cell(hd_txt, 1, col+1, fill_color="bbbbbb", b=True)
-                    # Fills the rows (parcelle)
-                    row = 1
-                    for parc in parc_fts:
-                        row += 1
-                        for col, expr_val in enumerate(hd_fld_exp):
-                            nw_val = get_val_by_expr(expr_val, parclot_lyr, parc)
-                            self.fill_cell(nw_val, row , col + 1)
-                    # Adds total row
-                    row += 2
-                    self.fill_cell(tot_label.format(lot), row , 1, fill_color="bbbbbb", b=True)
-                    tot_cont = getmulti_fields_values_from_one_value(nwlot_lyr, lot, self.lot_attname, '', '')[0][tot_fldname]
-                    self.fill_cell(transfo_m_to_ha(tot_cont), row , 2, fill_color="eeeeee")
-                    # Calculates columns width
-                    for column_cells in self.ws.columns:
-                        length = max(len(as_text(cell.value)) for cell in column_cells) + col_delta_w
-                        self.ws.column_dimensions[get_column_letter(column_cells[0].column)].width = length
-                        
-                wb.save(xl_filepath)
-                open_file(xl_filepath)
+                job.run()
+                # One file by lot or format without viewer: opens the directory of the files
+                if self.export_split or self.export_fmt not in export_open_fmts:
+                    open_file(self.export_rep)
+                else:
+                    open_file(job.xl_filepath)
                 
                 # End message
                 self.send_msg(exportxl_msg_txt[2])
@@ -152,30 +115,6 @@ class ExportXl:
             self.feedback.close()
 
 
-    def fill_cell(self, val, start_row, start_col, end_row=None, end_col=None, fill_color = "ffffff", b = False):
-        '''
-             Fills a cell or merged cells if end_row and end_col != None)
-            # b: boolean for bold text
-        '''
-        cell = self.ws.cell(start_row, start_col, val)
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        cell.fill = PatternFill(fill_type='solid',
-                                fgColor=fill_color)
-        brd = Side(style='thin', color='00000000')
-        cell.border = Border(left=brd, right=brd,
-                             top=brd, bottom=brd)
-        cell.font = Font(bold=b)
-        if end_col or end_row:
-            if not end_row:
-                end_row = start_row
-            if not end_col:
-                end_col = start_col
-            self.ws.merge_cells(start_row=start_row,
-                                start_column=start_col,
-                                end_row=end_row,
-                                end_column=end_col)
-
-
     def send_msg(self, msg):
         '''
             Send message to the dlg
@@ -0,0 +1,364 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        Export formats
+    * Description:   Writers of the export of the parcels by lot in the other
+    *                formats than xlsx: CSV, ODS, Parquet, SQLite
+    * Specific lib:  pyarrow (optional, Parquet only)
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+import csv
+import os
+import pickle
+import shutil
+import sqlite3
+import tempfile
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+# pyarrow is not shipped with QGIS: the Parquet format is only available if it is installed
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from .sgm_hunting_globalvars import *
+from .sgm_hunting_globalfnc import *
+from .sgm_hunting_xlwriter import ColWidths, XlStreamWriter
+
+
+def unique_names(names):
+    '''
+        Returns the column names made unique (suffix _2, _3, ... for the duplicates)
+    '''
+    nw_names = []
+    for name in names:
+        nw_name = name.strip() or "col"
+        i = 2
+        while nw_name in nw_names:
+            nw_name = f"{name.strip() or 'col'}_{i}"
+            i += 1
+        nw_names.append(nw_name)
+    return nw_names
+
+
+def export_writer(export_fmt, out_path):
+    '''
+        Returns the writer of an export format (export_fmts)
+        All the writers have the same interface: add_sheet(title, hd_text, rows, tot_row, lot),
+        save() and nb_rows
+    '''
+    if export_fmt == 'csv':
+        return CsvExportWriter(out_path)
+    if export_fmt == 'ods':
+        return OdsExportWriter(out_path)
+    if export_fmt == 'parquet':
+        if pa is None:
+            raise ImportError(parquet_err_txt)
+        return ParquetExportWriter(out_path)
+    if export_fmt == 'sqlite':
+        return SqliteExportWriter(out_path)
+    return XlStreamWriter(out_path)
+
+
+class CsvExportWriter:
+    '''
+        Writes the export in one CSV table: one row by parcel, the lot in the
+        first column (the total rows are not written, the totals are in the
+        calculated lots layer)
+    '''
+
+    def __init__(self, out_path):
+
+        self.csv_file = open(out_path, 'w', encoding='utf-8-sig', newline='')
+        self.writer = csv.writer(self.csv_file, delimiter=csv_delimiter)
+        self.hd_done = False
+        self.nb_rows = 0
+
+
+    def add_sheet(self, title, hd_text, rows, tot_row, lot=None):
+        '''
+            Writes the rows of a lot (the header with the first lot)
+        '''
+        if not self.hd_done:
+            self.writer.writerow([export_lot_hd] + hd_text)
+            self.hd_done = True
+        for vals in rows:
+            self.writer.writerow([lot] + ['' if val is None else val for val in map(py_val, vals)])
+            self.nb_rows += 1
+
+
+    def save(self):
+        '''
+            Closes the file
+        '''
+        self.csv_file.close()
+
+
+class ParquetExportWriter:
+    '''
+        Writes the export in one Parquet table (pyarrow); the lot is in the first column
+        The type of a column must be known before the first row is written, and is
+        found from all its values: the rows are first spilled to a temporary file by
+        batches of export_batch_rows rows, then written by save()
+        Column types: float64 (only numbers), bool (only booleans), string otherwise
+        (a column mixing kinds of values is written as texts, no value is lost)
+    '''
+
+    def __init__(self, out_path):
+
+        self.out_path = out_path
+        self.names = None
+        # Kinds of the values of each column ('bool', 'num', 'str')
+        self.col_kinds = []
+        self.batch = []
+        self.spill_file = tempfile.TemporaryFile(prefix='sgm_hunting_')
+        self.nb_rows = 0
+
+
+    def add_sheet(self, title, hd_text, rows, tot_row, lot=None):
+        '''
+            Adds the rows of a lot
+        '''
+        if self.names is None:
+            self.names = unique_names([export_lot_hd] + hd_text)
+            self.col_kinds = [set() for name in self.names]
+        for vals in rows:
+            rec = [lot] + [py_val(val) for val in vals]
+            for kinds, val in zip(self.col_kinds, rec):
+                if val is not None:
+                    kinds.add(self.val_kind(val))
+            self.batch.append(rec)
+            self.nb_rows += 1
+            if len(self.batch) >= export_batch_rows:
+                self.spill()
+
+
+    @staticmethod
+    def val_kind(val):
+        '''
+            Returns the kind of a value
+        '''
+        if isinstance(val, bool):
+            return 'bool'
+        if isinstance(val, (int, float)):
+            return 'num'
+        return 'str'
+
+
+    def spill(self):
+        '''
+            Writes the waiting rows in the temporary file
+        '''
+        if self.batch:
+            pickle.dump(self.batch, self.spill_file, pickle.HIGHEST_PROTOCOL)
+            self.batch = []
+
+
+    def col_type(self, kinds):
+        '''
+            Returns the arrow type of a column from the kinds of its values
+        '''
+        if kinds == {'bool'}:
+            return pa.bool_()
+        if kinds == {'num'}:
+            return pa.float64()
+        return pa.string()
+
+
+    def save(self):
+        '''
+            Writes the Parquet file from the temporary file
+        '''
+        if self.names is None:
+            self.names = [export_lot_hd]
+            self.col_kinds = [set()]
+        self.spill()
+        schema = pa.schema([(name, self.col_type(kinds)) for name, kinds in zip(self.names, self.col_kinds)])
+        writer = pq.ParquetWriter(self.out_path, schema)
+        try:
+            self.spill_file.seek(0)
+            while True:
+                try:
+                    batch = pickle.load(self.spill_file)
+                except EOFError:
+                    break
+                arrays = []
+                for col, fld in zip(zip(*batch), schema):
+                    if pa.types.is_floating(fld.type):
+                        col = [None if val is None else float(val) for val in col]
+                    elif pa.types.is_string(fld.type):
+                        col = [None if val is None else as_text(val) for val in col]
+                    arrays.append(pa.array(col, type=fld.type))
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+        finally:
+            writer.close()
+            self.spill_file.close()
+
+
+class SqliteExportWriter:
+    '''
+        Writes the export in a table (export_sqlite_tblname) of a new SQLite database,
+        in one transaction; the lot is in the first column
+    '''
+
+    def __init__(self, out_path):
+
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        self.con = sqlite3.connect(out_path)
+        self.con.execute("PRAGMA journal_mode = OFF")
+        self.con.execute("PRAGMA synchronous = OFF")
+        self.insert_sql = None
+        self.nb_rows = 0
+
+
+    def add_sheet(self, title, hd_text, rows, tot_row, lot=None):
+        '''
+            Writes the rows of a lot (creates the table with the first lot)
+        '''
+        if self.insert_sql is None:
+            names = unique_names([export_lot_hd] + hd_text)
+            cols = ', '.join('"' + name.replace('"', '""') + '"' for name in names)
+            self.con.execute(f'CREATE TABLE "{export_sqlite_tblname}" ({cols})')
+            self.insert_sql = f'INSERT INTO "{export_sqlite_tblname}" VALUES ({", ".join("?" * len(names))})'
+        nb_cols = self.insert_sql.count('?')
+        recs = ([lot] + [val if val is None or isinstance(val, (int, float, str)) else as_text(val) for val in map(py_val, vals)]
+                for vals in rows)
+        cur = self.con.executemany(self.insert_sql, (rec[:nb_cols] + [None] * (nb_cols - len(rec)) for rec in recs))
+        self.nb_rows += cur.rowcount
+
+
+    def save(self):
+        '''
+            Commits the rows and closes the database
+        '''
+        self.con.commit()
+        self.con.close()
+
+
+class OdsExportWriter:
+    '''
+        Writes the export in an OpenDocument spreadsheet (one sheet by lot, as the
+        xlsx export), without library: the rows of each sheet are streamed to a
+        temporary file, the column widths accumulated (ColWidths), and the
+        content of the ODS is assembled from the temporary files by save()
+    '''
+
+    # Styles of the cells: style name -> (background color, bold)
+    cell_styles = {'hd': xl_styles['xl_header'], 'ce': xl_styles['xl_cell'],
+                    'tot': xl_styles['xl_total'], 'totv': xl_styles['xl_total_val']}
+
+    def __init__(self, out_path):
+
+        self.out_path = out_path
+        self.tmp_dir = tempfile.mkdtemp(prefix='sgm_hunting_')
+        # Sheets: [(title, temporary file, column widths), ...]
+        self.sheets = []
+        self.nb_rows = 0
+
+
+    @staticmethod
+    def cell_xml(val, style):
+        '''
+            Returns the XML of a cell
+        '''
+        if val is None:
+            return f'<table:table-cell table:style-name="{style}"/>'
+        if isinstance(val, (int, float)) and not isinstance(val, bool):
+            return (f'<table:table-cell table:style-name="{style}" office:value-type="float" '
+                    f'office:value="{val!r}"><text:p>{val}</text:p></table:table-cell>')
+        return (f'<table:table-cell table:style-name="{style}" office:value-type="string">'
+                f'<text:p>{escape(as_text(val))}</text:p></table:table-cell>')
+
+
+    def row_xml(self, vals, style='ce'):
+        '''
+            Returns the XML of a row
+        '''
+        return '<table:table-row>' + ''.join(self.cell_xml(val, style) for val in vals) + '</table:table-row>\n'
+
+
+    def add_sheet(self, title, hd_text, rows, tot_row, lot=None):
+        '''
+            Writes a sheet (header, rows, empty row, total row) in a temporary file
+        '''
+        col_widths = ColWidths()
+        col_widths.add(hd_text, False)
+        col_widths.add(tot_row, False)
+        path = os.path.join(self.tmp_dir, f"{len(self.sheets)}.xml")
+        with open(path, 'w', encoding='utf-8') as tmp_file:
+            tmp_file.write(self.row_xml(hd_text, 'hd'))
+            for vals in rows:
+                vals = [py_val(val) for val in vals]
+                col_widths.add(vals)
+                tmp_file.write(self.row_xml(vals))
+                self.nb_rows += 1
+            tmp_file.write('<table:table-row><table:table-cell/></table:table-row>\n')
+            tmp_file.write('<table:table-row>' + self.cell_xml(tot_row[0], 'tot') +
+                            self.cell_xml(tot_row[1], 'totv') + '</table:table-row>\n')
+        self.sheets.append((title, path, col_widths.widths))
+
+
+    def styles_xml(self):
+        '''
+            Returns the XML of the automatic styles (cells and columns of each sheet)
+        '''
+        xml = ['<office:automatic-styles>']
+        for name, (fill_color, b) in self.cell_styles.items():
+            xml.append(f'<style:style style:name="{name}" style:family="table-cell">'
+                        f'<style:table-cell-properties fo:background-color="#{fill_color}" '
+                        f'fo:border="0.5pt solid #000000" style:vertical-align="middle"/>'
+                        f'<style:paragraph-properties fo:text-align="center"/>'
+                        + ('<style:text-properties fo:font-weight="bold"/>' if b else '') + '</style:style>')
+        for sheet_id, (title, path, widths) in enumerate(self.sheets):
+            for col, width in enumerate(widths):
+                xml.append(f'<style:style style:name="co{sheet_id}_{col}" style:family="table-column">'
+                            f'<style:table-column-properties style:column-width="{(width + col_delta_w) * ods_char_width:.2f}cm"/>'
+                            '</style:style>')
+        xml.append('</office:automatic-styles>')
+        return ''.join(xml)
+
+
+    def save(self):
+        '''
+            Writes the ODS file (zip) and deletes the temporary files
+        '''
+        try:
+            with zipfile.ZipFile(self.out_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+                # The mimetype must be the first entry, not compressed
+                zf.writestr(zipfile.ZipInfo('mimetype'), 'application/vnd.oasis.opendocument.spreadsheet',
+                            compress_type=zipfile.ZIP_STORED)
+                zf.writestr('META-INF/manifest.xml', ods_manifest_xml)
+                with zf.open('content.xml', 'w') as content:
+                    content.write((ods_content_head + self.styles_xml() +
+                                    '<office:body><office:spreadsheet>').encode('utf-8'))
+                    for sheet_id, (title, path, widths) in enumerate(self.sheets):
+                        content.write((f'<table:table table:name={quoteattr(title)}>' +
+                                        ''.join(f'<table:table-column table:style-name="co{sheet_id}_{col}"/>'
+                                                for col in range(len(widths)))).encode('utf-8'))
+                        with open(path, 'rb') as tmp_file:
+                            shutil.copyfileobj(tmp_file, content)
+                        content.write(b'</table:table>')
+                    content.write(b'</office:spreadsheet></office:body></office:document-content>')
+        finally:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
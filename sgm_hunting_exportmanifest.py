@@ -0,0 +1,129 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        ExportManifest class
+    * Description:   Content hashes of the lots of an export, stored next to
+    *                the exported file (incremental export)
+    * Specific lib:  none
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+import hashlib
+import json
+import os
+
+from .sgm_hunting_globalvars import *
+from .sgm_hunting_globalfnc import *
+
+
+def lot_hash(objs, need_geom, head):
+    '''
+        Returns the content hash of the sheet of a lot
+        objs: parcels of the lot, head: everything else written in the sheet
+        (format, header, expressions, total row)
+        The exported values are calculated from the attributes of the parcels (and from
+        their geometry if an expression needs it): the attributes are hashed, sorted so
+        that the order of the parcels in the layer does not matter, without evaluating
+        the expressions
+    '''
+    parc_keys = sorted(repr([py_val(val) for val in obj.attributes()]) +
+                        (bytes(obj.geometry().asWkb()).hex() if need_geom and obj.hasGeometry() else '')
+                        for obj in objs)
+    lot_h = hashlib.sha1(json.dumps(head, default=str).encode('utf-8'))
+    for parc_key in parc_keys:
+        lot_h.update(parc_key.encode('utf-8'))
+        lot_h.update(b'\n')
+    return lot_h.hexdigest()
+
+
+class ExportManifest:
+    '''
+        Hashes of the lots of an export: lot (as text) -> [hash, number of rows]
+        Stored in a json file next to the exported file (export_manifest_suffix)
+        A lot whose hash is the same as in the manifest of the previous export
+        does not need to be written again
+    '''
+
+    def __init__(self):
+        self.lots = {}
+
+
+    @staticmethod
+    def path(out_path):
+        '''
+            Returns the path of the manifest of an exported file
+        '''
+        return os.path.splitext(out_path)[0] + export_manifest_suffix
+
+
+    @staticmethod
+    def read(out_path):
+        '''
+            Reads the manifest of an exported file
+            Returns None if there is no (valid) manifest
+        '''
+        try:
+            with open(ExportManifest.path(out_path), encoding='utf-8') as json_file:
+                lots = json.load(json_file)['lots']
+        except (OSError, ValueError, KeyError):
+            return None
+        manifest = ExportManifest()
+        manifest.lots = lots
+        return manifest
+
+
+    def write(self, out_path):
+        '''
+            Writes the manifest of an exported file
+        '''
+        with open(ExportManifest.path(out_path), 'w', encoding='utf-8') as json_file:
+            json.dump({'lots': self.lots}, json_file, indent=1)
+
+
+    @staticmethod
+    def remove(out_path):
+        '''
+            Deletes the manifest of an exported file (the file is not incremental anymore)
+        '''
+        if os.path.exists(ExportManifest.path(out_path)):
+            os.remove(ExportManifest.path(out_path))
+
+
+    def set(self, lot, lot_h, nb_rows=None):
+        '''
+            Sets the hash (and the number of rows) of a lot
+        '''
+        self.lots[str(lot)] = [lot_h, nb_rows]
+
+
+    def nb_rows(self, lot):
+        '''
+            Returns the number of rows of a lot
+        '''
+        return self.lots[str(lot)][1]
+
+
+    def unchanged(self, lot, old_manifest):
+        '''
+            Returns True if a lot has the same hash in the previous manifest
+        '''
+        if old_manifest is None or str(lot) not in old_manifest.lots:
+            return False
+        old_h, old_nb = old_manifest.lots[str(lot)]
+        return old_h == self.lots[str(lot)][0] and old_nb is not None
@@ -0,0 +1,131 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        ColumnExprs class
+    * Description:   Compiled expressions of the exported columns
+    *                (parsed and prepared once by layer fields, python fast path)
+    * Specific lib:  none
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+from qgis.core import QgsExpression, QgsExpressionContext, QgsExpressionContextScope
+
+import threading
+
+from .sgm_hunting_globalvars import *
+from .sgm_hunting_globalfnc import *
+from .sgm_hunting_fastexpr import compile_expr
+
+
+# Caches of the compiled expressions (one by thread: a QgsExpression
+# must not be evaluated by 2 threads at the same time)
+thread_caches = threading.local()
+
+
+def fields_key(fields):
+    '''
+        Returns the key of a set of fields (names and types)
+    '''
+    return tuple((fld.name(), fld.type()) for fld in fields)
+
+
+class ExprCache:
+    '''
+        Parsed and prepared expressions:
+        (expression text, fields key) -> (QgsExpression, python function or None)
+        An expression is prepared with a context holding only the fields
+        The simple expressions are also compiled into python functions (compile_expr)
+    '''
+
+    def __init__(self):
+        self.exprs = {}
+
+
+    @staticmethod
+    def local():
+        '''
+            Returns the cache of the current thread
+        '''
+        cache = getattr(thread_caches, 'cache', None)
+        if cache is None:
+            cache = thread_caches.cache = ExprCache()
+        return cache
+
+
+    def get(self, expr_txt, fields, ctx):
+        '''
+            Returns the compiled expression of expr_txt for the fields
+            and its python function (None if it must be evaluated by QGIS)
+            ctx: context (with the fields) used to prepare a new expression
+            The parse errors are in the expression (hasParserError)
+        '''
+        key = (expr_txt, fields_key(fields))
+        comp = self.exprs.get(key)
+        if comp is None:
+            expr = QgsExpression(expr_txt)
+            fast_fnc = None
+            if not expr.hasParserError():
+                expr.prepare(ctx)
+                fast_fnc = compile_expr(expr, fields)
+            comp = self.exprs[key] = (expr, fast_fnc)
+        return comp
+
+
+class ColumnExprs:
+    '''
+        Expressions of the exported columns of a layer
+        All the expressions are compiled before the export (the parse errors
+        are raised at once), then evaluated for each feature with one context
+        The simple expressions (fields, left, substr, ...) are evaluated in python
+        on the attributes of the feature, without the QGIS expression engine
+    '''
+
+    def __init__(self, expr_txts, fields, cache=None):
+
+        self.ctx = QgsExpressionContext()
+        scp = QgsExpressionContextScope()
+        scp.setFields(fields)
+        self.ctx.appendScope(scp)
+        cache = cache or ExprCache.local()
+        comps = [cache.get(expr_txt, fields, self.ctx) for expr_txt in expr_txts]
+        self.exprs = [expr for expr, fast_fnc in comps]
+        # Python function of each column (evaluation by QGIS if None)
+        self.fast_fncs = [fast_fnc for expr, fast_fnc in comps]
+        self.all_fast = None not in self.fast_fncs
+        errs = [f"{expr.expression()} ({expr.parserErrorString()})" for expr in self.exprs if expr.hasParserError()]
+        if errs:
+            raise ValueError(expr_err_txt.format(', '.join(errs)))
+
+
+    def needs_geometry(self):
+        '''
+            Returns True if an expression uses the geometry of the features
+        '''
+        return any(expr.needsGeometry() for expr, fast_fnc in zip(self.exprs, self.fast_fncs) if fast_fnc is None)
+
+
+    def values(self, obj):
+        '''
+            Returns the values of the expressions for a feature
+        '''
+        atts = obj.attributes()
+        if self.all_fast:
+            return [fast_fnc(atts) for fast_fnc in self.fast_fncs]
+        self.ctx.setFeature(obj)
+        return [fast_fnc(atts) if fast_fnc else expr.evaluate(self.ctx) for expr, fast_fnc in zip(self.exprs, self.fast_fncs)]
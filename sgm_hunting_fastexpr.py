@@ -0,0 +1,184 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        Fast expressions
+    * Description:   Compilation of the simple expressions (fields, left, right,
+    *                substr, concatenation, round) into python functions
+    * Specific lib:  none
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+from qgis.core import QgsExpression, QgsExpressionNode, QgsExpressionNodeBinaryOperator, NULL
+from qgis.PyQt.QtCore import QVariant
+
+import math
+
+
+# Kinds of the values of the fields (the other types are not compiled)
+str_qtypes = (QVariant.String,)
+num_qtypes = (QVariant.Int, QVariant.UInt, QVariant.LongLong, QVariant.ULongLong, QVariant.Double)
+
+
+def is_null(val):
+    '''
+        Returns True if an attribute value is NULL
+    '''
+    return val is None or val == NULL
+
+
+def qt_left(txt, n):
+    '''
+        QString::left: the whole text if n < 0
+    '''
+    return txt if n < 0 else txt[:n]
+
+
+def qt_right(txt, n):
+    '''
+        QString::right: the whole text if n < 0
+    '''
+    if n < 0:
+        return txt
+    return txt[len(txt) - n:] if n < len(txt) else txt
+
+
+def qgs_substr(txt, start, length=None):
+    '''
+        substr function of the QGIS expressions (start from 1, negative start
+        and length from the end of the text)
+    '''
+    if length is None:
+        length = len(txt)
+    if start < 0:
+        start = max(len(txt) + start, 0)
+    elif start > 0:
+        start -= 1
+    if length < 0:
+        length = max(len(txt) + length - start, 0)
+    return txt[start:start + length]
+
+
+def qgs_round(val, places=None):
+    '''
+        round function of the QGIS expressions (half away from zero)
+        Returns an integer without places (or 0 places), a float otherwise
+    '''
+    sign = -1 if val < 0 else 1
+    if not places:
+        return sign * int(math.floor(abs(val) + 0.5))
+    scaler = 10.0 ** places
+    return sign * math.floor(abs(val) * scaler + 0.5) / scaler
+
+
+def null_safe(fnc, *args):
+    '''
+        Returns a function of the attributes applying fnc to the values of args,
+        NULL if a value is NULL (as most of the QGIS functions)
+    '''
+    def calc(atts):
+        vals = [arg(atts) for arg in args]
+        if any(is_null(val) for val in vals):
+            return NULL
+        return fnc(*vals)
+    return calc
+
+
+def int_literal(node):
+    '''
+        Returns the value of an integer literal node, None if it is not one
+    '''
+    if node.nodeType() != QgsExpressionNode.ntLiteral:
+        return None
+    val = node.value()
+    if isinstance(val, bool) or not isinstance(val, int):
+        return None
+    return val
+
+
+def compile_node(node, fields):
+    '''
+        Returns (function of the attributes, kind of the value: 'str' or 'num')
+        of an expression node, None if the node can not be compiled
+    '''
+    node_type = node.nodeType()
+    if node_type == QgsExpressionNode.ntColumnRef:
+        fld_id = fields.lookupField(node.name())
+        if fld_id == -1:
+            return None
+        fld_type = fields.at(fld_id).type()
+        kind = 'str' if fld_type in str_qtypes else 'num' if fld_type in num_qtypes else None
+        if kind is None:
+            return None
+        return (lambda atts: atts[fld_id]), kind
+    if node_type == QgsExpressionNode.ntLiteral:
+        val = node.value()
+        if isinstance(val, str):
+            return (lambda atts: val), 'str'
+        if isinstance(val, (int, float)) and not isinstance(val, bool):
+            return (lambda atts: val), 'num'
+        return None
+    if node_type == QgsExpressionNode.ntBinaryOperator:
+        if node.op() != QgsExpressionNodeBinaryOperator.boConcat:
+            return None
+        left = compile_node(node.opLeft(), fields)
+        right = compile_node(node.opRight(), fields)
+        if not left or not right or left[1] != 'str' or right[1] != 'str':
+            return None
+        return null_safe(lambda a, b: a + b, left[0], right[0]), 'str'
+    if node_type == QgsExpressionNode.ntFunction:
+        fnc_name = QgsExpression.Functions()[node.fnIndex()].name().lower()
+        args = node.args().list() if node.args() else []
+        if not args:
+            return None
+        arg0 = compile_node(args[0], fields)
+        if arg0 is None:
+            return None
+        if fnc_name == 'concat':
+            parts = [arg0] + [compile_node(arg, fields) for arg in args[1:]]
+            if any(part is None or part[1] != 'str' for part in parts):
+                return None
+            fncs = [part[0] for part in parts]
+            # concat: the NULL values are empty texts
+            return (lambda atts: ''.join('' if is_null(v) else v for v in (f(atts) for f in fncs))), 'str'
+        # The other functions: integer literals after the first argument
+        lits = [int_literal(arg) for arg in args[1:]]
+        if None in lits:
+            return None
+        if fnc_name in ('left', 'right') and arg0[1] == 'str' and len(lits) == 1:
+            fnc = qt_left if fnc_name == 'left' else qt_right
+            n = lits[0]
+            return null_safe(lambda txt: fnc(txt, n), arg0[0]), 'str'
+        if fnc_name == 'substr' and arg0[1] == 'str' and len(lits) in (1, 2):
+            return null_safe(lambda txt: qgs_substr(txt, *lits), arg0[0]), 'str'
+        if fnc_name == 'round' and arg0[1] == 'num' and len(lits) in (0, 1):
+            return null_safe(lambda val: qgs_round(val, *lits), arg0[0]), 'num'
+        return None
+    return None
+
+
+def compile_expr(expr, fields):
+    '''
+        Returns the python function (of the attributes list of a feature) of a parsed
+        expression, None if the expression is not simple enough: it must then be
+        evaluated by QGIS
+    '''
+    if expr.hasParserError() or expr.rootNode() is None:
+        return None
+    res = compile_node(expr.rootNode(), fields)
+    return res[0] if res else None
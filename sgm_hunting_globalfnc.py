@@ -26,14 +26,17 @@
 from qgis.PyQt.QtCore import QDate, QDateTime
 from qgis.PyQt.QtGui import QColor
 from qgis.core import (QgsFields, QgsGradientStop, QgsCategorizedSymbolRenderer, QgsSymbol, QgsRendererCategory, 
-                        QgsGradientColorRamp, QgsExpression, QgsExpressionContext, QgsExpressionContextScope, QgsMessageLog)
+                        QgsGradientColorRamp, QgsExpression, QgsExpressionContext, QgsExpressionContextScope, QgsMessageLog,
+                        QgsGeometry, QgsVectorLayer, QgsFeatureRequest, NULL)
 
 import os
+import hashlib
 import subprocess
 import sys
 import json
 import codecs
 import locale
+import multiprocessing
 
 
 def read_jsparams(plugin_dir, json_name, json_key ):
@@ -76,6 +79,7 @@ def set_txt_qobj(qobj, val_txt):
         pte -> PlainTextEdit
         dte -> DateTimeEdit
         spb -> SpinBox
+        chk -> CheckBox
     '''
     # Case of ComboBox
     qobj_name = qobj.objectName()
@@ -117,6 +121,9 @@ def set_txt_qobj(qobj, val_txt):
             qobj.setValue(val_txt)
         else:
             qobj.setValue(0)
+    # Case of CheckBox
+    elif qobj_name[-3:] == 'chk':
+        qobj.setChecked(bool(val_txt))
 
 
 def get_txt_qobj(qobj):
@@ -131,6 +138,7 @@ def get_txt_qobj(qobj):
         pte -> PlainTextEdit
         dte -> DateTimeEdit
         spb -> SpinBox
+        chk -> CheckBox
     '''
     qobj_name = qobj.objectName()
     # Case of ComboBox
@@ -171,6 +179,9 @@ def get_txt_qobj(qobj):
             return [val_txt, True]
         else:
             return [0, False]
+    # Case of CheckBox
+    elif qobj_name[-3:] == 'chk':
+        return [qobj.isChecked(), True]
 
 
 def not_empty_val(val_2_check):
@@ -309,6 +320,27 @@ def get_val_by_expr(expr_val, lyr, obj):
     return nw_val
 
 
+def index_by_key(lyr, key_att, att_names):
+    '''
+        Returns an index of the features of a layer by the value of one of its fields:
+        {key_att value: {att_name: value, ...}, ...}
+        Read in one scan of the layer, without geometry and with only the key_att
+        and att_names fields (the att_names missing in the layer are not in the dicts)
+        If several features have the same key value, the last one is kept
+        To be used instead of one scan of the layer by searched value
+    '''
+    flds = lyr.fields()
+    key_id = flds.indexFromName(key_att)
+    fld_ids = [(n, flds.indexFromName(n)) for n in att_names if flds.indexFromName(n) != -1]
+    request = QgsFeatureRequest()
+    request.setFlags(QgsFeatureRequest.NoGeometry)
+    request.setSubsetOfAttributes([key_id] + [fld_id for n, fld_id in fld_ids])
+    key_idx = {}
+    for obj in lyr.getFeatures(request):
+        key_idx[obj.attribute(key_id)] = {n: obj.attribute(fld_id) for n, fld_id in fld_ids}
+    return key_idx
+
+
 def getmulti_fields_values_from_one_value(lyr, find_val, in_att, cond_val, cond_fld):
     '''
         Returns a list of dictionnaries containing all the attribute values of a specific feature
@@ -316,6 +348,7 @@ def getmulti_fields_values_from_one_value(lyr, find_val, in_att, cond_val, cond_
         respecting the condition cond_fld = cond_val
         If cond_fld == '', no condition (all the values of the field)
         The list contains the different features found respecting those rules
+        Scans the whole layer: for several values, use index_by_key
     '''
     obj_lst = []
     for obj in lyr.getFeatures():
@@ -383,4 +416,108 @@ def debug_msg(debug_on_off, msg_str, msg_list_var):
     '''
     if debug_on_off == 'DEBUG':
         msg = msg_str % msg_list_var
-        QgsMessageLog.logMessage(msg, 'Sgm debug')
\ No newline at end of file
+        QgsMessageLog.logMessage(msg, 'Sgm debug')
+
+
+def geom_from_wkb(wkb):
+    '''
+        Returns a QgsGeometry from a WKB (bytes)
+    '''
+    geom = QgsGeometry()
+    geom.fromWkb(wkb)
+    return geom
+
+
+def py_val(val):
+    '''
+        Returns a python value that can be sent to a worker process (NULL -> None)
+    '''
+    if val == NULL:
+        return None
+    return val
+
+
+def get_nb_workers(nb_workers):
+    '''
+        Returns the number of worker processes to use
+        nb_workers: configured number (0 = automatic: number of CPU)
+    '''
+    if nb_workers <= 0:
+        nb_workers = os.cpu_count() or 1
+    return int(nb_workers)
+
+
+def get_mp_context():
+    '''
+        Returns the multiprocessing context used to launch worker processes
+        Inside QGIS, sys.executable is QGIS itself and not python,
+        so the python interpreter of the QGIS install is used instead
+    '''
+    mp_ctx = multiprocessing.get_context('spawn')
+    if not os.path.basename(sys.executable).lower().startswith('python'):
+        if sys.platform == "win32":
+            mp_ctx.set_executable(os.path.join(sys.exec_prefix, 'pythonw.exe'))
+        else:
+            mp_ctx.set_executable(os.path.join(sys.exec_prefix, 'bin', 'python3'))
+    return mp_ctx
+
+
+def values_in_expr(att_name, vals):
+    '''
+        Returns the expression (also valid in OGR SQL) "att_name IN (vals)"
+    '''
+    vals_txt = ','.join(QgsExpression.quotedValue(str(v)) for v in sorted(vals, key=str))
+    return f"{QgsExpression.quotedColumnRef(att_name)} IN ({vals_txt})"
+
+
+def delete_by_values(lyr_uri, att_name, vals):
+    '''
+        Deletes the features of a layer (ogr uri) whose att_name value is in vals
+        Returns the number of deleted features
+    '''
+    if not vals:
+        return 0
+    lyr = QgsVectorLayer(lyr_uri, 'del', 'ogr')
+    request = QgsFeatureRequest(QgsExpression(values_in_expr(att_name, vals)))
+    request.setFlags(QgsFeatureRequest.NoGeometry)
+    request.setNoAttributes()
+    del_ids = [obj.id() for obj in lyr.getFeatures(request)]
+    if del_ids and not lyr.dataProvider().deleteFeatures(del_ids):
+        raise IOError(lyr.dataProvider().lastError())
+    return len(del_ids)
+
+
+def lyr_fingerprint(lyr):
+    '''
+        Returns a fingerprint (text) of the data of a layer:
+        its source, the modification time of its file and its number of features
+        Returns None if the layer is not a file (database, memory layer): its changes
+        can not be seen from its source, see src_fingerprint
+    '''
+    src = lyr.source()
+    src_path = src.split('|')[0]
+    if not os.path.isfile(src_path):
+        return None
+    return f"{src}|{os.path.getmtime(src_path)}|{lyr.featureCount()}"
+
+
+def src_fingerprint(src):
+    '''
+        Returns a fingerprint (text) of the content of the features of a layer or of a
+        feature source: ids, attributes and geometries (one scan of the features)
+    '''
+    fgp = hashlib.sha1()
+    for obj in src.getFeatures():
+        fgp.update(repr([obj.id()] + [py_val(v) for v in obj.attributes()]).encode('utf-8'))
+        fgp.update(bytes(obj.geometry().asWkb()))
+    return fgp.hexdigest()
+
+
+def get_lyr_by_uri(project, lyr_uri):
+    '''
+        Returns the layer of the project reading lyr_uri (GPKG table), None if not found
+    '''
+    for lyr in project.mapLayers().values():
+        if lyr.source().replace('\\', '/') == lyr_uri.replace('\\', '/'):
+            return lyr
+    return None
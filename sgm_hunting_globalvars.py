@@ -35,7 +35,8 @@ dlg_msg_titles = [  "Création des nouvelles couches de gestion de chasse",
                     "Export Excel Liste des parcelles par lot de chasse"
                     ]
 dlg_msg_buts = [    "Créer les couches  >>",
-                    "Exporter fichier Excel >>"
+                    "Exporter fichier Excel >>",
+                    "Annuler le traitement"
                     ]
 crelyr_msg_txt = [  "Ré-ajustement des Lots sur Parcelles",
                     "Création de la nouvelle couche <font color=\"firebrick\">{0:s}</font>",
@@ -48,10 +49,50 @@ crelyr_msg_txt = [  "Ré-ajustement des Lots sur Parcelles",
                     "Applique la symbologie catégorisée",
                     "Création des nouvelles couches terminée ! "
                     ]
+snapcache_msg_txt = "Lots ré-ajustés : {0:d} repris du cache, {1:d} recalculés, {2:d} supprimés du cache"
+sliver_msg_txt = "Morceaux de parcelles résiduels : {0:d} supprimés, {1:d} fusionnés"
+instr_msg_txt = "<i>Étape {0:s} : {1:.2f} s (CPU {2:.2f} s), mémoire max +{3:s} Mo, objets lus {4} / écrits {5}</i>"
 exportxl_msg_txt = [    "Création du fichier Excel",
                         "Création de la feuille <font color=\"firebrick\">{0:s}</font>",
                         "Export du fichier Excel des parcelles par lot de chasse terminé !"
                         ]
+incr_msg_txt = [    "Calcul des empreintes des lots",
+                    "Mode incrémental: {0:d} lot(s) à recalculer sur {1:d}",
+                    "Aucun lot modifié depuis le dernier calcul, les couches sont à jour",
+                    "Enregistrement des empreintes des lots"
+                    ]
+expr_err_txt = "Expression(s) d'export invalide(s) : {0:s}"
+export_incr_msg_txt = "Export incrémental: {0:d} lot(s) à écrire sur {1:d}, les fichiers des autres lots sont conservés"
+parquet_err_txt = "Le format Parquet nécessite la librairie python pyarrow (non installée)"
+alg_group_txt = "Lots de chasse"
+alg_snap_txt = ("Ré-ajustement des lots sur les parcelles",
+                "Ré-ajuste les limites des lots de chasse sur les limites des parcelles proches (tolérance de ré-ajustement).")
+alg_split_txt = ("Découpage des parcelles par lot",
+                    "Découpe les parcelles par les lots ré-ajustés et calcule la surface dessin et la contenance chasse de chaque morceau.")
+alg_calc_txt = ("Lots de chasse calculés",
+                "Crée les lots calculés (union des morceaux de parcelles de chaque lot) avec les totaux par lot.")
+alg_export_txt = ("Export Excel des parcelles par lot",
+                    "Crée le fichier Excel de la liste des parcelles par lot (une feuille par lot).")
+alg_param_txt = {   'PARCELS': "Couche des parcelles",
+                    'LOTS': "Couche zonage des lots",
+                    'SNAPPED': "Lots ré-ajustés",
+                    'PARCLOT': "Parcelles par lot de chasse",
+                    'NWLOTS': "Lots de chasse calculés",
+                    'XLSX': "Fichier d'export",
+                    'LOT_ATTNAME': "Champ contenant le nom des lots",
+                    'DIST_MAX': "Tolérance de ré-ajustement",
+                    'GRID_SIZE': "Grille de précision (0 : aucune)",
+                    'SLIVER_AREA': "Surface minimale des morceaux (0 : aucune)",
+                    'SLIVER_WIDTH': "Largeur moyenne minimale des morceaux (0 : aucune)",
+                    'SLIVER_MERGE': "Fusionner les résidus avec le morceau voisin (sinon supprimés)",
+                    'LARGEST_REM': "Répartition exacte de la contenance (plus forts restes)",
+                    'ATT_EXPORT': "Champs/expressions exportés",
+                    'HD_EXPORT': "En-têtes des colonnes"
+                    }
+alg_fld_err_txt = "Champ(s) absent(s) de la couche : {0:s}"
+batch_err_txt = "Manifeste : commune {0}, paramètre {1:s} manquant"
+batch_dup_txt = "Manifeste : commune {0}, {1:s} déjà utilisé par une autre commune ({2:s})"
+cancel_msg_txt = "Traitement annulé ! Les couches n'ont pas été créées."
 alert_lyr_msg_txt = [   "Problème couche non valide",
                         "L'une des couches <font color=\"firebrick\">{0:s}</font> et <font color=\"firebrick\">{1:s}</font> n'est pas valide<br>Veuillez vérifier que ces 2 couches sont bien présentes dans votre projet et qu'elles sont valides !"
                         ]
@@ -77,8 +118,115 @@ tot_fldname = "total_surface_chasse"
 tot_fldqtype = QVariant.Double
 tot_fldalias = "Total Surface chasse"
 
+# Totals by lot of the calculated lots layer (same order as LotTotal.values())
+lotstat_fldnames = [tot_fldname, "total_surface_geo_chasse", "nb_parcelles_chasse", "min_surface_geo_chasse", "max_surface_geo_chasse"]
+lotstat_fldqtypes = [tot_fldqtype, QVariant.Double, QVariant.Int, QVariant.Double, QVariant.Double]
+lotstat_fldalias = [tot_fldalias, "Total Surface dessin chasse", "Nombre de parcelles chasse", "Surface dessin min parcelle chasse", "Surface dessin max parcelle chasse"]
+
 cat_label = "Lot {0:s}"
 
+# Incremental mode configuration
+fgp_tblname = "empreintes_lots"
+# Parameters whose change implies to recompute all the lots
+incr_conf_keys = ["lot_attname_led", "dist_max_spb", "grid_size_spb", "sliver_area_spb", "sliver_width_spb",
+                    "sliver_merge_chk", "largest_rem_chk", "parclot_lyrname_led", "nwlots_lyrname_led"]
+
+# Snapping engine: max size (map units) of the lot ring chunks used to find the parcels near the lots
+snap_chunk_len = 50
+
+# Cache of the snapped lots (GPKG next to the project GPKG, kept between the runs)
+snapcache_suffix = "_cache"
+snapcache_tblname = "lots_reajustes"
+# Eviction: max days without use, max size of the cached geometries (MB)
+snapcache_max_age = 30
+snapcache_max_size = 200
+
+# SQLite pragmas of the GPKG bulk writing
+gpkg_pragmas = ["synchronous = OFF", "cache_size = -262144", "temp_store = MEMORY"]
+# Suffix of the GPKG written by a full run (renamed at the end of the run)
+gpkg_tmp_suffix = ".tmp"
+
+# Instrumentation of the stages: run log (JSON lines next to the GPKG),
+# 'DEBUG' to send the measures to the QGIS message log (see debug_msg)
+runlog_suffix = "_journal.jsonl"
+instr_debug = 'NODEBUG'
+
+# Proration: number of pieces prorated in one batch
+prorata_batch_size = 5000
+
+# Tiled overlay configuration (worker processes)
+tiles_by_worker = 4
+tiled_min_nbparc = 20000
+# Max number of parcels by tile (more tiles for a large cadastre) and max number of
+# tiles read and waiting by worker process, to bound the memory
+tile_max_nbparc = 10000
+tiles_waiting_by_worker = 2
+
+# Synthetic cadastre (benchmarks): CRS, origin, size of the parcels (m),
+# number of parcels by commune, max move of the vertices of the lots (m)
+synth_crs = "EPSG:2154"
+synth_origin = (1000000, 6800000)
+synth_parc_size = 40
+synth_parc_by_com = 5000
+synth_lot_noise = 1
+synth_parc_lyrname = "Parcelles"
+# Benchmarks: results files (in the output directory)
+bench_json_name = "bench_results.json"
+bench_csv_name = "bench_results.csv"
+
+# Batch (many communes): worker processes of each commune (nb_workers_spb),
+# log of each commune (in its output dir), consolidated report
+batch_nb_workers = 1
+batch_log_name = "journal_batch.log"
+batch_json_name = "batch_report.json"
+batch_csv_name = "batch_report.csv"
+
 # Excel export configuration
 col_delta_w = 5
-tot_label = "Total surface chasse Lot {0:s}"
\ No newline at end of file
+# Parallel export: min number of parcels, max number of lots waiting by worker process
+xl_parallel_min_rows = 20000
+xl_lots_by_worker = 2
+# Number of rows of a sheet measured to set the width of the columns: these rows are kept
+# in memory until the widths are set (0: all the rows, the whole sheet is kept in memory)
+xl_width_sample = 500
+# Named styles of the cells: name -> (background color, bold)
+xl_styles = {   'xl_header': ("bbbbbb", True),
+                'xl_cell': ("ffffff", False),
+                'xl_total': ("bbbbbb", True),
+                'xl_total_val': ("eeeeee", False)
+                }
+# Max number of parcels kept in memory while grouping them by lot (beyond: temporary files)
+export_spill_rows = 200000
+tot_label = "Total surface chasse Lot {0:s}"
+# Export formats: format (export_fmt_cmb) -> extension of the files
+export_fmts = { 'xlsx': ".xlsx",
+                'ods': ".ods",
+                'csv': ".csv",
+                'parquet': ".parquet",
+                'sqlite': ".sqlite"
+                }
+# Formats opened at the end of the export (the others: the folder is opened)
+export_open_fmts = ['xlsx', 'ods', 'csv']
+export_file_filter = "Excel (*.xlsx);;OpenDocument (*.ods);;CSV (*.csv);;Parquet (*.parquet);;SQLite (*.sqlite)"
+# Tabular formats (csv, parquet, sqlite): header of the lot column, rows written by batch, table name
+export_lot_hd = "Lot"
+export_batch_rows = 50000
+export_sqlite_tblname = "parcelles_lots"
+csv_delimiter = ";"
+# Incremental export: manifest of the hashes of the lots
+export_manifest_suffix = "_manifest.json"
+# ODS: width of a character (cm) and fixed parts of the files
+ods_char_width = 0.2
+ods_manifest_xml = (    '<?xml version="1.0" encoding="UTF-8"?>'
+                        '<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" manifest:version="1.2">'
+                        '<manifest:file-entry manifest:full-path="/" manifest:media-type="application/vnd.oasis.opendocument.spreadsheet"/>'
+                        '<manifest:file-entry manifest:full-path="content.xml" manifest:media-type="text/xml"/>'
+                        '</manifest:manifest>'
+                        )
+ods_content_head = (    '<?xml version="1.0" encoding="UTF-8"?>'
+                        '<office:document-content xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+                        'xmlns:style="urn:oasis:names:tc:opendocument:xmlns:style:1.0" '
+                        'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" '
+                        'xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0" '
+                        'xmlns:fo="urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0" office:version="1.2">'
+                        )
\ No newline at end of file
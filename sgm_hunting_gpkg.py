@@ -0,0 +1,196 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        GpkgWriter class
+    * Description:   Bulk writing of the tables of the GPKG
+    *                (one transaction, spatial index built after loading)
+    * Specific lib:  GDAL/OGR python bindings (shipped with QGIS)
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+from qgis.core import QgsWkbTypes, QgsCoordinateReferenceSystem, NULL
+from qgis.PyQt.QtCore import Qt, QVariant, QDate, QDateTime, QTime
+
+from osgeo import gdal, ogr, osr
+
+import os
+
+from .sgm_hunting_globalvars import *
+
+
+# OGR types of the QVariant types (the other types are written as text)
+ogr_fldtypes = {
+                QVariant.String: ogr.OFTString,
+                QVariant.Int: ogr.OFTInteger,
+                QVariant.UInt: ogr.OFTInteger64,
+                QVariant.LongLong: ogr.OFTInteger64,
+                QVariant.ULongLong: ogr.OFTInteger64,
+                QVariant.Double: ogr.OFTReal,
+                QVariant.Bool: ogr.OFTInteger,
+                QVariant.Date: ogr.OFTDate,
+                QVariant.DateTime: ogr.OFTDateTime,
+                QVariant.Time: ogr.OFTTime
+                }
+
+
+def ogr_value(val):
+    '''
+        Returns the value to give to OGR for an attribute value (None for NULL)
+    '''
+    if val is None or val == NULL:
+        return None
+    if isinstance(val, (QDate, QDateTime, QTime)):
+        return val.toString(Qt.ISODate) if val.isValid() else None
+    if isinstance(val, bool):
+        return int(val)
+    if isinstance(val, (int, float, str)):
+        return val
+    return str(val)
+
+
+class GpkgWriter:
+    '''
+        Writes the features in a table of a GPKG with OGR:
+        - the table is created with its final schema (or the features are appended
+          to the existing table: append)
+        - all the features are inserted in one transaction, with the SQLite
+          pragmas of gpkg_pragmas (and without journal in a new file)
+        - the spatial index of a new table is built once all the features are inserted
+        Same use as a QgsVectorFileWriter (addFeature), but close() must be called
+        to commit the features
+    '''
+
+    def __init__(self, gpkg_path, lyr_name, fields, wkb_type, crs, append=False):
+
+        self.lyr_name = lyr_name
+        self.append = append
+        self.error = ''
+        nw_file = not os.path.exists(gpkg_path)
+        if nw_file:
+            self.ds = ogr.GetDriverByName('GPKG').CreateDataSource(gpkg_path)
+        else:
+            self.ds = ogr.Open(gpkg_path, 1)
+        if self.ds is None:
+            raise IOError(gdal.GetLastErrorMsg())
+        pragmas = gpkg_pragmas + (["journal_mode = OFF"] if nw_file else [])
+        for pragma in pragmas:
+            self.exec_sql("PRAGMA " + pragma)
+        if append:
+            self.lyr = self.ds.GetLayerByName(lyr_name)
+            if self.lyr is None:
+                raise IOError(gdal.GetLastErrorMsg())
+        else:
+            self.create_lyr(fields, wkb_type, crs)
+        # Index of each field in the OGR table (-1: field not in the table)
+        lyr_defn = self.lyr.GetLayerDefn()
+        self.fld_ids = [lyr_defn.GetFieldIndex(fld.name()) for fld in fields]
+        self.has_geom = self.lyr.GetGeomType() != ogr.wkbNone
+        if self.ds.StartTransaction() != ogr.OGRERR_NONE:
+            raise IOError(gdal.GetLastErrorMsg())
+
+
+    def exec_sql(self, sql):
+        '''
+            Executes a SQL statement on the GPKG (the result is not used)
+        '''
+        result = self.ds.ExecuteSQL(sql)
+        if result is not None:
+            self.ds.ReleaseResultSet(result)
+
+
+    def create_lyr(self, fields, wkb_type, crs):
+        '''
+            Creates the table (replaces the existing one), without spatial index
+        '''
+        for i in range(self.ds.GetLayerCount()):
+            if self.ds.GetLayer(i).GetName() == self.lyr_name:
+                self.ds.DeleteLayer(i)
+                break
+        srs = None
+        if crs is not None and crs.isValid():
+            srs = osr.SpatialReference()
+            srs.ImportFromWkt(crs.toWkt(QgsCoordinateReferenceSystem.WKT_PREFERRED_GDAL))
+            srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        if wkb_type == QgsWkbTypes.NoGeometry:
+            geom_type = ogr.wkbNone
+        else:
+            geom_type = ogr.GT_SetModifier(QgsWkbTypes.flatType(wkb_type),
+                                            QgsWkbTypes.hasZ(wkb_type),
+                                            QgsWkbTypes.hasM(wkb_type))
+        self.lyr = self.ds.CreateLayer(self.lyr_name, srs, geom_type, ['SPATIAL_INDEX=NO'])
+        if self.lyr is None:
+            raise IOError(gdal.GetLastErrorMsg())
+        for fld in fields:
+            ogr_fld = ogr.FieldDefn(fld.name(), ogr_fldtypes.get(fld.type(), ogr.OFTString))
+            if fld.type() == QVariant.Bool:
+                ogr_fld.SetSubType(ogr.OFSTBoolean)
+            if self.lyr.CreateField(ogr_fld) != ogr.OGRERR_NONE:
+                raise IOError(gdal.GetLastErrorMsg())
+
+
+    def addFeature(self, obj, flags=None):
+        '''
+            Inserts a feature (in the current transaction)
+            Returns False on error (see errorMessage)
+        '''
+        ogr_obj = ogr.Feature(self.lyr.GetLayerDefn())
+        if self.has_geom and obj.hasGeometry():
+            ogr_obj.SetGeometryDirectly(ogr.CreateGeometryFromWkb(bytes(obj.geometry().asWkb())))
+        for fld_id, val in zip(self.fld_ids, obj.attributes()):
+            if fld_id == -1:
+                continue
+            val = ogr_value(val)
+            if val is None:
+                ogr_obj.SetFieldNull(fld_id)
+            else:
+                ogr_obj.SetField(fld_id, val)
+        if self.lyr.CreateFeature(ogr_obj) != ogr.OGRERR_NONE:
+            self.error = gdal.GetLastErrorMsg()
+            return False
+        return True
+
+
+    def errorMessage(self):
+        '''
+            Returns the last error message
+        '''
+        return self.error
+
+
+    def close(self, commit=True):
+        '''
+            Commits the transaction (or rolls it back: commit False),
+            builds the spatial index of a new table and closes the GPKG
+        '''
+        if self.ds is None:
+            return
+        try:
+            if not commit:
+                self.ds.RollbackTransaction()
+                return
+            if self.ds.CommitTransaction() != ogr.OGRERR_NONE:
+                raise IOError(gdal.GetLastErrorMsg())
+            if self.has_geom and not self.append:
+                lyr_name = self.lyr_name.replace("'", "''")
+                geom_col = self.lyr.GetGeometryColumn().replace("'", "''")
+                self.exec_sql(f"SELECT CreateSpatialIndex('{lyr_name}', '{geom_col}')")
+        finally:
+            self.lyr = None
+            # Closes the GPKG
+            self.ds = None
@@ -0,0 +1,131 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        LotBuckets class
+    * Description:   Features of a layer grouped by lot in one scan
+    *                (memory buckets spilled to temporary files when too large)
+    * Specific lib:  none
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+from qgis.core import QgsFeature, QgsFeatureRequest
+
+import os
+import pickle
+import shutil
+import tempfile
+
+from .sgm_hunting_globalvars import *
+from .sgm_hunting_globalfnc import *
+
+
+class LotBuckets:
+    '''
+        Features of a layer grouped by lot value, read in one scan (load)
+        The features stay in memory buckets up to max_rows features; beyond,
+        all the buckets are spilled to temporary files (one file by lot), so
+        the memory used is bounded whatever the size of the layer
+        rows(lot) returns the features of a lot in the order of the scan
+        The geometries are only read if need_geom
+    '''
+
+    def __init__(self, lyr, lot_attname, need_geom=False, max_rows=export_spill_rows):
+
+        self.lyr = lyr
+        self.fields = lyr.fields()
+        self.lot_id = self.fields.indexFromName(lot_attname)
+        self.need_geom = need_geom
+        self.max_rows = max_rows
+        # In memory buckets: lot value -> [QgsFeature, ...]
+        self.buckets = {}
+        self.nb_mem = 0
+        self.nb_rows = 0
+        # Spilled buckets: lot value -> temporary file
+        self.spill_dir = None
+        self.spill_files = {}
+
+
+    def load(self, feedback=None):
+        '''
+            Reads the layer (one scan) and groups its features by lot
+            feedback: object with isCanceled() (None: not cancelable)
+        '''
+        request = QgsFeatureRequest()
+        if not self.need_geom:
+            request.setFlags(QgsFeatureRequest.NoGeometry)
+        for obj in self.lyr.getFeatures(request):
+            if feedback and feedback.isCanceled():
+                return
+            self.buckets.setdefault(obj.attribute(self.lot_id), []).append(obj)
+            self.nb_mem += 1
+            self.nb_rows += 1
+            if self.nb_mem >= self.max_rows:
+                self.spill()
+
+
+    def spill(self):
+        '''
+            Appends the memory buckets to their temporary files and empties them
+        '''
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix='sgm_hunting_')
+        for lot_val, objs in self.buckets.items():
+            path = self.spill_files.get(lot_val)
+            if path is None:
+                path = self.spill_files[lot_val] = os.path.join(self.spill_dir, f"{len(self.spill_files)}.pkl")
+            recs = [([py_val(val) for val in obj.attributes()],
+                        bytes(obj.geometry().asWkb()) if self.need_geom and obj.hasGeometry() else None)
+                    for obj in objs]
+            with open(path, 'ab') as spill_file:
+                pickle.dump(recs, spill_file, pickle.HIGHEST_PROTOCOL)
+        self.buckets = {}
+        self.nb_mem = 0
+
+
+    def rows(self, lot_val):
+        '''
+            Returns the features of a lot (generator): spilled ones first, then the memory ones
+        '''
+        path = self.spill_files.get(lot_val)
+        if path:
+            with open(path, 'rb') as spill_file:
+                while True:
+                    try:
+                        recs = pickle.load(spill_file)
+                    except EOFError:
+                        break
+                    for atts, wkb in recs:
+                        obj = QgsFeature(self.fields)
+                        obj.setAttributes(atts)
+                        if wkb:
+                            obj.setGeometry(geom_from_wkb(wkb))
+                        yield obj
+        for obj in self.buckets.get(lot_val, []):
+            yield obj
+
+
+    def close(self):
+        '''
+            Frees the buckets and deletes the temporary files
+        '''
+        self.buckets = {}
+        self.spill_files = {}
+        if self.spill_dir:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
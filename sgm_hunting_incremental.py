@@ -0,0 +1,190 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        LotFingerprints class
+    * Description:   Fingerprints of the hunting lots, to recompute only the
+    *                lots which have changed since the last run
+    * Specific lib:  none
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+from qgis.core import (QgsFields, QgsField, QgsFeature, QgsFeatureSink, QgsVectorLayer,
+                        QgsRectangle, QgsWkbTypes)
+from qgis.PyQt.QtCore import QVariant
+
+import hashlib
+import json
+import os
+
+from .sgm_hunting_globalvars import *
+from .sgm_hunting_globalfnc import *
+from .sgm_hunting_gpkg import GpkgWriter
+
+
+def lot_fingerprint(lot):
+    '''
+        Returns the fingerprint of a lot feature (hash of its geometry and attributes)
+    '''
+    fgp = hashlib.sha1()
+    fgp.update(bytes(lot.geometry().asWkb()))
+    fgp.update(repr([py_val(v) for v in lot.attributes()]).encode('utf-8'))
+    return fgp.hexdigest()
+
+
+def run_fingerprint(conf, parc_fgp, lot_crs):
+    '''
+        Returns the fingerprint of everything, except the lots, used to calculate the layers:
+        the parameters (incr_conf_keys), the parcel layer (parc_fgp: lyr_fingerprint or
+        src_fingerprint) and the CRS of the lots
+        If it changes, all the lots have to be recomputed
+    '''
+    fgp_items = [conf.get(k) for k in incr_conf_keys]
+    fgp_items += [parc_fgp, lot_crs.authid()]
+    return hashlib.sha1(json.dumps(fgp_items, default=str).encode('utf-8')).hexdigest()
+
+
+class LotFingerprints:
+    '''
+        Fingerprints of the lots: lot fid -> (lot value, fingerprint, bounding box)
+        and fingerprint of the run (run_fingerprint)
+        Stored in a table of the GPKG (fgp_tblname), the run fingerprint
+        is stored in the row whose lot fid is -1
+    '''
+
+    def __init__(self, run_fgp=None):
+        self.run_fgp = run_fgp
+        self.lots = {}
+
+
+    def load_lyr(self, lot_lyr, lot_attname):
+        '''
+            Calculates the fingerprints of the lots of a layer
+            (or of a thread safe source of its features)
+        '''
+        for lot in lot_lyr.getFeatures():
+            if lot.geometry().isNull():
+                continue
+            self.lots[lot.id()] = (lot[lot_attname], lot_fingerprint(lot), lot.geometry().boundingBox())
+
+
+    @staticmethod
+    def fields():
+        '''
+            Returns the fields of the fingerprints table
+        '''
+        flds = QgsFields()
+        flds.append(QgsField("lot_fid", QVariant.LongLong))
+        flds.append(QgsField("lot_val", QVariant.String))
+        flds.append(QgsField("fingerprint", QVariant.String))
+        for n in ["xmin", "ymin", "xmax", "ymax"]:
+            flds.append(QgsField(n, QVariant.Double))
+        return flds
+
+
+    @staticmethod
+    def read(gpkg_path):
+        '''
+            Reads the fingerprints stored in the GPKG
+            Returns None if there are no (valid) fingerprints
+        '''
+        if not os.path.exists(gpkg_path):
+            return None
+        fgp_lyr = QgsVectorLayer(gpkg_path + '|layername=' + fgp_tblname, fgp_tblname, 'ogr')
+        if not fgp_lyr.isValid():
+            return None
+        fgps = LotFingerprints()
+        fgp_idx = index_by_key(fgp_lyr, "lot_fid", ["lot_val", "fingerprint", "xmin", "ymin", "xmax", "ymax"])
+        for lot_fid, atts in fgp_idx.items():
+            if lot_fid == -1:
+                fgps.run_fgp = atts["fingerprint"]
+            else:
+                rect = QgsRectangle(atts["xmin"], atts["ymin"], atts["xmax"], atts["ymax"])
+                fgps.lots[lot_fid] = (atts["lot_val"], atts["fingerprint"], rect)
+        if not fgps.run_fgp:
+            return None
+        return fgps
+
+
+    def write(self, gpkg_path):
+        '''
+            Writes the fingerprints in the GPKG (replaces the existing ones)
+            Without run fingerprint, writes an empty table: invalidates the
+            stored fingerprints (next run will recompute all the lots)
+        '''
+        flds = self.fields()
+        writer = GpkgWriter(gpkg_path, fgp_tblname, flds, QgsWkbTypes.NoGeometry, None)
+        if self.run_fgp:
+            rows = [[-1, None, self.run_fgp, None, None, None, None]]
+            for lot_fid, (lot_val, fgp, rect) in self.lots.items():
+                rows.append([lot_fid, str(lot_val), fgp, rect.xMinimum(), rect.yMinimum(), rect.xMaximum(), rect.yMaximum()])
+            for row in rows:
+                obj = QgsFeature(flds)
+                obj.setAttributes(row)
+                writer.addFeature(obj, QgsFeatureSink.FastInsert)
+        writer.close()
+
+
+    def sharing_lots(self, parc_bboxes):
+        '''
+            Returns the fids of the lots which may share a parcel with others: lots whose
+            extent intersects one of the bounding boxes of these parcels (in the CRS of the lots)
+        '''
+        return {lot_fid for lot_fid, (lot_val, fgp, rect) in self.lots.items()
+                if any(rect.intersects(bbox) for bbox in parc_bboxes)}
+
+
+    def changed_lots(self, old_fgps, near_parcels=None):
+        '''
+            Compares the fingerprints with the previous ones (old_fgps)
+            Returns (recalc_fids, recalc_vals)
+            recalc_fids: fids of the lots to recompute: the changed (or new) lots,
+            their neighbours, the lots which may share a parcel with them and the
+            lots with the same value
+            recalc_vals: values (as text) of the lots whose pieces must be
+            deleted/recomputed (recomputed lots and removed lots)
+            near_parcels: function returning the bounding boxes of the parcels near
+            a list of rectangles (the pieces of a parcel depend on all its lots:
+            merged slivers, largest remainder)
+        '''
+        chg_fids = set()
+        chg_rects = []
+        for lot_fid, (lot_val, fgp, rect) in self.lots.items():
+            old_lot = old_fgps.lots.get(lot_fid)
+            if old_lot is None or old_lot[1] != fgp:
+                chg_fids.add(lot_fid)
+                chg_rects.append(rect)
+                if old_lot:
+                    chg_rects.append(old_lot[2])
+        del_fids = [lot_fid for lot_fid in old_fgps.lots if lot_fid not in self.lots]
+        chg_rects += [old_fgps.lots[lot_fid][2] for lot_fid in del_fids]
+        # Adds the neighbours of the changed lots (the old and the new extents)
+        recalc_fids = set(chg_fids)
+        for lot_fid, (lot_val, fgp, rect) in self.lots.items():
+            if any(rect.intersects(chg_rect) for chg_rect in chg_rects):
+                recalc_fids.add(lot_fid)
+        # Adds the lots sharing a parcel with a changed lot (old and new extents)
+        if near_parcels and chg_rects:
+            recalc_fids |= self.sharing_lots(near_parcels(chg_rects))
+        # Values to recompute (as text): new and old values of the recomputed lots, values of removed lots
+        recalc_vals = {str(self.lots[lot_fid][0]) for lot_fid in recalc_fids}
+        recalc_vals |= {str(old_fgps.lots[lot_fid][0]) for lot_fid in del_fids}
+        recalc_vals |= {str(old_fgps.lots[lot_fid][0]) for lot_fid in recalc_fids if lot_fid in old_fgps.lots}
+        # All the lots having a recomputed value are recomputed
+        recalc_fids |= {lot_fid for lot_fid, lot in self.lots.items() if str(lot[0]) in recalc_vals}
+        return recalc_fids, recalc_vals
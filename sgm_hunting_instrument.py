@@ -0,0 +1,198 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        RunLog, StageSpan classes
+    * Description:   Instrumentation of the stages of the jobs
+    *                (times, memory, number of features, run log)
+    * Specific lib:  none
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+import configparser
+import datetime
+import json
+import os
+import sys
+import time
+
+from .sgm_hunting_globalvars import *
+from .sgm_hunting_globalfnc import *
+
+
+def peak_rss():
+    '''
+        Returns the peak resident memory of the process (MB), None if unknown
+    '''
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD),
+                        ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t),
+                        ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t),
+                        ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        proc = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(proc, ctypes.byref(counters), counters.cb):
+            return None
+        return counters.PeakWorkingSetSize / 1048576
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, in KB elsewhere
+    return max_rss / 1048576 if sys.platform == 'darwin' else max_rss / 1024
+
+
+def plugin_version():
+    '''
+        Returns the version of the plugin (metadata.txt)
+    '''
+    metadata = configparser.ConfigParser(interpolation=None)
+    metadata.read(os.path.join(os.path.dirname(__file__), 'metadata.txt'), encoding='utf-8')
+    return metadata.get('general', 'version', fallback='')
+
+
+class StageSpan:
+    '''
+        Measures a stage (context manager): wall time, CPU time of the process,
+        increase of the peak resident memory and numbers of features in and out
+        (set by the stage with set_counts)
+        The measures are added to the run log when the stage ends
+    '''
+
+    def __init__(self, run_log, stage):
+
+        self.run_log = run_log
+        self.stage = stage
+        self.nb_in = None
+        self.nb_out = None
+        self.status = 'ok'
+
+
+    def set_counts(self, nb_in=None, nb_out=None):
+        '''
+            Sets the numbers of features read and written by the stage
+        '''
+        if nb_in is not None:
+            self.nb_in = nb_in
+        if nb_out is not None:
+            self.nb_out = nb_out
+
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.rss = peak_rss()
+        return self
+
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.status = 'error'
+        rss = peak_rss()
+        self.run_log.add({
+                            'stage': self.stage,
+                            'status': self.status,
+                            'wall_s': round(time.perf_counter() - self.wall, 3),
+                            'cpu_s': round(time.process_time() - self.cpu, 3),
+                            'peak_rss_delta_mb': None if rss is None or self.rss is None else round(rss - self.rss, 1),
+                            'nb_in': self.nb_in,
+                            'nb_out': self.nb_out
+                            })
+        # The exceptions are not handled here
+        return False
+
+
+class RunLog:
+    '''
+        Measures of the stages of a run (pipeline: name of the job)
+        Each measure is sent to the messages (send_msg function) and to the
+        QGIS message log if debug_on_off is 'DEBUG' (see debug_msg)
+        The run is appended as one JSON line to the run log file (write)
+    '''
+
+    def __init__(self, pipeline, log_path, send_msg=None, debug_on_off=instr_debug):
+
+        self.pipeline = pipeline
+        self.log_path = log_path
+        self.send_msg = send_msg
+        self.debug_on_off = debug_on_off
+        self.start = datetime.datetime.now()
+        self.spans = []
+
+
+    def span(self, stage):
+        '''
+            Returns the span measuring a stage
+        '''
+        return StageSpan(self, stage)
+
+
+    def add(self, span):
+        '''
+            Adds the measures of a stage
+        '''
+        self.spans.append(span)
+        if self.send_msg:
+            self.send_msg(self.span_txt(span))
+        debug_msg(self.debug_on_off, "%s: %s", (self.pipeline, json.dumps(span)))
+
+
+    @staticmethod
+    def span_txt(span):
+        '''
+            Returns the text of the measures of a stage
+        '''
+        rss = span['peak_rss_delta_mb']
+        return instr_msg_txt.format(span['stage'],
+                                    span['wall_s'],
+                                    span['cpu_s'],
+                                    '?' if rss is None else f"{rss:.1f}",
+                                    '-' if span['nb_in'] is None else span['nb_in'],
+                                    '-' if span['nb_out'] is None else span['nb_out'])
+
+
+    def write(self, **run_info):
+        '''
+            Appends the run (run_info and the measures of the stages) to the run log file
+            Never raises: the run log must not break the job
+        '''
+        run = { 'pipeline': self.pipeline,
+                'version': plugin_version(),
+                'start': self.start.isoformat(timespec='seconds'),
+                'wall_s': round(sum(span['wall_s'] for span in self.spans), 3)
+                }
+        run.update(run_info)
+        run['stages'] = self.spans
+        try:
+            with open(self.log_path, 'a', encoding='utf-8') as log_file:
+                log_file.write(json.dumps(run, ensure_ascii=False, default=str) + '\n')
+        except OSError as e:
+            debug_msg(self.debug_on_off, "%s: %s", (self.pipeline, str(e)))
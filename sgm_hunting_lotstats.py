@@ -0,0 +1,134 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        LotAggregate class
+    * Description:   Totals by hunting lot, accumulated while the parcel
+    *                pieces are written
+    * Specific lib:  none
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+from qgis.core import QgsFields, QgsField
+
+import locale
+
+from .sgm_hunting_globalvars import *
+from .sgm_hunting_globalfnc import *
+
+
+class LotTotal:
+    '''
+        Totals of one lot
+        cont: sum of the contenance_chasse of the pieces
+        surf: sum of the surface_geo_chasse of the pieces
+        nb_parc: number of pieces (parcels or parts of parcels)
+        min_surf, max_surf: surface_geo_chasse of the smallest and largest pieces
+    '''
+
+    __slots__ = ('cont', 'surf', 'nb_parc', 'min_surf', 'max_surf')
+
+    def __init__(self):
+        self.cont = 0
+        self.surf = 0
+        self.nb_parc = 0
+        self.min_surf = None
+        self.max_surf = None
+
+
+    def add(self, surf, cont):
+        '''
+            Adds a piece to the totals
+        '''
+        self.cont += cont
+        self.surf += surf
+        self.nb_parc += 1
+        if self.min_surf is None or surf < self.min_surf:
+            self.min_surf = surf
+        if self.max_surf is None or surf > self.max_surf:
+            self.max_surf = surf
+
+
+    def values(self):
+        '''
+            Returns the totals in the order of the lotstat_fldnames fields
+        '''
+        return [self.cont, self.surf, self.nb_parc, self.min_surf, self.max_surf]
+
+
+class LotAggregate:
+    '''
+        Totals by lot (LotTotal by lot value)
+        Filled while the pieces are written (add) or read from the
+        calculated lots layer (from_lyr), used to fill the calculated lots
+        layer and the total rows of the Excel export
+    '''
+
+    def __init__(self):
+        self.lots = {}
+
+
+    def add(self, lot_val, surf, cont):
+        '''
+            Adds a piece to the totals of its lot
+        '''
+        lot_tot = self.lots.get(lot_val)
+        if lot_tot is None:
+            lot_tot = self.lots[lot_val] = LotTotal()
+        lot_tot.add(surf, cont)
+
+
+    def get(self, lot_val):
+        '''
+            Returns the LotTotal of a lot (empty totals if the lot is unknown)
+        '''
+        return self.lots.get(lot_val, LotTotal())
+
+
+    def lot_values(self):
+        '''
+            Returns the sorted list of the lots
+        '''
+        return sorted(self.lots, key=lambda v: locale.strxfrm(str(v)))
+
+
+    @staticmethod
+    def fields():
+        '''
+            Returns the QgsFields of the totals (calculated lots layer)
+        '''
+        flds = QgsFields()
+        for i, n in enumerate(lotstat_fldnames):
+            flds.append(QgsField(n, lotstat_fldqtypes[i]))
+        return flds
+
+
+    @staticmethod
+    def from_lyr(lyr, lot_attname):
+        '''
+            Returns the LotAggregate read from a calculated lots layer
+            (index of the totals by lot: index_by_key)
+            The totals fields missing in the layer (old layers) stay empty
+        '''
+        lot_agg = LotAggregate()
+        for lot_val, atts in index_by_key(lyr, lot_attname, lotstat_fldnames).items():
+            lot_tot = lot_agg.lots[lot_val] = LotTotal()
+            for slot, fld_name in zip(LotTotal.__slots__, lotstat_fldnames):
+                if fld_name in atts:
+                    setattr(lot_tot, slot, atts[fld_name])
+        return lot_agg
@@ -0,0 +1,74 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        LotPieces class
+    * Description:   Union of the parcel pieces by hunting lot
+    *                (calculated lots layer, without native:dissolve)
+    * Specific lib:  none
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+from qgis.core import QgsGeometry, QgsGeometryParameters, QgsFeatureRequest
+
+import locale
+
+from .sgm_hunting_globalvars import *
+from .sgm_hunting_globalfnc import *
+
+
+def union_pieces(wkbs, grid_size=0):
+    '''
+        Returns the union (WKB of a multipolygon) of the pieces of a lot
+        (run in the calling thread or in a worker process: only WKB here)
+        The union is a cascaded union (GEOS unary union) on the precision grid (grid_size)
+    '''
+    params = QgsGeometryParameters()
+    if grid_size > 0:
+        params.setGridSize(grid_size)
+    geom = QgsGeometry.unaryUnion([geom_from_wkb(wkb) for wkb in wkbs], params)
+    geom.convertToMultiType()
+    return bytes(geom.asWkb())
+
+
+class LotPieces:
+    '''
+        Geometries (WKB) of the parcel pieces grouped by lot: lot value -> [WKB, ...]
+        Read from the parcels by lot layer in one scan, with the lot field only
+    '''
+
+    def __init__(self):
+        self.lots = {}
+
+
+    def load_lyr(self, lyr, lot_attname):
+        '''
+            Groups the pieces of a layer by lot (the subset string of the layer is used)
+        '''
+        request = QgsFeatureRequest()
+        request.setSubsetOfAttributes([lot_attname], lyr.fields())
+        for obj in lyr.getFeatures(request):
+            if obj.hasGeometry():
+                self.lots.setdefault(obj[lot_attname], []).append(bytes(obj.geometry().asWkb()))
+
+
+    def lot_values(self):
+        '''
+            Returns the sorted list of the lots
+        '''
+        return sorted(self.lots, key=lambda v: locale.strxfrm(str(v)))
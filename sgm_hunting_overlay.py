@@ -0,0 +1,252 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        LotOverlay class
+    * Description:   Overlay engine splitting the parcels by the hunting lots
+    *                (in the calling thread or by tiles in worker processes)
+    * Specific lib:  none
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+from qgis.core import (QgsGeometry, QgsSpatialIndex, QgsFeatureRequest, QgsRectangle,
+                        QgsCoordinateTransform, QgsWkbTypes, QgsGeometryParameters)
+
+import math
+
+from .sgm_hunting_globalvars import *
+from .sgm_hunting_globalfnc import *
+from .sgm_hunting_prorata import prorate_batch
+
+
+class LotOverlay:
+    '''
+        Splits the parcels by the hunting lots (same result as native:intersection)
+        - parcels outside every lot are rejected by the spatial index (bounding box)
+        - parcels fully contained in a lot are copied without intersection
+          (containment test with the prepared geometry of the lot)
+        - only the parcels on the boundary of a lot are really intersected,
+          on a precision grid (grid_size, 0: full precision)
+        - the slivers (pieces of an intersected parcel smaller than sliver_area
+          or thinner than sliver_width) are dropped, or merged into the largest
+          piece of their parcel (sliver_merge)
+        The lots are loaded from a layer (load_lyr) or one by one (add_lot)
+    '''
+
+    def __init__(self, grid_size=0, sliver_area=0, sliver_width=0, sliver_merge=False):
+
+        self.grid_size = grid_size
+        self.sliver_area = sliver_area
+        self.sliver_width = sliver_width
+        self.sliver_merge = sliver_merge
+        self.geom_params = QgsGeometryParameters()
+        if grid_size > 0:
+            self.geom_params.setGridSize(grid_size)
+        self.sp_idx = QgsSpatialIndex()
+        # Lot geometry, prepared geometry engine and lot value by lot id
+        self.lots = {}
+        self.extent = QgsRectangle()
+        self.extent.setMinimal()
+        self.nb_contained = 0
+        self.nb_intersected = 0
+        self.nb_sliv_dropped = 0
+        self.nb_sliv_merged = 0
+
+
+    def params(self):
+        '''
+            Returns the parameters of the overlay (to create the same overlay in a worker process)
+        '''
+        return (self.grid_size, self.sliver_area, self.sliver_width, self.sliver_merge)
+
+
+    def load_lyr(self, lot_lyr, lot_attname, dest_crs, transform_ctx):
+        '''
+            Loads the lots of a layer
+            The lots are transformed to the CRS of the parcels (dest_crs) if necessary
+        '''
+        xform = None
+        if lot_lyr.crs() != dest_crs:
+            xform = QgsCoordinateTransform(lot_lyr.crs(), dest_crs, transform_ctx)
+        request = QgsFeatureRequest()
+        request.setSubsetOfAttributes([lot_attname], lot_lyr.fields())
+        request.setInvalidGeometryCheck(QgsFeatureRequest.GeometrySkipInvalid)
+        for lot in lot_lyr.getFeatures(request):
+            geom = QgsGeometry(lot.geometry())
+            if geom.isNull() or geom.isEmpty():
+                continue
+            if xform:
+                geom.transform(xform)
+            self.add_lot(lot.id(), geom, lot[lot_attname])
+
+
+    def add_lot(self, lot_id, geom, lot_val):
+        '''
+            Adds a lot to the overlay (prepares its geometry)
+        '''
+        engine = QgsGeometry.createGeometryEngine(geom.constGet())
+        engine.prepareGeometry()
+        self.lots[lot_id] = (geom, engine, lot_val)
+        self.sp_idx.addFeature(lot_id, geom.boundingBox())
+        self.extent.combineExtentWith(geom.boundingBox())
+
+
+    def lots_to_wkb(self, rect):
+        '''
+            Returns the lots intersecting rect, serialized for a worker process:
+            [(lot id, lot WKB, lot value), ...]
+        '''
+        return [(lot_id, bytes(self.lots[lot_id][0].asWkb()), self.lots[lot_id][2])
+                for lot_id in sorted(self.sp_idx.intersects(rect))]
+
+
+    def split(self, parc_geom):
+        '''
+            Returns the list of the pieces of a parcel geometry: [(piece geometry, lot value), ...]
+            The pieces are multipolygons (as native:intersection output)
+        '''
+        pieces = []
+        if parc_geom.isNull() or parc_geom.isEmpty():
+            return pieces
+        parc_ageom = parc_geom.constGet()
+        # Pieces produced by a real intersection (the only possible slivers)
+        cut_ids = []
+        for lot_id in self.sp_idx.intersects(parc_geom.boundingBox()):
+            lot_geom, engine, lot_val = self.lots[lot_id]
+            # Parcel inside the lot: copied unchanged
+            if engine.contains(parc_ageom):
+                nw_geom = QgsGeometry(parc_geom)
+                self.nb_contained += 1
+            # Parcel on the boundary of the lot: real intersection (on the precision grid)
+            elif engine.intersects(parc_ageom):
+                nw_geom = parc_geom.intersection(lot_geom, self.geom_params)
+                # Keeps only the polygonal part of the intersection
+                if QgsWkbTypes.flatType(nw_geom.wkbType()) == QgsWkbTypes.GeometryCollection:
+                    nw_geom = nw_geom.convertGeometryCollectionToSubclass(QgsWkbTypes.PolygonGeometry)
+                if nw_geom.isNull() or nw_geom.isEmpty() or nw_geom.type() != QgsWkbTypes.PolygonGeometry:
+                    continue
+                self.nb_intersected += 1
+                cut_ids.append(len(pieces))
+            else:
+                continue
+            nw_geom.convertToMultiType()
+            pieces.append((nw_geom, lot_val))
+        if cut_ids and (self.sliver_area > 0 or self.sliver_width > 0):
+            pieces = self.remove_slivers(pieces, cut_ids)
+        return pieces
+
+
+    def is_sliver(self, geom):
+        '''
+            Returns True if a piece is a sliver: area lower than sliver_area
+            or mean width (2 x area / perimeter) lower than sliver_width
+        '''
+        area = geom.area()
+        if area < self.sliver_area:
+            return True
+        if self.sliver_width > 0:
+            perimeter = geom.length()
+            return perimeter > 0 and 2 * area / perimeter < self.sliver_width
+        return False
+
+
+    def remove_slivers(self, pieces, cut_ids):
+        '''
+            Drops the slivers of the pieces of a parcel, or merges them into
+            the largest other piece of the parcel (sliver_merge)
+        '''
+        sliv_ids = {i for i in cut_ids if self.is_sliver(pieces[i][0])}
+        if not sliv_ids:
+            return pieces
+        kept = [piece for i, piece in enumerate(pieces) if i not in sliv_ids]
+        if self.sliver_merge and kept:
+            big_id = max(range(len(kept)), key=lambda i: kept[i][0].area())
+            big_geom, big_val = kept[big_id]
+            for i in sliv_ids:
+                big_geom = big_geom.combine(pieces[i][0], self.geom_params)
+            big_geom.convertToMultiType()
+            kept[big_id] = (big_geom, big_val)
+            self.nb_sliv_merged += len(sliv_ids)
+        else:
+            self.nb_sliv_dropped += len(sliv_ids)
+        return kept
+
+
+class TileGrid:
+    '''
+        Regular grid of about nb_tiles tiles covering an extent
+        A parcel belongs to the tile containing the center of its bounding box,
+        so each parcel is in one tile only
+    '''
+
+    def __init__(self, extent, nb_tiles):
+
+        self.extent = extent
+        width = max(extent.width(), 1)
+        height = max(extent.height(), 1)
+        self.nb_col = max(1, round(math.sqrt(nb_tiles * width / height)))
+        self.nb_row = max(1, math.ceil(nb_tiles / self.nb_col))
+        self.tile_w = width / self.nb_col
+        self.tile_h = height / self.nb_row
+
+
+    def tile_id(self, bbox):
+        '''
+            Returns the id of the tile of a bounding box
+        '''
+        center = bbox.center()
+        col = int((center.x() - self.extent.xMinimum()) // self.tile_w)
+        row = int((center.y() - self.extent.yMinimum()) // self.tile_h)
+        col = min(max(col, 0), self.nb_col - 1)
+        row = min(max(row, 0), self.nb_row - 1)
+        return row * self.nb_col + col
+
+
+def split_tile(lots, parcs, overlay_params, largest_rem=False):
+    '''
+        Splits and prorates the parcels of a tile (run in a worker process:
+        only WKB and python values here, no QGIS layer)
+        lots: list of (lot id, lot WKB, lot value)
+        parcs: list of (parcel WKB, surface_geo, contenance)
+        overlay_params: parameters of the overlay (LotOverlay.params)
+        largest_rem: largest remainder option of prorate_batch
+        Returns (pieces, nb_dropped, nb_sliv_dropped, nb_sliv_merged)
+        pieces: list of (parcel index in parcs, piece WKB, lot value, surf, cont)
+        nb_dropped: number of 0 m² pieces eliminated
+        nb_sliv_dropped, nb_sliv_merged: number of slivers dropped or merged
+    '''
+    overlay = LotOverlay(*overlay_params)
+    for lot_id, lot_wkb, lot_val in lots:
+        overlay.add_lot(lot_id, geom_from_wkb(lot_wkb), lot_val)
+    all_pieces = []
+    for parc_id, (parc_wkb, psurf, pcont) in enumerate(parcs):
+        for piece_geom, lot_val in overlay.split(geom_from_wkb(parc_wkb)):
+            all_pieces.append((parc_id, piece_geom, lot_val))
+    if not all_pieces:
+        return [], 0, overlay.nb_sliv_dropped, overlay.nb_sliv_merged
+    parc_ids = [parc_id for parc_id, piece_geom, lot_val in all_pieces]
+    surfs, conts, keep = prorate_batch( [piece_geom.area() for parc_id, piece_geom, lot_val in all_pieces],
+                                        [parcs[parc_id][1] for parc_id in parc_ids],
+                                        [parcs[parc_id][2] for parc_id in parc_ids],
+                                        parc_ids,
+                                        largest_rem
+                                        )
+    # Eliminates 0 m² parcels
+    pieces = [(parc_id, bytes(piece_geom.asWkb()), lot_val, float(surfs[i]), float(conts[i]))
+                for i, (parc_id, piece_geom, lot_val) in enumerate(all_pieces) if keep[i]]
+    return pieces, len(all_pieces) - len(pieces), overlay.nb_sliv_dropped, overlay.nb_sliv_merged
@@ -0,0 +1,544 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        ParcLotJob class
+    * Description:   Class to do the job for creating new layers to manage
+    *                hunting lots, independently from the GUI
+    * Specific lib:  none
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+from qgis.core import (QgsProcessingContext, QgsProcessingMultiStepFeedback,
+                        QgsFeatureRequest, QgsVectorLayer, QgsCoordinateTransform,
+                        QgsVectorLayerFeatureSource, QgsWkbTypes, QgsRectangle, QgsFeature, QgsFeatureSink,
+                        QgsMemoryProviderUtils, QgsGeometry)
+
+from concurrent.futures import ProcessPoolExecutor, wait
+
+import math
+import os
+
+from .sgm_hunting_globalvars import *
+from .sgm_hunting_globalfnc import *
+from .sgm_hunting_prorata import ParcLotSink
+from .sgm_hunting_overlay import LotOverlay, TileGrid, split_tile
+from .sgm_hunting_lotstats import LotAggregate
+from .sgm_hunting_incremental import LotFingerprints, run_fingerprint
+from .sgm_hunting_snap import LotSnapper, SnapCache
+from .sgm_hunting_gpkg import GpkgWriter
+from .sgm_hunting_lotunion import LotPieces, union_pieces
+from .sgm_hunting_instrument import RunLog
+
+
+class ParcLotJob:
+    '''
+        Creates the parcels by lot and the calculated lots layers in the GPKG
+        Does not use iface nor the project, so it can run in a background task:
+        the layers are added to the project by the caller once the job is done
+        The layers given are only read in __init__ (calling thread): the job then
+        uses thread safe sources of their features and the properties read there
+    '''
+
+    def __init__(self, parc_lyr, lot_lyr, gpkg_path, conf, feedback):
+
+        # Thread safe sources of the parcels and of the lots (created in the calling thread)
+        self.parc_src = QgsVectorLayerFeatureSource(parc_lyr)
+        self.lot_src = QgsVectorLayerFeatureSource(lot_lyr)
+        # Properties of the layers, read in the calling thread
+        self.parc_name = parc_lyr.name()
+        self.parc_source = parc_lyr.source()
+        self.parc_crs = parc_lyr.crs()
+        self.parc_flds = parc_lyr.fields()
+        self.parc_wkb_type = parc_lyr.wkbType()
+        self.nb_parc = parc_lyr.featureCount()
+        # Fingerprint of the parcels (None if not a file: calculated from their content in check_lots)
+        self.parc_fgp = lyr_fingerprint(parc_lyr)
+        self.lot_crs = lot_lyr.crs()
+        self.lot_flds = lot_lyr.fields()
+        self.lot_wkb_type = lot_lyr.wkbType()
+        self.gpkg_path = gpkg_path
+        # GPKG written by the stages: a temporary file in a full run (renamed at the end
+        # of the run, so the GPKG is never half written), the GPKG itself in incremental mode
+        self.out_path = gpkg_path
+        # GPKG of the snapped lots cache (not deleted by a full run)
+        self.snapcache_path = os.path.splitext(gpkg_path)[0] + snapcache_suffix + '.gpkg'
+        self.feedback = feedback
+        self.conf = conf
+        for k, v in conf.items():
+            self.__dict__[k[:-4]] = v
+        self.lot_fld = self.lot_flds.at(self.lot_flds.indexFromName(self.lot_attname))
+        # Stages of the job (in order)
+        self.stages = [ self.check_lots,
+                        self.snap_lots,
+                        self.cre_parclot,
+                        self.cre_nwlots,
+                        self.save_lots
+                        ]
+        # Uris of the new layers
+        self.parclot_uri = self.gpkg_path + '|layername=' + self.parclot_lyrname
+        self.nwlots_uri = self.gpkg_path + '|layername=' + self.nwlots_lyrname
+        # Lots to recompute (None: all the lots, see check_lots) and lots sharing
+        # a parcel with them (only used to split these parcels)
+        self.recalc_fids = None
+        self.recalc_vals = None
+        self.ctx_fids = set()
+        self.up_to_date = False
+        # Measures of the stages (run log next to the GPKG)
+        self.run_log = RunLog('PrepaParcLot', os.path.splitext(gpkg_path)[0] + runlog_suffix, self.send_msg)
+        self.span = None
+
+
+    def run(self):
+        '''
+            Runs all the stages, checking the cancellation between each of them
+            Each stage is measured (run_log)
+            Returns True if the job is complete, False if it has been canceled
+        '''
+        self.context = QgsProcessingContext()
+        self.context.setInvalidGeometryCheck(QgsFeatureRequest.GeometrySkipInvalid)
+        self.ms_feedback = QgsProcessingMultiStepFeedback(len(self.stages), self.feedback)
+        status = 'error'
+        try:
+            for stg_id, stage in enumerate(self.stages):
+                if self.feedback.isCanceled():
+                    break
+                self.ms_feedback.setCurrentStep(stg_id)
+                with self.run_log.span(stage.__name__) as self.span:
+                    stage()
+                    if self.feedback.isCanceled():
+                        self.span.status = 'canceled'
+                # Nothing has changed since the last run (incremental mode)
+                if self.up_to_date:
+                    break
+            if self.feedback.isCanceled():
+                status = 'canceled'
+                return False
+            # Replaces the GPKG by the new one (atomic)
+            if self.out_path != self.gpkg_path:
+                os.replace(self.out_path, self.gpkg_path)
+            status = 'ok'
+            return True
+        finally:
+            # A canceled or failed full run leaves the previous GPKG unchanged
+            if self.out_path != self.gpkg_path and os.path.exists(self.out_path):
+                os.remove(self.out_path)
+            self.run_log.write( status=status,
+                                gpkg=self.gpkg_path,
+                                parc_lyr=self.parc_name,
+                                parc_src=self.parc_source,
+                                nb_parc=self.nb_parc,
+                                nb_workers=get_nb_workers(self.nb_workers),
+                                incremental=self.recalc_fids is not None
+                                )
+
+
+    def set_counts(self, nb_in=None, nb_out=None):
+        '''
+            Sets the numbers of features read and written by the current stage
+        '''
+        if self.span is not None:
+            self.span.set_counts(nb_in, nb_out)
+
+
+    def out_uri(self, lyr_name):
+        '''
+            Returns the uri of a table of the GPKG being written
+        '''
+        return self.out_path + '|layername=' + lyr_name
+
+
+    def check_lots(self):
+        '''
+            Calculates the fingerprints of the lots
+            In incremental mode, compares them with the fingerprints stored in the GPKG
+            to find the lots to recompute (only if the parameters and the parcels are unchanged)
+            The parcels not in a file (database, memory layer) are fingerprinted from
+            their content, their changes can not be seen from their source
+        '''
+        self.send_msg(incr_msg_txt[0])
+        if self.parc_fgp is None:
+            self.parc_fgp = src_fingerprint(self.parc_src)
+        self.lot_fgps = LotFingerprints(run_fingerprint(self.conf, self.parc_fgp, self.lot_crs))
+        self.lot_fgps.load_lyr(self.lot_src, self.lot_attname)
+        self.set_counts(len(self.lot_fgps.lots), len(self.lot_fgps.lots))
+        if not self.incremental:
+            return
+        old_fgps = LotFingerprints.read(self.gpkg_path)
+        if old_fgps is None or old_fgps.run_fgp != self.lot_fgps.run_fgp:
+            return
+        # The 2 tables must exist to be patched
+        for lyr_uri in [self.parclot_uri, self.nwlots_uri]:
+            if not QgsVectorLayer(lyr_uri, 'chk', 'ogr').isValid():
+                return
+        self.recalc_fids, self.recalc_vals = self.lot_fgps.changed_lots(old_fgps, self.near_parcels)
+        # The pieces of a parcel depend on all its lots: the other lots of the parcels
+        # of the recomputed lots are also loaded in the overlay, but not written
+        recalc_rects = [self.lot_fgps.lots[lot_fid][2] for lot_fid in self.recalc_fids]
+        self.ctx_fids = self.lot_fgps.sharing_lots(self.near_parcels(recalc_rects)) - self.recalc_fids
+        self.set_counts(nb_out=len(self.recalc_fids))
+        if not self.recalc_fids and not self.recalc_vals:
+            self.send_msg(incr_msg_txt[2])
+            self.up_to_date = True
+        else:
+            self.send_msg(incr_msg_txt[1].format(len(self.recalc_fids), len(self.lot_fgps.lots)))
+            # Invalidates the stored fingerprints while the tables are patched
+            # (a canceled or failed run will recompute all the lots next time)
+            LotFingerprints().write(self.gpkg_path)
+
+
+    def near_parcels(self, rects):
+        '''
+            Returns the bounding boxes (in the CRS of the lots) of the parcels near
+            rectangles of the lots, buffered by the snapping tolerance
+        '''
+        xform = None
+        if self.parc_crs != self.lot_crs:
+            xform = QgsCoordinateTransform(self.lot_crs, self.parc_crs, self.context.transformContext())
+        margin = max(self.dist_max, 0)
+        bboxes = []
+        for rect in rects:
+            rect = rect.buffered(margin)
+            if xform:
+                rect = xform.transformBoundingBox(rect)
+            request = QgsFeatureRequest(rect)
+            request.setNoAttributes()
+            for parc in self.parc_src.getFeatures(request):
+                if not parc.hasGeometry():
+                    continue
+                bbox = parc.geometry().boundingBox()
+                if xform:
+                    bbox = xform.transformBoundingBox(bbox, QgsCoordinateTransform.ReverseTransform)
+                bboxes.append(bbox.buffered(margin))
+        return bboxes
+
+
+    def snap_lots(self):
+        '''
+            If necessary, creates new snapping Lots on Parcelles layer
+            In incremental mode, only the lots to recompute (and the lots sharing
+            a parcel with them) are used
+            The snapped lots are read from the cache when the lot geometry, the parcels
+            and the tolerance are unchanged: only the other lots are snapped (LotSnapper)
+            The lots (snapped or not) are copied in a memory layer of the job (lotaccr_lyr)
+        '''
+        self.send_msg(crelyr_msg_txt[0])
+        request = QgsFeatureRequest()
+        if self.recalc_fids is not None:
+            request.setFilterFids(list(self.recalc_fids | self.ctx_fids))
+        lot_objs = [lot for lot in self.lot_src.getFeatures(request) if not lot.geometry().isNull()]
+        if self.dist_max <= 0:
+            self.add_lotaccr([(lot, lot.geometry()) for lot in lot_objs])
+            self.set_counts(len(lot_objs), len(lot_objs))
+            return
+        cache = SnapCache(self.snapcache_path, self.parc_fgp, self.dist_max, self.lot_crs)
+        lots = [(lot, cache.key(lot.geometry())) for lot in lot_objs]
+        snap_geoms = cache.get([k for lot, k in lots])
+        miss_lots = [(lot, k) for lot, k in lots if k not in snap_geoms]
+        # Snaps the lots not found in the cache (only the parcels near these lots are loaded)
+        nw_geoms = {}
+        if miss_lots:
+            snapper = LotSnapper(self.parc_src, self.parc_crs, self.lot_crs, self.dist_max,
+                                    self.context.transformContext())
+            snapper.load_ref([lot.geometry() for lot, k in miss_lots])
+            for lot_id, (lot, k) in enumerate(miss_lots):
+                if self.feedback.isCanceled():
+                    return
+                nw_geoms[k] = snapper.snap(lot.geometry())
+                self.set_progress(lot_id, len(miss_lots))
+            cache.put(nw_geoms)
+        nb_evicted = cache.evict()
+        snap_geoms.update(nw_geoms)
+        self.send_msg(snapcache_msg_txt.format(len(lots) - len(miss_lots), len(miss_lots), nb_evicted))
+        # Snapped lots layer (cached and new geometries, lot attributes)
+        nb_out = self.add_lotaccr([(lot, snap_geoms[k]) for lot, k in lots if k in snap_geoms])
+        self.set_counts(len(lots), nb_out)
+
+
+    def add_lotaccr(self, lot_geoms):
+        '''
+            Creates the memory layer of the lots used by the overlay (lotaccr_lyr)
+            lot_geoms: [(lot feature, geometry), ...]
+            Returns the number of lots
+        '''
+        self.lotaccr_lyr = QgsMemoryProviderUtils.createMemoryLayer('lots', self.lot_flds,
+                                                                    QgsWkbTypes.multiType(self.lot_wkb_type),
+                                                                    self.lot_crs)
+        lot_objs = []
+        for lot, geom in lot_geoms:
+            geom = QgsGeometry(geom)
+            geom.convertToMultiType()
+            obj = QgsFeature(lot)
+            obj.setGeometry(geom)
+            lot_objs.append(obj)
+        self.lotaccr_lyr.dataProvider().addFeatures(lot_objs)
+        return len(lot_objs)
+
+
+    def cre_parclot(self):
+        '''
+            Creates new parclot intersection layer
+            The parcels are split by the lots with the overlay engine and the pieces
+            are streamed in the GPKG table: the 2 surface fields are calculated
+            and the 0 m² pieces eliminated while writing
+            The slivers are eliminated by the overlay, before the calculation of the fields
+            In incremental mode, only the pieces of the recomputed lots are written
+        '''
+        self.send_msg(crelyr_msg_txt[1].format(self.parclot_lyrname))
+        if self.recalc_fids is None:
+            # Full run: writes a new GPKG in a temporary file
+            self.out_path = os.path.splitext(self.gpkg_path)[0] + gpkg_tmp_suffix + '.gpkg'
+            if os.path.exists(self.out_path):
+                os.remove(self.out_path)
+        else:
+            # Incremental mode: deletes the pieces of the lots to recompute
+            delete_by_values(self.out_uri(self.parclot_lyrname), self.lot_attname, self.recalc_vals)
+        # Prepares the overlay engine (spatial index of the lots)
+        self.send_msg(crelyr_msg_txt[2])
+        overlay = LotOverlay(self.grid_size, self.sliver_area, self.sliver_width, self.sliver_merge)
+        overlay.load_lyr(   self.lotaccr_lyr,
+                            self.lot_attname,
+                            self.parc_crs,
+                            self.context.transformContext()
+                            )
+        # Fields of the pieces: all the parcel fields + the lot field
+        in_flds = merge_fields(self.parc_flds, [self.lot_fld])
+        parclot_sink = ParcLotSink( in_flds,
+                                    self.lot_attname,
+                                    self.out_path,
+                                    self.parclot_lyrname,
+                                    QgsWkbTypes.multiType(self.parc_wkb_type),
+                                    self.parc_crs,
+                                    self.recalc_fids is not None,
+                                    self.largest_rem,
+                                    lot_vals=self.recalc_vals
+                                    )
+        # Only the parcels in the extent of the lots (to recompute) are read
+        extent = overlay.extent
+        if self.recalc_vals is not None:
+            extent = QgsRectangle()
+            extent.setMinimal()
+            for lot_geom, engine, lot_val in overlay.lots.values():
+                if str(lot_val) in self.recalc_vals:
+                    extent.combineExtentWith(lot_geom.boundingBox())
+        request = QgsFeatureRequest(extent)
+        request.setInvalidGeometryCheck(QgsFeatureRequest.GeometrySkipInvalid)
+        nb_workers = get_nb_workers(self.nb_workers)
+        done = False
+        try:
+            # Tiled mode only for large cadastres (cost of the worker processes launch)
+            if nb_workers > 1 and self.nb_parc >= tiled_min_nbparc:
+                self.split_tiled(overlay, parclot_sink, request, nb_workers)
+            else:
+                self.split_serial(overlay, parclot_sink, request)
+            done = not self.feedback.isCanceled()
+        finally:
+            # The pieces are committed only if all the parcels are split (no partial table)
+            parclot_sink.close(done)
+        self.lot_agg = parclot_sink.lot_agg
+        self.set_counts(nb_out=parclot_sink.nb_written)
+        if overlay.nb_sliv_dropped or overlay.nb_sliv_merged:
+            self.send_msg(sliver_msg_txt.format(overlay.nb_sliv_dropped, overlay.nb_sliv_merged))
+
+
+    def split_serial(self, overlay, parclot_sink, request):
+        '''
+            Splits the parcels by the lots in the current thread
+        '''
+        nb_obj = max(self.nb_parc, 1)
+        for obj_id, parc in enumerate(self.parc_src.getFeatures(request)):
+            # Cancellation inside the stage
+            if self.feedback.isCanceled():
+                return
+            parc_atts = parc.attributes()
+            # Writes the pieces with the 2 new fields calculated
+            for piece_geom, lot_val in overlay.split(parc.geometry()):
+                parclot_sink.add_piece(piece_geom, parc_atts + [lot_val], obj_id)
+            self.set_progress(obj_id, nb_obj)
+            self.set_counts(nb_in=obj_id + 1)
+
+
+    def split_tiled(self, overlay, parclot_sink, request, nb_workers):
+        '''
+            Splits the parcels by the lots by spatial tiles, in worker processes
+            The parcels are first distributed in the tiles (only their fids are kept),
+            the parcels of a tile are read when the tile is sent to the workers and
+            at most tiles_waiting_by_worker tiles by worker are waiting (bounded memory)
+            The geometries are sent to the workers as WKB, the attributes stay here
+            The results are written in the tiles order (deterministic output)
+        '''
+        # Distributes the parcels in the tiles (tile id -> [parcel fids, extent of the parcels])
+        grid = TileGrid(overlay.extent, max(nb_workers * tiles_by_worker, math.ceil(self.nb_parc / tile_max_nbparc)))
+        tiles = {}
+        nb_obj = max(self.nb_parc, 1) * 2
+        fid_request = QgsFeatureRequest(request)
+        fid_request.setNoAttributes()
+        for obj_id, parc in enumerate(self.parc_src.getFeatures(fid_request)):
+            if self.feedback.isCanceled():
+                return
+            geom = parc.geometry()
+            if geom.isNull() or geom.isEmpty():
+                continue
+            bbox = geom.boundingBox()
+            tile = tiles.setdefault(grid.tile_id(bbox), [[], QgsRectangle(bbox)])
+            tile[0].append(parc.id())
+            tile[1].combineExtentWith(bbox)
+            self.set_progress(obj_id, nb_obj)
+            self.set_counts(nb_in=obj_id + 1)
+
+        # Runs the tiles in the worker processes
+        tile_ids = sorted(tiles)
+        with ProcessPoolExecutor(max_workers=nb_workers, mp_context=get_mp_context()) as executor:
+            futures = []
+            next_id = 0
+            for i, t in enumerate(tile_ids):
+                # Reads and submits the next tiles (bounded number of tiles waiting)
+                while next_id < len(tile_ids) and len(futures) < nb_workers * tiles_waiting_by_worker:
+                    futures.append(self.submit_tile(executor, overlay, tiles.pop(tile_ids[next_id])))
+                    next_id += 1
+                future, parc_atts = futures.pop(0)
+                # Cancellation while waiting for the workers
+                while not future.done():
+                    if self.feedback.isCanceled():
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        return
+                    wait([future], timeout=0.5)
+                pieces, nb_dropped, nb_sliv_dropped, nb_sliv_merged = future.result()
+                for parc_id, piece_wkb, lot_val, surf, cont in pieces:
+                    parclot_sink.write_piece(geom_from_wkb(piece_wkb), parc_atts[parc_id] + [lot_val], surf, cont)
+                parclot_sink.nb_dropped += nb_dropped
+                overlay.nb_sliv_dropped += nb_sliv_dropped
+                overlay.nb_sliv_merged += nb_sliv_merged
+                self.ms_feedback.setProgress(50 + (i + 1) * 50 / len(tile_ids))
+
+
+    def submit_tile(self, executor, overlay, tile):
+        '''
+            Reads the parcels of a tile and sends them to a worker process (split_tile)
+            tile: [parcel fids, extent of the parcels]
+            Returns (future, attributes of the parcels)
+        '''
+        psurf_id = self.parc_flds.indexFromName(surfgeo_fldname)
+        pcont_id = self.parc_flds.indexFromName(contparc_fldname)
+        request = QgsFeatureRequest()
+        request.setFilterFids(tile[0])
+        request.setInvalidGeometryCheck(QgsFeatureRequest.GeometrySkipInvalid)
+        parc_atts_lst = []
+        parcs = []
+        for parc in self.parc_src.getFeatures(request):
+            geom = parc.geometry()
+            if geom.isNull() or geom.isEmpty():
+                continue
+            parc_atts = parc.attributes()
+            parc_atts_lst.append(parc_atts)
+            parcs.append((bytes(geom.asWkb()), py_val(parc_atts[psurf_id]), py_val(parc_atts[pcont_id])))
+        future = executor.submit(split_tile, overlay.lots_to_wkb(tile[1]), parcs, overlay.params(), self.largest_rem)
+        return future, parc_atts_lst
+
+
+    def cre_nwlots(self):
+        '''
+            Creates new calculated lots layer, with the totals by lot fields only
+            The pieces are grouped by lot and each lot is the union of its pieces
+            (in worker processes if there are several workers)
+            In incremental mode, only the recomputed lots are replaced
+        '''
+        self.send_msg(crelyr_msg_txt[6])
+        parclot_lyr = QgsVectorLayer(self.out_uri(self.parclot_lyrname), self.parclot_lyrname, 'ogr')
+        if self.recalc_fids is not None:
+            parclot_lyr.setSubsetString(values_in_expr(self.lot_attname, self.recalc_vals))
+        lot_pieces = LotPieces()
+        lot_pieces.load_lyr(parclot_lyr, self.lot_attname)
+        self.set_counts(nb_in=sum(len(wkbs) for wkbs in lot_pieces.lots.values()))
+        del parclot_lyr
+        lot_geoms = self.union_lots(lot_pieces)
+        if self.feedback.isCanceled():
+            return
+
+        # Writes the lots with the totals by lot fields
+        self.send_msg(crelyr_msg_txt[7])
+        if self.recalc_fids is not None:
+            delete_by_values(self.out_uri(self.nwlots_lyrname), self.lot_attname, self.recalc_vals)
+        nwlots_flds = merge_fields([self.lot_fld], LotAggregate.fields())
+        writer = GpkgWriter(self.out_path,
+                            self.nwlots_lyrname,
+                            nwlots_flds,
+                            QgsWkbTypes.multiType(self.parc_wkb_type),
+                            self.parc_crs,
+                            self.recalc_fids is not None
+                            )
+        for lot_val, lot_wkb in lot_geoms:
+            nw_obj = QgsFeature(nwlots_flds)
+            nw_obj.setGeometry(geom_from_wkb(lot_wkb))
+            nw_obj.setAttributes([lot_val] + self.lot_agg.get(lot_val).values())
+            writer.addFeature(nw_obj, QgsFeatureSink.FastInsert)
+        writer.close()
+        self.set_counts(nb_out=len(lot_geoms))
+
+
+    def union_lots(self, lot_pieces):
+        '''
+            Returns the union of the pieces of each lot: [(lot value, WKB), ...] (sorted by lot)
+        '''
+        lot_vals = lot_pieces.lot_values()
+        nb_workers = min(get_nb_workers(self.nb_workers), len(lot_vals))
+        lot_geoms = []
+        if nb_workers <= 1:
+            for i, lot_val in enumerate(lot_vals):
+                if self.feedback.isCanceled():
+                    return lot_geoms
+                lot_geoms.append((lot_val, union_pieces(lot_pieces.lots.pop(lot_val), self.grid_size)))
+                self.ms_feedback.setProgress((i + 1) * 100 / len(lot_vals))
+            return lot_geoms
+        with ProcessPoolExecutor(max_workers=nb_workers, mp_context=get_mp_context()) as executor:
+            futures = [executor.submit(union_pieces, lot_pieces.lots.pop(lot_val), self.grid_size) for lot_val in lot_vals]
+            for i, (lot_val, future) in enumerate(zip(lot_vals, futures)):
+                # Cancellation while waiting for the workers
+                while not future.done():
+                    if self.feedback.isCanceled():
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        return lot_geoms
+                    wait([future], timeout=0.5)
+                lot_geoms.append((lot_val, future.result()))
+                self.ms_feedback.setProgress((i + 1) * 100 / len(lot_vals))
+        return lot_geoms
+
+
+    def save_lots(self):
+        '''
+            Stores the fingerprints of the lots in the GPKG (for the incremental mode)
+        '''
+        self.send_msg(incr_msg_txt[3])
+        self.set_counts(len(self.lot_fgps.lots), len(self.lot_fgps.lots))
+        self.lot_fgps.write(self.out_path)
+
+
+    def set_progress(self, obj_id, nb_obj):
+        '''
+            Sets the progress of the current stage
+            (only every 1000 objects, not to flood the GUI with signals)
+        '''
+        if obj_id % 1000 == 0:
+            self.ms_feedback.setProgress(obj_id * 100 / nb_obj)
+
+
+    def send_msg(self, msg):
+        '''
+            Sends a message to the feedback
+        '''
+        self.feedback.pushInfo(msg)
@@ -26,15 +26,15 @@
 
 from qgis.PyQt import uic
 from qgis.PyQt.QtCore import Qt, pyqtSignal
-from qgis.PyQt.QtWidgets import qApp, QMessageBox, QWidget
+from qgis.PyQt.QtWidgets import QMessageBox, QWidget
 from qgis.PyQt.QtGui import QTextCursor
-from qgis.core import QgsProcessing, QgsFields, QgsField
+from qgis.core import QgsApplication, QgsTask, QgsProcessingFeedback, QgsVectorLayer
 
-import processing
 import os
 
 from .sgm_hunting_globalvars import *
 from .sgm_hunting_globalfnc import *
+from .sgm_hunting_parclotjob import ParcLotJob
 
 gui_dlg_hunting_msg, _ = uic.loadUiType(
         os.path.join(os.path.dirname(__file__), r"gui/dlg_hunting_msg.ui"))
@@ -51,6 +51,7 @@ class PrepaParcLot:
         self.conf = conf
         for k, v in self.conf.items():
             self.__dict__[k[:-4]] = v
+        self.task = None
 
 
     def launch(self) :
@@ -58,6 +59,8 @@ class PrepaParcLot:
         self.feedback = MsgWnd()
         # Captures the signal to launch the process
         self.feedback.send_ok.connect(self.ok_param) 
+        # Captures the signal to cancel the process
+        self.feedback.send_cancel.connect(self.cancel_task) 
         # Modal window
         self.feedback.setWindowModality(Qt.ApplicationModal)
         # Shows the parameters window
@@ -67,10 +70,12 @@ class PrepaParcLot:
     def ok_param(self):
         '''
             Launch the process once the msg window is validated
+            The job runs in a background task, the new layers are
+            added to the project at the end of the task (see task_completed)
         '''
         # Initializes progressbar
-        self.feedback.pg_bar.setMaximum(8)
-        self.pgb_val = 0
+        self.feedback.pg_bar.setMaximum(100)
+        self.feedback.pg_bar.setValue(0)
         
         # Initialization
         parc_lyr_m = self.project.mapLayersByName(parc_lyrname)
@@ -81,173 +86,180 @@ class PrepaParcLot:
                                     alert_lyr_msg_txt[0], 
                                     alert_lyr_msg_txt[1].format(parc_lyrname, self.lot_lyrname)
                                     )
+            self.feedback.end_run()
         else:
             parc_lyr = parc_lyr_m[0]
             lot_lyr = lot_lyr_m[0]
             parclyr_al = get_layer_fields_alias(parc_lyr)
             lot_lyr_al = get_layer_fields_alias(lot_lyr)
+            # Alias of the new layers
+            self.al_map = parclyr_al + lot_lyr_al + [[fdn, add_fldalias[i]] for i, fdn in enumerate(add_fldnames)] + [[fdn, lotstat_fldalias[i]] for i, fdn in enumerate(lotstat_fldnames)]
+            # Builts the new complete filename for the new layer (GPKG)
+            prj_dir = self.project.absolutePath()
+            nw_filename = gpkg_fname + ".gpkg"
+            nw_filepath = os.path.join(prj_dir, nw_filename)
+            # Prepares the background task
             try:
-                # If necessary, creates new snapping Lots on Parcelles layer
-                self.send_msg(crelyr_msg_txt[0])
-                if self.dist_max > 0:
-                    alg_params = {  'INPUT': lot_lyr,
-                                    'REFERENCE_LAYER': parc_lyr,
-                                    'TOLERANCE': self.dist_max,
-                                    'BEHAVIOR': 1,
-                                    'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-                                    }
-                    lotaccr_lyr = processing.run("native:snapgeometries", alg_params)['OUTPUT']
-                else:
-                    lotaccr_lyr = lot_lyr
-                    
-                # Creates new parclot intersection layer
-                self.send_msg(crelyr_msg_txt[1].format(self.parclot_lyrname))
-                # Builts the new complete filename for the new layer (GPKG)
-                prj_dir = self.project.absolutePath()
-                nw_filename = gpkg_fname + ".gpkg"
-                nw_filepath = os.path.join(prj_dir, nw_filename)
-                # Removes existing files before creating new file
-                if os.path.exists(nw_filepath):
-                    os.remove(nw_filepath)
-                # Uses intersection processing algorithm
-                self.send_msg(crelyr_msg_txt[2])
-                output_uri = 'ogr:dbname=\'' + nw_filepath + '\' table="' + self.parclot_lyrname + '" (geom)'
-                alg_params = {
-                                'INPUT': parc_lyr,
-                                'OVERLAY': lotaccr_lyr,
-                                'INPUT_FIELDS': [],
-                                'OVERLAY_FIELDS': [self.lot_attname],
-                                'OVERLAY_FIELDS_PREFIX': '',
-                                'OUTPUT': output_uri,
-                                'GRID_SIZE': None
-                                }
-                parclot_uri = processing.run("native:intersection", alg_params)['OUTPUT']
-                parclot_lyr = self.iface.addVectorLayer(parclot_uri, self.parclot_lyrname, 'ogr')
-                
-                # Adds 2 surface fields
-                self.send_msg(crelyr_msg_txt[3])
-                add_flds = QgsFields()
-                for i, n in enumerate(add_fldnames):
-                    add_flds.append(QgsField(n, add_fldqtypes[i]))
-                parclot_lyr.dataProvider().addAttributes(add_flds)
-                parclot_lyr.updateFields()
-                
-                # Calculates 2 new fields
-                if not parclot_lyr.isEditable():
-                    parclot_lyr.startEditing()
-                for obj in parclot_lyr.getFeatures():
-                    parclot_psurf = obj[surfgeo_fldname]
-                    parclot_pcont = obj[contparc_fldname]
-                    parclot_surf = round(obj.geometry().area())
-                    parclot_cont = parclot_pcont
-                    if parclot_psurf != 0 :
-                        if parclot_surf < parclot_psurf:
-                            parclot_cont = round(parclot_surf / parclot_psurf * parclot_pcont)
-                        else:
-                            parclot_surf = parclot_psurf
-                    update_attval(parclot_lyr, obj, add_fldnames[0], parclot_surf)
-                    update_attval(parclot_lyr, obj, add_fldnames[1], parclot_cont)
-                    # Eliminates 0 m² parcels
-                    if parclot_cont == 0:
-                        parclot_lyr.deleteFeature(obj.id())
-                    
-                parclot_lyr.commitChanges()
-                
-                # Creates alias
-                al_map = parclyr_al + lot_lyr_al + [[fdn, add_fldalias[i]] for i, fdn in enumerate(add_fldnames)] + [[tot_fldname, tot_fldalias]]
-                create_alias(parclot_lyr, al_map)
-                
-                # Moves layer to the top (layer order)
-                move_lyr_to_top(self.project, parclot_lyr)
-                
-                # Adds categorized symbology
-                self.send_msg(crelyr_msg_txt[4])
-                add_cat_symb(parclot_lyr, self.lot_attname, ramp_c, cat_label)
-                
-                parclot_lyr.triggerRepaint()
-
-                # Creates new stat by category for total surface by lot calculation
-                self.send_msg(crelyr_msg_txt[5])
-                alg_params = {  'INPUT': parclot_lyr,
-                                'VALUES_FIELD_NAME': add_fldnames[1],
-                                'CATEGORIES_FIELD_NAME':[self.lot_attname],
-                                'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-                                }
-                stat_lyr = processing.run("qgis:statisticsbycategories", alg_params)['OUTPUT']
-                # Creates dic of total contenance by lot
-                cont_lot_dic = {}
-                for obj in stat_lyr.getFeatures():
-                    cont_lot_dic[obj[self.lot_attname]] = obj['sum']
-                
-                # Creates new calculated lots layer
-                output_uri = 'ogr:dbname=\'' + nw_filepath + '\' table="' + self.nwlots_lyrname + '" (geom)'
-                self.send_msg(crelyr_msg_txt[6])
-                alg_params = {  'INPUT': parclot_lyr,
-                                'FIELD': [self.lot_attname],
-                                'SEPARATE_DISJOINT': False,
-                                'OUTPUT': output_uri
-                                }
-                nwlots_uri = processing.run("native:dissolve", alg_params)['OUTPUT']
-                nwlots_lyr = self.iface.addVectorLayer(nwlots_uri, self.nwlots_lyrname, 'ogr')
-                
-                # Moves layer to the top (layer order)
-                move_lyr_to_top(self.project, nwlots_lyr)
-                
-                # Deletes useless fields and add the contenance total field
-                self.send_msg(crelyr_msg_txt[7])
-                del_flds = []
-                for fld in nwlots_lyr.fields():
-                    fld_name = fld.name()
-                    if fld_name not in ['fid', self.lot_attname]:
-                        del_flds.append(nwlots_lyr.fields().indexFromName(fld_name))
-                nwlots_lyr.dataProvider().deleteAttributes(del_flds)
-                nwlots_lyr.updateFields()
-                add_flds = QgsFields()
-                add_flds.append(QgsField(tot_fldname, tot_fldqtype))
-                nwlots_lyr.dataProvider().addAttributes(add_flds)
-                nwlots_lyr.updateFields()
-                if not nwlots_lyr.isEditable():
-                    nwlots_lyr.startEditing()
-                for obj in nwlots_lyr.getFeatures():
-                    update_attval(nwlots_lyr, obj, tot_fldname, cont_lot_dic[obj[self.lot_attname]])
-                nwlots_lyr.commitChanges()
-                
-                create_alias(nwlots_lyr, al_map)
-
-                # Add categorized symbology
-                self.send_msg(crelyr_msg_txt[8])
-                add_cat_symb(nwlots_lyr, self.lot_attname, ramp_c, cat_label)
-                
-                nwlots_lyr.triggerRepaint()
-                
-                self.canvas.setExtent(nwlots_lyr.extent())
-                self.canvas.refresh()
-                
-                # End message
-                self.send_msg(crelyr_msg_txt[9])
-                QMessageBox.information(
-                                        self.feedback, 
-                                        mnu_fnc1_txt, 
-                                        crelyr_msg_txt[9]
-                                        )
-
+                self.task = PrepaParcLotTask(mnu_fnc1_txt)
+                self.task.job = ParcLotJob(parc_lyr, lot_lyr, nw_filepath, self.conf, self.task.job_feedback)
             except Exception as e:
-                self.send_msg(alert_cre_msg_txt[1].format(str(e)))
-                QMessageBox.warning(
-                                        self.feedback, 
-                                        alert_cre_msg_txt[0], 
-                                        alert_cre_msg_txt[1].format(str(e))
-                                        )
-        self.feedback.close()
+                # The job could not be prepared (missing field...): the task is not launched
+                self.task = None
+                self.alert_error(e)
+                self.feedback.end_run()
+                return
+            self.task.job_feedback.send_msg.connect(self.feedback.update_log)
+            self.task.progressChanged.connect(self.feedback.set_progress)
+            self.task.taskCompleted.connect(self.task_completed)
+            self.task.taskTerminated.connect(self.task_terminated)
+            QgsApplication.taskManager().addTask(self.task)
+
+
+    def cancel_task(self):
+        '''
+            Asks the running task to stop
+            The task stops at the next cancellation check of the job
+        '''
+        if self.task:
+            self.task.cancel()
+
+
+    def task_completed(self):
+        '''
+            Adds the new layers to the project (main thread)
+        '''
+        job = self.task.job
+        self.task = None
+        try:
+            parclot_lyr = self.load_nwlyr(job.parclot_uri, self.parclot_lyrname)
+            # Adds categorized symbology
+            self.send_msg(crelyr_msg_txt[4])
+            add_cat_symb(parclot_lyr, self.lot_attname, ramp_c, cat_label)
+            parclot_lyr.triggerRepaint()
+            
+            nwlots_lyr = self.load_nwlyr(job.nwlots_uri, self.nwlots_lyrname)
+            # Add categorized symbology
+            self.send_msg(crelyr_msg_txt[8])
+            add_cat_symb(nwlots_lyr, self.lot_attname, ramp_c, cat_label)
+            nwlots_lyr.triggerRepaint()
+            
+            self.canvas.setExtent(nwlots_lyr.extent())
+            self.canvas.refresh()
+            
+            # End message
+            self.feedback.set_progress(100)
+            self.send_msg(crelyr_msg_txt[9])
+            QMessageBox.information(
+                                    self.feedback, 
+                                    mnu_fnc1_txt, 
+                                    crelyr_msg_txt[9]
+                                    )
+        except Exception as e:
+            self.alert_error(e)
+        self.feedback.end_run()
+
+
+    def load_nwlyr(self, lyr_uri, lyr_name):
+        '''
+            Returns the new layer lyr_uri, added to the project
+            If the layer is already in the project (incremental mode), it is only reloaded
+        '''
+        nw_lyr = get_lyr_by_uri(self.project, lyr_uri)
+        if nw_lyr:
+            nw_lyr.dataProvider().reloadData()
+            nw_lyr.updateFields()
+        else:
+            nw_lyr = QgsVectorLayer(lyr_uri, lyr_name, 'ogr')
+            self.project.addMapLayer(nw_lyr)
+            # Moves layer to the top (layer order)
+            move_lyr_to_top(self.project, nw_lyr)
+        # Creates alias
+        create_alias(nw_lyr, self.al_map)
+        return nw_lyr
+
+
+    def task_terminated(self):
+        '''
+            Manages the end of a canceled or failed task
+        '''
+        exc = self.task.exception
+        self.task = None
+        if exc:
+            self.alert_error(exc)
+        else:
+            self.send_msg(cancel_msg_txt)
+            QMessageBox.information(
+                                    self.feedback, 
+                                    mnu_fnc1_txt, 
+                                    cancel_msg_txt
+                                    )
+        self.feedback.end_run()
+
+
+    def alert_error(self, e):
+        '''
+            Shows the error message
+        '''
+        self.send_msg(alert_cre_msg_txt[1].format(str(e)))
+        QMessageBox.warning(
+                                self.feedback, 
+                                alert_cre_msg_txt[0], 
+                                alert_cre_msg_txt[1].format(str(e))
+                                )
 
 
     def send_msg(self, msg):
         '''
             Send message to the dlg
         '''
-        self.feedback.pg_bar.setValue(self.pgb_val)
         self.feedback.update_log(msg)
-        self.pgb_val += 1
+
+
+class JobFeedback(QgsProcessingFeedback):
+    '''
+        Feedback of the job, sends the job messages through a signal
+        (the signal is queued to the msg window living in the main thread)
+    '''
+
+    send_msg = pyqtSignal(str)
+
+    def pushInfo(self, info):
+        self.send_msg.emit(info)
+
+
+class PrepaParcLotTask(QgsTask):
+    '''
+        Runs the ParcLotJob in a background thread
+    '''
+
+    def __init__(self, description):
+        super(PrepaParcLotTask, self).__init__(description, QgsTask.CanCancel)
+        self.job = None
+        self.exception = None
+        # The job progress is forwarded to the task progress
+        self.job_feedback = JobFeedback()
+        self.job_feedback.progressChanged.connect(self.setProgress)
+
+
+    def run(self):
+        '''
+            Runs the job (background thread, no GUI here!)
+        '''
+        try:
+            return self.job.run()
+        except Exception as e:
+            # An error raised by a canceled algorithm is not an error
+            if not self.isCanceled():
+                self.exception = e
+            return False
+
+
+    def cancel(self):
+        '''
+            Cancels the job (cooperative cancellation, checked by the job)
+        '''
+        self.job_feedback.cancel()
+        super(PrepaParcLotTask, self).cancel()
 
 
 class MsgWnd(QWidget, gui_dlg_hunting_msg):
@@ -256,6 +268,7 @@ class MsgWnd(QWidget, gui_dlg_hunting_msg):
     '''
 
     send_ok = pyqtSignal()
+    send_cancel = pyqtSignal()
 
     def __init__(self, parent=None):
         super(MsgWnd, self).__init__(parent)
@@ -263,8 +276,8 @@ class MsgWnd(QWidget, gui_dlg_hunting_msg):
         # Fills title and button text
         self.setWindowTitle(dlg_msg_titles[0])
         self.valid_bt.setText(dlg_msg_buts[0])
-        # Initialization of the closing method (False = quit by red cross)
-        self.quit_valid = False
+        # True while the process is running
+        self.running = False
         # Deletes Widget on close event
         self.setAttribute(Qt.WA_DeleteOnClose)
         # Connections
@@ -273,23 +286,45 @@ class MsgWnd(QWidget, gui_dlg_hunting_msg):
 
     def butt_ok(self):
         '''
-            Closes the window when clicking on the launch button
+            Launches the process when clicking on the launch button
+            or cancels it if it is running
         '''
-        self.quit_valid = True
-        self.close()
+        if self.running:
+            self.send_cancel.emit()
+        else:
+            self.running = True
+            self.valid_bt.setText(dlg_msg_buts[2])
+            self.send_ok.emit()
 
 
     def closeEvent(self, event):
         '''
-            Sends signal when the window is quit
+            Cancels the process if the window is quit while running
+            The window is closed at the end of the process
         '''
-        if self.quit_valid:
-            self.send_ok.emit()
+        if self.running:
+            self.send_cancel.emit()
+            event.ignore()
         else:
             # Hides the window
             self.hide()
 
 
+    def end_run(self):
+        '''
+            Closes the window at the end of the process
+        '''
+        self.running = False
+        self.close()
+
+
+    def set_progress(self, val):
+        '''
+            Updates the progressbar (val in %)
+        '''
+        self.pg_bar.setValue(int(val))
+
+
     def update_log(self, msg):
         """
             Updates the message zone
@@ -302,5 +337,4 @@ class MsgWnd(QWidget, gui_dlg_hunting_msg):
         c = t.textCursor()
         c.movePosition(QTextCursor.End, QTextCursor.MoveAnchor)
         t.setTextCursor(c)
-        qApp.processEvents()
-        
\ No newline at end of file
+        
@@ -0,0 +1,265 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        Prorata
+    * Description:   Calculation of the hunting surfaces of the parcel pieces
+    *                and streaming writing of the pieces in the GPKG
+    * Specific lib:  numpy (optional)
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+from qgis.core import QgsFields, QgsField, QgsFeature, QgsFeatureSink
+
+import math
+
+# numpy is shipped with QGIS, but the proration works without it
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .sgm_hunting_globalvars import *
+from .sgm_hunting_globalfnc import *
+from .sgm_hunting_lotstats import LotAggregate
+from .sgm_hunting_gpkg import GpkgWriter
+
+
+def calc_prorata(piece_area, psurf, pcont):
+    '''
+        Returns the hunting surfaces (surface_geo_chasse, contenance_chasse) of a parcel piece
+        piece_area: geometric area of the piece
+        psurf: surface_geo of the whole parcel
+        pcont: cadastral contenance of the whole parcel
+        The contenance is prorated only if the piece is smaller than the parcel
+    '''
+    surf = round(piece_area)
+    cont = pcont
+    if psurf != 0 :
+        if surf < psurf:
+            cont = round(surf / psurf * pcont)
+        else:
+            surf = psurf
+    return surf, cont
+
+
+def prorate_batch(areas, psurfs, pconts, parc_ids=None, largest_rem=False):
+    '''
+        Calculates the hunting surfaces of a batch of pieces (same rule as calc_prorata)
+        areas: geometric areas of the pieces
+        psurfs, pconts: surface_geo and contenance of the parcel of each piece
+        parc_ids: parcel id of each piece, needed by the largest remainder option
+        (the pieces of a parcel do not need to be consecutive, but all the pieces
+        of a parcel must be in the batch)
+        largest_rem: the contenance of a parcel is shared out between its pieces in
+        proportion to their exact areas, and rounded by the largest remainder method:
+        if the pieces cover the parcel, their contenances sum exactly to the contenance
+        of the parcel, otherwise to the rounded sum of their exact shares
+        Returns (surfs, conts, keep): surface_geo_chasse, contenance_chasse and
+        keep mask (False for the 0 m² pieces), as numpy arrays (lists without numpy)
+    '''
+    if np is None:
+        return prorate_batch_py(areas, psurfs, pconts, parc_ids, largest_rem)
+    areas = np.asarray(areas, dtype=float)
+    # Empty (NULL) values are taken as 0
+    psurfs = np.asarray([py_val(v) or 0 for v in psurfs], dtype=float)
+    pconts = np.asarray([py_val(v) or 0 for v in pconts], dtype=float)
+    surfs = np.round(areas)
+    # Pieces smaller than their parcel: prorated contenance
+    prorated = (psurfs != 0) & (surfs < psurfs)
+    surfs = np.where((psurfs != 0) & ~prorated, psurfs, surfs)
+    shares = np.divide(surfs * pconts, psurfs, out=pconts.copy(), where=prorated)
+    conts = np.where(prorated, np.round(shares), pconts)
+    if largest_rem and parc_ids is not None and (psurfs != 0).any():
+        # All the pieces of the parcels with a surface_geo
+        idx = np.flatnonzero(psurfs != 0)
+        # Parcel of each piece, as a group number
+        grp_ids, grp = np.unique(np.asarray(parc_ids)[idx], return_inverse=True)
+        nb_grp = len(grp_ids)
+        grp_area = np.bincount(grp, weights=areas[idx], minlength=nb_grp)
+        grp_psurf = np.zeros(nb_grp)
+        grp_psurf[grp] = psurfs[idx]
+        grp_pcont = np.zeros(nb_grp)
+        grp_pcont[grp] = pconts[idx]
+        # Pieces covering their parcel: the contenance is shared out by their total area
+        covered = np.round(grp_area) >= grp_psurf
+        bases = np.where(covered, grp_area, grp_psurf)[grp]
+        p_shares = np.divide(areas[idx] * grp_pcont[grp], bases, out=np.zeros(len(idx)), where=bases != 0)
+        floors = np.floor(p_shares)
+        targets = np.where(covered, grp_pcont, np.round(np.bincount(grp, weights=p_shares, minlength=nb_grp)))
+        missing = targets - np.bincount(grp, weights=floors, minlength=nb_grp)
+        # Rank of each piece in its parcel by decreasing remainder
+        order = np.lexsort((-(p_shares - floors), grp))
+        grp_start = np.r_[0, np.cumsum(np.bincount(grp, minlength=nb_grp))[:-1]]
+        ranks = np.empty(len(idx), dtype=int)
+        ranks[order] = np.arange(len(idx)) - grp_start[grp[order]]
+        conts[idx] = floors + (ranks < missing[grp])
+    return surfs, conts, conts != 0
+
+
+def prorate_batch_py(areas, psurfs, pconts, parc_ids=None, largest_rem=False):
+    '''
+        prorate_batch without numpy (same arguments and results, as lists)
+    '''
+    psurfs = [py_val(v) or 0 for v in psurfs]
+    pconts = [py_val(v) or 0 for v in pconts]
+    surfs = []
+    conts = []
+    for area, psurf, pcont in zip(areas, psurfs, pconts):
+        surf, cont = calc_prorata(area, psurf, pcont)
+        surfs.append(surf)
+        conts.append(cont)
+    if largest_rem and parc_ids is not None:
+        grp = {}
+        for i, psurf in enumerate(psurfs):
+            if psurf != 0:
+                grp.setdefault(parc_ids[i], []).append(i)
+        for ids in grp.values():
+            psurf = psurfs[ids[0]]
+            pcont = pconts[ids[0]]
+            grp_area = sum(areas[i] for i in ids)
+            # Pieces covering their parcel: the contenance is shared out by their total area
+            covered = round(grp_area) >= psurf
+            base = grp_area if covered else psurf
+            shares = {i: areas[i] * pcont / base if base else 0 for i in ids}
+            floors = {i: math.floor(v) for i, v in shares.items()}
+            target = pcont if covered else round(sum(shares.values()))
+            missing = target - sum(floors.values())
+            for rank, i in enumerate(sorted(ids, key=lambda i: floors[i] - shares[i])):
+                conts[i] = floors[i] + (1 if rank < missing else 0)
+    return surfs, conts, [cont != 0 for cont in conts]
+
+
+class ParcLotSink:
+    '''
+        Writes the parcel pieces (parcel x lot) in a GPKG table
+        The 2 hunting surface fields are calculated on the fly and the 0 m² pieces
+        are eliminated before writing, so each piece is written only once
+        The pieces are prorated by batches (prorate_batch), a batch always holds
+        all the pieces of its parcels
+        The totals by lot are accumulated in the same pass (lot_agg)
+        The pieces can also be written in a sink of the caller (writer: a
+        QgsFeatureSink with the fields of out_fields), which is then not closed here
+        lot_vals: values (as text) of the lots whose pieces are written (None: all the lots),
+        the pieces of the other lots are only used to prorate the pieces of their parcels
+    '''
+
+    def __init__(self, in_flds, lot_attname, gpkg_path, lyr_name, wkb_type, crs, append=False, largest_rem=False,
+                    writer=None, lot_vals=None):
+
+        # The fid of the source layer is not kept (several pieces by parcel),
+        # the GPKG creates its own fid
+        self.att_ids = [i for i, fld in enumerate(in_flds) if fld.name().lower() != 'fid']
+        self.psurf_id = in_flds.indexFromName(surfgeo_fldname)
+        self.pcont_id = in_flds.indexFromName(contparc_fldname)
+        self.lot_id = in_flds.indexFromName(lot_attname)
+        self.lot_agg = LotAggregate()
+        self.fields = self.out_fields(in_flds)
+        self.own_writer = writer is None
+        if self.own_writer:
+            # Creates the GPKG table with its final schema (or appends to the existing table)
+            writer = GpkgWriter(gpkg_path, lyr_name, self.fields, wkb_type, crs, append)
+        self.writer = writer
+        self.largest_rem = largest_rem
+        self.lot_vals = lot_vals
+        # Pieces waiting to be prorated: (geometry, attributes, parcel id)
+        self.pieces = []
+        self.nb_written = 0
+        self.nb_dropped = 0
+
+
+    @staticmethod
+    def out_fields(in_flds):
+        '''
+            Returns the fields of the pieces: the input fields (without fid)
+            and the 2 hunting surface fields
+        '''
+        add_flds = QgsFields()
+        for i, n in enumerate(add_fldnames):
+            add_flds.append(QgsField(n, add_fldqtypes[i]))
+        flds = QgsFields()
+        for fld in in_flds:
+            if fld.name().lower() != 'fid':
+                flds.append(fld)
+        return merge_fields(flds, add_flds)
+
+
+    def add_piece(self, geom, atts, parc_id):
+        '''
+            Adds a piece, its hunting surfaces are calculated and it is written
+            with the next batch
+            geom: geometry of the piece
+            atts: attributes of the piece (in the order of the input fields)
+            parc_id: id of the parcel of the piece (the pieces of a parcel are added together)
+        '''
+        # A full batch is flushed only between 2 parcels
+        if len(self.pieces) >= prorata_batch_size and parc_id != self.pieces[-1][2]:
+            self.flush()
+        self.pieces.append((geom, atts, parc_id))
+
+
+    def flush(self):
+        '''
+            Calculates the hunting surfaces of the waiting pieces and writes them
+            (the 0 m² pieces are eliminated)
+        '''
+        if not self.pieces:
+            return
+        geoms, atts_lst, parc_ids = zip(*self.pieces)
+        self.pieces = []
+        surfs, conts, keep = prorate_batch( [geom.area() for geom in geoms],
+                                            [atts[self.psurf_id] for atts in atts_lst],
+                                            [atts[self.pcont_id] for atts in atts_lst],
+                                            parc_ids,
+                                            self.largest_rem
+                                            )
+        for i, geom in enumerate(geoms):
+            # Eliminates 0 m² parcels
+            if not keep[i]:
+                self.nb_dropped += 1
+                continue
+            self.write_piece(geom, atts_lst[i], float(surfs[i]), float(conts[i]))
+
+
+    def write_piece(self, geom, atts, surf, cont):
+        '''
+            Writes a piece whose hunting surfaces are already calculated
+            (if its lot is written, see lot_vals)
+        '''
+        if self.lot_vals is not None and str(atts[self.lot_id]) not in self.lot_vals:
+            return
+        nw_obj = QgsFeature(self.fields)
+        nw_obj.setGeometry(geom)
+        nw_obj.setAttributes([atts[i] for i in self.att_ids] + [surf, cont])
+        if not self.writer.addFeature(nw_obj, QgsFeatureSink.FastInsert):
+            raise IOError(self.writer.lastError() if not self.own_writer else self.writer.errorMessage())
+        self.lot_agg.add(atts[self.lot_id], surf, cont)
+        self.nb_written += 1
+
+
+    def close(self, commit=True):
+        '''
+            Flushes and closes the GPKG table (commits the pieces)
+            commit False: the pieces are not written (the transaction is rolled back)
+        '''
+        if self.writer is not None:
+            if commit:
+                self.flush()
+            if self.own_writer:
+                self.writer.close(commit)
+            self.writer = None
@@ -0,0 +1,58 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        HuntingProvider class
+    * Description:   Processing provider of the plugin algorithms
+    * Specific lib:  none
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+from qgis.core import QgsProcessingProvider
+from qgis.PyQt.QtGui import QIcon
+
+import os.path
+
+from .sgm_hunting_globalvars import *
+from .sgm_hunting_algorithms import (SnapLotsAlgorithm,
+                                     SplitParcelsAlgorithm,
+                                     CalcLotsAlgorithm,
+                                     ExportXlAlgorithm)
+
+
+class HuntingProvider(QgsProcessingProvider):
+    '''
+        Processing provider: the stages of the creation of the layers and the
+        Excel export, usable in Model Builder, in batch and with qgis_process
+    '''
+
+    def loadAlgorithms(self):
+        for alg in (SnapLotsAlgorithm(), SplitParcelsAlgorithm(), CalcLotsAlgorithm(), ExportXlAlgorithm()):
+            self.addAlgorithm(alg)
+
+
+    def id(self):
+        return 'sgmhunting'
+
+
+    def name(self):
+        return mnu_title_txt
+
+
+    def icon(self):
+        return QIcon(os.path.join(os.path.dirname(__file__), 'icons', 'sgm_hunting.png'))
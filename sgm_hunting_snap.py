@@ -0,0 +1,427 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        LotSnapper, SnapCache classes
+    * Description:   Snapping of the hunting lots on the parcels
+    *                (snapping engine and cache of the snapped lots)
+    * Specific lib:  none
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+from qgis.core import (QgsFields, QgsField, QgsFeature, QgsFeatureSink, QgsFeatureRequest,
+                        QgsGeometry, QgsVectorLayer, QgsWkbTypes, QgsSpatialIndex, QgsRectangle,
+                        QgsPointXY, QgsCoordinateTransform)
+from qgis.PyQt.QtCore import QVariant
+
+import hashlib
+import math
+import os
+import time
+
+from .sgm_hunting_globalvars import *
+from .sgm_hunting_globalfnc import *
+from .sgm_hunting_gpkg import GpkgWriter
+
+
+class VertexGrid:
+    '''
+        Grid hash of points (cell size = tolerance): the points closer than
+        the tolerance of a location are in the 9 cells around it
+    '''
+
+    def __init__(self, cell_size):
+
+        self.cell_size = cell_size
+        self.cells = {}
+        self.nb_pts = 0
+
+
+    def cell(self, x, y):
+        '''
+            Returns the cell of a location
+        '''
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+
+    def add(self, x, y):
+        '''
+            Adds a point (the duplicated points are added once)
+        '''
+        pts = self.cells.setdefault(self.cell(x, y), set())
+        if (x, y) not in pts:
+            pts.add((x, y))
+            self.nb_pts += 1
+
+
+    def in_rect(self, xmin, ymin, xmax, ymax):
+        '''
+            Returns the points of the cells covering a rectangle
+        '''
+        cmin = self.cell(xmin, ymin)
+        cmax = self.cell(xmax, ymax)
+        for cx in range(cmin[0], cmax[0] + 1):
+            for cy in range(cmin[1], cmax[1] + 1):
+                yield from self.cells.get((cx, cy), ())
+
+
+    def near_seg(self, ax, ay, bx, by):
+        '''
+            Returns the points of the cells along a segment, closer than 2 cells to it
+            (walks the segment cell by cell: does not scan its whole bounding box)
+        '''
+        nb_step = math.ceil(math.hypot(bx - ax, by - ay) / self.cell_size) + 1
+        cells = set()
+        for i in range(nb_step + 1):
+            cx, cy = self.cell(ax + (bx - ax) * i / nb_step, ay + (by - ay) * i / nb_step)
+            cells.update((cx + dx, cy + dy) for dx in range(-2, 3) for dy in range(-2, 3))
+        for cell in cells:
+            yield from self.cells.get(cell, ())
+
+
+    def nearest(self, x, y, tol):
+        '''
+            Returns (distance, point) of the nearest point closer than tol (None if no point)
+        '''
+        best = None
+        for px, py in self.in_rect(x - tol, y - tol, x + tol, y + tol):
+            dist = math.hypot(px - x, py - y)
+            if dist <= tol and (best is None or dist < best[0]):
+                best = (dist, (px, py))
+        return best
+
+
+def closest_on_seg(x, y, ax, ay, bx, by):
+    '''
+        Returns (distance, t, point) of the point of segment ab closest to (x, y)
+        t: position of the point on the segment (0: a, 1: b)
+    '''
+    dx = bx - ax
+    dy = by - ay
+    len2 = dx * dx + dy * dy
+    t = 0 if len2 == 0 else min(1, max(0, ((x - ax) * dx + (y - ay) * dy) / len2))
+    px = ax + t * dx
+    py = ay + t * dy
+    return math.hypot(px - x, py - y), t, (px, py)
+
+
+class LotSnapper:
+    '''
+        Snaps the lots on the parcels (same behaviour as native:snapgeometries
+        with BEHAVIOR 1: prefer closest point, insert extra vertices where required)
+        Only the parcels near the lot boundaries are loaded (requests on the
+        bounding boxes of short chunks of the lot rings, buffered by the tolerance),
+        so the cost depends on the length of the lot boundaries, not on the size
+        of the cadastre
+        The parcel vertices are stored in a grid hash, the parcel segments in a spatial index
+    '''
+
+    def __init__(self, parc_src, parc_crs, lot_crs, tolerance, transform_ctx):
+
+        self.parc_src = parc_src
+        self.tol = tolerance
+        # Parcels -> lots CRS and lots -> parcels CRS transformations
+        self.xform = None
+        self.inv_xform = None
+        if parc_crs != lot_crs:
+            self.xform = QgsCoordinateTransform(parc_crs, lot_crs, transform_ctx)
+            self.inv_xform = QgsCoordinateTransform(lot_crs, parc_crs, transform_ctx)
+        self.vtx_grid = VertexGrid(tolerance)
+        self.seg_idx = QgsSpatialIndex()
+        self.segs = []
+        self.seg_keys = set()
+        self.parc_ids = set()
+
+
+    @staticmethod
+    def rings(geom):
+        '''
+            Returns the rings of a (multi)polygon geometry: [[[(x, y), ...], ...], ...]
+        '''
+        if geom.isMultipart():
+            polys = geom.asMultiPolygon()
+        else:
+            polys = [geom.asPolygon()]
+        return [[[(pt.x(), pt.y()) for pt in ring] for ring in poly] for poly in polys]
+
+
+    def chunk_rects(self, ring):
+        '''
+            Returns the bounding boxes (buffered by the tolerance) of the chunks of a ring:
+            the ring is cut in chunks whose width and height are lower than snap_chunk_len
+            (long segments are cut too), so the boxes follow the ring closely
+        '''
+        rects = []
+        rect = None
+        for (ax, ay), (bx, by) in zip(ring[:-1], ring[1:]):
+            nb_step = max(1, math.ceil(math.hypot(bx - ax, by - ay) / snap_chunk_len))
+            for i in range(nb_step + 1):
+                x = ax + (bx - ax) * i / nb_step
+                y = ay + (by - ay) * i / nb_step
+                if rect is None:
+                    rect = QgsRectangle(x, y, x, y)
+                elif (max(rect.xMaximum(), x) - min(rect.xMinimum(), x) > snap_chunk_len or
+                        max(rect.yMaximum(), y) - min(rect.yMinimum(), y) > snap_chunk_len):
+                    rects.append(rect)
+                    # The new chunk starts at the last point of the previous one
+                    lx = ax + (bx - ax) * (i - 1) / nb_step if i > 0 else x
+                    ly = ay + (by - ay) * (i - 1) / nb_step if i > 0 else y
+                    rect = QgsRectangle(min(lx, x), min(ly, y), max(lx, x), max(ly, y))
+                else:
+                    rect.combineExtentWith(x, y)
+        if rect is not None:
+            rects.append(rect)
+        return [r.buffered(self.tol) for r in rects]
+
+
+    def load_ref(self, lot_geoms):
+        '''
+            Loads the vertices and the segments of the parcels near the boundaries of the lots
+        '''
+        nw_ids = set()
+        for geom in lot_geoms:
+            for poly in self.rings(geom):
+                for ring in poly:
+                    for rect in self.chunk_rects(ring):
+                        if self.inv_xform:
+                            rect = self.inv_xform.transformBoundingBox(rect)
+                        request = QgsFeatureRequest(rect)
+                        request.setFlags(QgsFeatureRequest.NoGeometry)
+                        request.setNoAttributes()
+                        nw_ids.update(obj.id() for obj in self.parc_src.getFeatures(request))
+        nw_ids -= self.parc_ids
+        if not nw_ids:
+            return
+        self.parc_ids |= nw_ids
+        request = QgsFeatureRequest()
+        request.setFilterFids(list(nw_ids))
+        request.setNoAttributes()
+        for parc in self.parc_src.getFeatures(request):
+            geom = parc.geometry()
+            if geom.isNull() or geom.isEmpty() or geom.type() != QgsWkbTypes.PolygonGeometry:
+                continue
+            if self.xform:
+                geom = QgsGeometry(geom)
+                geom.transform(self.xform)
+            for poly in self.rings(geom):
+                for ring in poly:
+                    for i, (x, y) in enumerate(ring[:-1]):
+                        self.vtx_grid.add(x, y)
+                        self.add_seg(x, y, *ring[i + 1])
+
+
+    def add_seg(self, ax, ay, bx, by):
+        '''
+            Adds a parcel segment (the segments shared by 2 parcels are added once)
+        '''
+        seg_key = (ax, ay, bx, by) if (ax, ay) <= (bx, by) else (bx, by, ax, ay)
+        if seg_key in self.seg_keys:
+            return
+        self.seg_keys.add(seg_key)
+        self.seg_idx.addFeature(len(self.segs), QgsRectangle(min(ax, bx), min(ay, by), max(ax, bx), max(ay, by)))
+        self.segs.append(seg_key)
+
+
+    def snap_pt(self, x, y):
+        '''
+            Returns the snapped location of a lot vertex: the closest parcel vertex or
+            point of a parcel segment closer than the tolerance (unchanged if none)
+        '''
+        best = self.vtx_grid.nearest(x, y, self.tol)
+        rect = QgsRectangle(x - self.tol, y - self.tol, x + self.tol, y + self.tol)
+        for seg_id in self.seg_idx.intersects(rect):
+            dist, t, pt = closest_on_seg(x, y, *self.segs[seg_id])
+            # The vertices are preferred at the same distance
+            if dist <= self.tol and (best is None or dist < best[0]):
+                best = (dist, pt)
+        return (x, y) if best is None else best[1]
+
+
+    def snap_ring(self, ring):
+        '''
+            Snaps a closed ring: snaps its vertices, then inserts the parcel vertices
+            closer than the tolerance of each snapped segment
+            Returns the original ring if the snapped one is degenerated
+        '''
+        snap_pts = [self.snap_pt(x, y) for x, y in ring[:-1]]
+        snap_pts.append(snap_pts[0])
+        nw_ring = []
+        for (ax, ay), (bx, by) in zip(snap_pts[:-1], snap_pts[1:]):
+            nw_ring.append((ax, ay))
+            inserts = []
+            for px, py in self.vtx_grid.near_seg(ax, ay, bx, by):
+                if (px, py) == (ax, ay) or (px, py) == (bx, by):
+                    continue
+                dist, t, pt = closest_on_seg(px, py, ax, ay, bx, by)
+                if dist <= self.tol and 0 < t < 1:
+                    inserts.append((t, (px, py)))
+            nw_ring += [pt for t, pt in sorted(inserts)]
+        nw_ring.append(nw_ring[0])
+        # Removes the duplicated consecutive vertices
+        nw_ring = [pt for i, pt in enumerate(nw_ring) if i == 0 or pt != nw_ring[i - 1]]
+        if len(nw_ring) < 4:
+            return ring
+        return nw_ring
+
+
+    def snap(self, geom):
+        '''
+            Returns the snapped geometry of a lot (multipolygon)
+            The parcels near the lot must have been loaded (load_ref)
+        '''
+        if geom.isNull() or geom.isEmpty() or geom.type() != QgsWkbTypes.PolygonGeometry:
+            return QgsGeometry(geom)
+        polys = [[[QgsPointXY(x, y) for x, y in self.snap_ring(ring)] for ring in poly] for poly in self.rings(geom)]
+        return QgsGeometry.fromMultiPolygonXY(polys)
+
+
+class SnapCache:
+    '''
+        Cache of the snapped lot geometries, stored in a table of a GPKG
+        The cache is content addressed: the key of a snapped lot is the hash of
+        the lot geometry, the fingerprint of the parcel layer and the tolerance,
+        so an entry is never stale (it is just not used anymore and evicted later)
+        Eviction: entries not used since snapcache_max_age days, then the least
+        recently used entries above snapcache_max_size MB
+    '''
+
+    def __init__(self, cache_path, parc_fgp, tolerance, crs):
+
+        self.cache_path = cache_path
+        self.cache_uri = cache_path + '|layername=' + snapcache_tblname
+        self.crs = crs
+        # Part of the key common to all the lots
+        self.key_base = f"{parc_fgp}|{tolerance}|{crs.authid()}".encode('utf-8')
+        # Entries of the cache: key -> (fid, last use, size)
+        self.entries = {}
+        self.cache_lyr = None
+        self.load()
+
+
+    def load(self):
+        '''
+            Opens the cache table (if it exists) and reads its entries (without geometry)
+        '''
+        self.entries = {}
+        self.cache_lyr = None
+        if not os.path.exists(self.cache_path):
+            return
+        cache_lyr = QgsVectorLayer(self.cache_uri, snapcache_tblname, 'ogr')
+        if not cache_lyr.isValid():
+            return
+        self.cache_lyr = cache_lyr
+        request = QgsFeatureRequest()
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        for obj in cache_lyr.getFeatures(request):
+            self.entries[obj["cache_key"]] = (obj.id(), obj["last_used"], obj["size"])
+
+
+    def key(self, geom):
+        '''
+            Returns the key of a lot geometry
+        '''
+        cache_key = hashlib.sha1(self.key_base)
+        cache_key.update(bytes(geom.asWkb()))
+        return cache_key.hexdigest()
+
+
+    @staticmethod
+    def fields():
+        '''
+            Returns the fields of the cache table
+        '''
+        flds = QgsFields()
+        flds.append(QgsField("cache_key", QVariant.String))
+        flds.append(QgsField("last_used", QVariant.Double))
+        flds.append(QgsField("size", QVariant.LongLong))
+        return flds
+
+
+    def get(self, keys):
+        '''
+            Returns the snapped geometries found in the cache: {key: geometry}
+            The found entries are marked as used now
+        '''
+        found = {self.entries[k][0]: k for k in keys if k in self.entries}
+        geoms = {}
+        if not found:
+            return geoms
+        request = QgsFeatureRequest()
+        request.setFilterFids(list(found))
+        request.setNoAttributes()
+        for obj in self.cache_lyr.getFeatures(request):
+            geoms[found[obj.id()]] = obj.geometry()
+        used_id = self.cache_lyr.fields().indexFromName("last_used")
+        now = time.time()
+        self.cache_lyr.dataProvider().changeAttributeValues({fid: {used_id: now} for fid in found})
+        # Same date in memory (used by evict)
+        for fid, k in found.items():
+            self.entries[k] = (fid, now, self.entries[k][2])
+        return geoms
+
+
+    def put(self, snap_geoms):
+        '''
+            Adds snapped geometries to the cache: {key: geometry}
+        '''
+        if not snap_geoms:
+            return
+        flds = self.fields()
+        writer = GpkgWriter(self.cache_path,
+                            snapcache_tblname,
+                            flds,
+                            QgsWkbTypes.MultiPolygon,
+                            self.crs,
+                            self.cache_lyr is not None
+                            )
+        now = time.time()
+        for cache_key, geom in snap_geoms.items():
+            if cache_key in self.entries:
+                continue
+            nw_geom = QgsGeometry(geom)
+            nw_geom.convertToMultiType()
+            obj = QgsFeature(flds)
+            obj.setGeometry(nw_geom)
+            obj.setAttributes([cache_key, now, len(nw_geom.asWkb())])
+            writer.addFeature(obj, QgsFeatureSink.FastInsert)
+        writer.close()
+        self.load()
+
+
+    def evict(self):
+        '''
+            Deletes the entries not used since snapcache_max_age days,
+            then the least recently used entries while the cache is above snapcache_max_size MB
+            Returns the number of deleted entries
+        '''
+        if self.cache_lyr is None:
+            return 0
+        # Most recently used entries first
+        entries = sorted(self.entries.values(), key=lambda e: e[1], reverse=True)
+        min_used = time.time() - snapcache_max_age * 86400
+        max_size = snapcache_max_size * 1024 * 1024
+        del_ids = []
+        cache_size = 0
+        for fid, last_used, size in entries:
+            cache_size += size
+            if last_used < min_used or cache_size > max_size:
+                del_ids.append(fid)
+        if del_ids:
+            self.cache_lyr.dataProvider().deleteFeatures(del_ids)
+            self.load()
+        return len(del_ids)
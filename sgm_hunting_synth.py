@@ -0,0 +1,155 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        Synthetic cadastre
+    * Description:   Generation of synthetic Parcelles and LOTS CHASSE layers
+    *                (benchmarks of the plugin without a real cadastre)
+    * Specific lib:  none
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+from qgis.core import (QgsFields, QgsField, QgsFeature, QgsFeatureSink, QgsGeometry, QgsPointXY,
+                        QgsRectangle, QgsWkbTypes, QgsCoordinateReferenceSystem)
+from qgis.PyQt.QtCore import QVariant
+
+import hashlib
+import math
+import random
+import string
+
+from .sgm_hunting_globalvars import *
+from .sgm_hunting_globalfnc import *
+from .sgm_hunting_gpkg import GpkgWriter
+
+
+def jitter(x, y, amp, seed):
+    '''
+        Returns a pseudo random offset (dx, dy) in [-amp, amp] depending only on
+        the location (x, y), so a vertex shared by 2 polygons moves the same way
+    '''
+    h = hashlib.sha1(f"{seed}|{x:.3f}|{y:.3f}".encode('utf-8')).digest()
+    dx = int.from_bytes(h[:4], 'little') / 0xffffffff * 2 - 1
+    dy = int.from_bytes(h[4:8], 'little') / 0xffffffff * 2 - 1
+    return dx * amp, dy * amp
+
+
+def parc_fields():
+    '''
+        Returns the fields of the synthetic parcels (as the Parcelles layer)
+    '''
+    flds = QgsFields()
+    flds.append(QgsField("idu", QVariant.String))
+    flds.append(QgsField("nomcommune", QVariant.String))
+    flds.append(QgsField("tex", QVariant.String))
+    flds.append(QgsField(surfgeo_fldname, QVariant.Double))
+    flds.append(QgsField(contparc_fldname, QVariant.Double))
+    return flds
+
+
+def synth_parcels(gpkg_path, lyr_name, nb_parc, seed=0):
+    '''
+        Writes nb_parc synthetic parcels in a table of a GPKG
+        The parcels are the cells (synth_parc_size m) of a regular grid whose
+        vertices are moved randomly, so the parcels are irregular quadrilaterals
+        without gaps nor overlaps
+        The parcels are grouped in communes of synth_parc_by_com parcels
+        Returns the extent of the parcels
+    '''
+    rnd = random.Random(seed)
+    size = synth_parc_size
+    nb_col = math.ceil(math.sqrt(nb_parc))
+    x0, y0 = synth_origin
+    crs = QgsCoordinateReferenceSystem(synth_crs)
+    flds = parc_fields()
+    writer = GpkgWriter(gpkg_path, lyr_name, flds, QgsWkbTypes.MultiPolygon, crs)
+    sections = [a + b for a in string.ascii_uppercase for b in string.ascii_uppercase]
+
+    def vertex(col, row):
+        x = x0 + col * size
+        y = y0 + row * size
+        dx, dy = jitter(x, y, size * 0.25, seed)
+        return QgsPointXY(x + dx, y + dy)
+
+    try:
+        for parc_id in range(nb_parc):
+            col = parc_id % nb_col
+            row = parc_id // nb_col
+            ring = [vertex(col, row), vertex(col + 1, row), vertex(col + 1, row + 1), vertex(col, row + 1)]
+            geom = QgsGeometry.fromMultiPolygonXY([[ring + [ring[0]]]])
+            com_id = parc_id // synth_parc_by_com
+            num_id = parc_id % synth_parc_by_com
+            section = sections[num_id // 500 % len(sections)]
+            num = f"{num_id % 500 + 1:04d}"
+            surf = round(geom.area())
+            obj = QgsFeature(flds)
+            obj.setGeometry(geom)
+            obj.setAttributes([ f"{com_id + 1:03d}000{section}{num}",
+                                f"Commune {com_id + 1}",
+                                num,
+                                surf,
+                                round(surf * rnd.uniform(0.97, 1.03))
+                                ])
+            writer.addFeature(obj, QgsFeatureSink.FastInsert)
+    finally:
+        writer.close()
+    nb_row = math.ceil(nb_parc / nb_col)
+    return QgsRectangle(x0, y0, x0 + nb_col * size, y0 + nb_row * size)
+
+
+def synth_lots(gpkg_path, lyr_name, lot_attname, extent, nb_lots, seed=0):
+    '''
+        Writes nb_lots synthetic hunting lots covering extent in a table of a GPKG
+        The lots are the cells of the Voronoi diagram of random points, densified
+        and moved randomly (synth_lot_noise m) as if they had been drawn by hand,
+        so they must be snapped on the parcels
+    '''
+    rnd = random.Random(seed)
+    pts = [QgsPointXY(rnd.uniform(extent.xMinimum(), extent.xMaximum()),
+                        rnd.uniform(extent.yMinimum(), extent.yMaximum())) for i in range(nb_lots)]
+    ext_geom = QgsGeometry.fromRect(extent)
+    cells = QgsGeometry.fromMultiPointXY(pts).voronoiDiagram(ext_geom)
+    flds = QgsFields()
+    flds.append(QgsField(lot_attname, QVariant.String))
+    writer = GpkgWriter(gpkg_path, lyr_name, flds, QgsWkbTypes.MultiPolygon, QgsCoordinateReferenceSystem(synth_crs))
+    try:
+        lot_num = 0
+        for cell in cells.asGeometryCollection():
+            cell = cell.intersection(ext_geom).densifyByDistance(synth_parc_size / 2)
+            if cell.isEmpty():
+                continue
+            polys = cell.asMultiPolygon() if cell.isMultipart() else [cell.asPolygon()]
+            polys = [[[QgsPointXY(pt.x() + jitter(pt.x(), pt.y(), synth_lot_noise, seed + 1)[0],
+                                    pt.y() + jitter(pt.x(), pt.y(), synth_lot_noise, seed + 1)[1])
+                        for pt in ring] for ring in poly] for poly in polys]
+            lot_num += 1
+            obj = QgsFeature(flds)
+            obj.setGeometry(QgsGeometry.fromMultiPolygonXY(polys).makeValid())
+            obj.setAttributes([str(lot_num)])
+            writer.addFeature(obj, QgsFeatureSink.FastInsert)
+    finally:
+        writer.close()
+
+
+def synth_cadastre(gpkg_path, nb_parc, nb_lots, lot_lyrname, lot_attname, seed=0):
+    '''
+        Creates a GPKG with a synthetic Parcelles layer (nb_parc parcels)
+        and a synthetic hunting lots layer (nb_lots lots)
+    '''
+    extent = synth_parcels(gpkg_path, synth_parc_lyrname, nb_parc, seed)
+    synth_lots(gpkg_path, lot_lyrname, lot_attname, extent, nb_lots, seed)
@@ -0,0 +1,279 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        XlExportJob class
+    * Description:   Job creating the Excel file of the parcels by hunting lot
+    *                (without GUI, run by ExportXl or headless)
+    * Specific lib:  openpyxl (XlStreamWriter), pyarrow (optional, Parquet)
+    * First release: 2023-09-05
+    * Last release:  2023-09-07
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL v3
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+from concurrent.futures import ProcessPoolExecutor
+import os.path
+import re
+
+from .sgm_hunting_globalvars import *
+from .sgm_hunting_globalfnc import *
+from .sgm_hunting_lotstats import LotAggregate
+from .sgm_hunting_instrument import RunLog
+from .sgm_hunting_groupby import LotBuckets
+from .sgm_hunting_exprcache import ColumnExprs
+from .sgm_hunting_exportfmt import export_writer
+from .sgm_hunting_exportmanifest import ExportManifest, lot_hash
+from .sgm_hunting_xlparallel import fields_snapshot, lot_snapshot, render_lot
+
+
+class XlExportJob:
+    '''
+        Creates the Excel file of the parcels by lot (one sheet by lot)
+        Does not use iface, the project nor any window: the messages are sent
+        to send_msg and the measures of the stages to log_msg (None: not shown),
+        so it can also run headless
+        With several workers (nb_workers) and a large layer, the rows of the lots
+        are calculated in worker processes (write_sheets_parallel)
+        export_split: one Excel file by lot (lot_filepath) instead of one sheet by lot
+        export_fmt: format of the files (export_fmts), the extension of xl_filepath is replaced
+        export_incr: incremental export (split mode only), only the files of the lots
+        changed since the previous export are written (hash_lots)
+    '''
+
+    def __init__(self, parclot_lyr, nwlot_lyr, xl_filepath, conf, send_msg=None, log_msg=None):
+
+        self.parclot_lyr = parclot_lyr
+        self.nwlot_lyr = nwlot_lyr
+        # Parameters missing in the conf of some callers (Processing)
+        self.nb_workers = 1
+        self.export_split = False
+        self.export_fmt = 'xlsx'
+        self.export_incr = False
+        for k, v in conf.items():
+            self.__dict__[k[:-4]] = v
+        self.xl_filepath = os.path.splitext(xl_filepath)[0] + export_fmts.get(self.export_fmt, ".xlsx")
+        self.msg_fnc = send_msg
+        # Measures of the stages (run log next to the GPKG, or next to the exported
+        # file if the parcels are not in a file: memory or database layer)
+        gpkg_path = parclot_lyr.source().split('|')[0]
+        if parclot_lyr.providerType() != 'ogr' or not os.path.isfile(gpkg_path):
+            gpkg_path = self.xl_filepath
+        self.run_log = RunLog('ExportXl', os.path.splitext(gpkg_path)[0] + runlog_suffix, log_msg)
+        # Excel files written
+        self.xl_files = []
+        self.xl_writer = None
+        # Incremental export: hashes of the lots, lots whose file is kept
+        self.manifest = None
+        self.reused = set()
+
+
+    def run(self):
+        '''
+            Creates the Excel file
+            The errors are raised to the caller
+        '''
+        status = 'error'
+        lot_lst = []
+        parc_buckets = None
+        try:
+            # Compiles the exported expressions (an invalid expression stops the export here)
+            hd_fld_exp = self.att_export[1:-1].split("','")
+            hd_text = self.hd_export.split(",")
+            col_exprs = ColumnExprs(hd_fld_exp, self.parclot_lyr.fields())
+            with self.run_log.span('read_lots') as span:
+                # Finds the list of Lots
+                lot_lst = get_fldval_sorted(self.nwlot_lyr, self.lot_attname)
+                # Totals by lot (read once from the calculated lots layer)
+                lot_agg = LotAggregate.from_lyr(self.nwlot_lyr, self.lot_attname)
+                span.set_counts(self.nwlot_lyr.featureCount(), len(lot_lst))
+            with self.run_log.span('read_parcels') as span:
+                # Groups the parcels by lot in one scan of the layer
+                parc_buckets = LotBuckets(self.parclot_lyr, self.lot_attname, col_exprs.needs_geometry())
+                parc_buckets.load()
+                span.set_counts(parc_buckets.nb_rows, parc_buckets.nb_rows)
+            if self.export_incr and self.export_split:
+                with self.run_log.span('hash_lots') as span:
+                    self.hash_lots(lot_lst, hd_fld_exp, hd_text, col_exprs, parc_buckets, lot_agg)
+                    span.set_counts(parc_buckets.nb_rows, len(lot_lst) - len(self.reused))
+                self.send_msg(export_incr_msg_txt.format(len(lot_lst) - len(self.reused), len(lot_lst)))
+            else:
+                # The files are fully written: a previous manifest would not match them anymore
+                ExportManifest.remove(self.xl_filepath)
+            self.send_msg(exportxl_msg_txt[0])
+            nb_workers = min(get_nb_workers(self.nb_workers), len(lot_lst))
+            with self.run_log.span('sheets') as span:
+                if nb_workers > 1 and parc_buckets.nb_rows >= xl_parallel_min_rows:
+                    nb_rows = self.write_sheets_parallel(lot_lst, hd_fld_exp, hd_text, col_exprs, parc_buckets,
+                                                            lot_agg, nb_workers)
+                else:
+                    nb_rows = self.write_sheets(lot_lst, hd_text, col_exprs, parc_buckets, lot_agg)
+                span.set_counts(nb_rows, nb_rows)
+            with self.run_log.span('save') as span:
+                if self.xl_writer:
+                    self.xl_writer.save()
+                    self.xl_files.append(self.xl_filepath)
+                span.set_counts(nb_rows, len(self.xl_files))
+                if self.manifest:
+                    self.manifest.write(self.xl_filepath)
+            status = 'ok'
+        finally:
+            if parc_buckets is not None:
+                parc_buckets.close()
+            self.run_log.write(status=status, xlsx=self.xl_filepath, nb_lots=len(lot_lst), nb_files=len(self.xl_files),
+                                nb_reused=len(self.reused))
+
+
+    def lot_filepath(self, lot):
+        '''
+            Returns the path of the file of a lot (export_split)
+        '''
+        xl_name = os.path.splitext(self.xl_filepath)[0]
+        # Characters not allowed in a file name
+        lot_name = re.sub(r'[\\/:*?"<>|]', '_', str(lot))
+        return f"{xl_name} - {lot_name}{export_fmts.get(self.export_fmt, '.xlsx')}"
+
+
+    def sheet_args(self, lot, lot_agg):
+        '''
+            Returns the name and the total row of the sheet of a lot
+        '''
+        return f"Lot {lot}", [tot_label.format(lot), transfo_m_to_ha(lot_agg.get(lot).cont)]
+
+
+    def hash_lots(self, lot_lst, hd_fld_exp, hd_text, col_exprs, parc_buckets, lot_agg):
+        '''
+            Calculates the hashes of the lots (manifest) and finds the lots not changed
+            since the previous export whose file still exists (reused): their file is kept
+            The files of the lots removed since the previous export are deleted
+            Only in split mode: a file holding all the lots is always fully written (reading
+            back the unchanged sheets would cost as much as calculating their rows again)
+        '''
+        old_manifest = ExportManifest.read(self.xl_filepath)
+        self.manifest = ExportManifest()
+        need_geom = col_exprs.needs_geometry()
+        for lot in lot_lst:
+            ws_name, tot_row = self.sheet_args(lot, lot_agg)
+            head = [self.export_fmt, self.export_split, hd_fld_exp, hd_text, ws_name, tot_row]
+            self.manifest.set(lot, lot_hash(parc_buckets.rows(lot), need_geom, head))
+            if self.manifest.unchanged(lot, old_manifest):
+                self.manifest.set(lot, self.manifest.lots[str(lot)][0], old_manifest.nb_rows(lot))
+                self.reused.add(lot)
+        self.reused = {lot for lot in self.reused if os.path.exists(self.lot_filepath(lot))}
+        if old_manifest:
+            # Several lots can have the same file name (characters replaced)
+            lot_paths = {self.lot_filepath(lot) for lot in lot_lst}
+            for old_lot in old_manifest.lots:
+                old_path = self.lot_filepath(old_lot)
+                if old_lot not in self.manifest.lots and old_path not in lot_paths and os.path.exists(old_path):
+                    os.remove(old_path)
+
+
+    def write_sheets(self, lot_lst, hd_text, col_exprs, parc_buckets, lot_agg):
+        '''
+            Writes the sheets of the lots in the current process (rows streamed to the file)
+            Returns the number of rows written
+        '''
+        self.xl_writer = None if self.export_split else export_writer(self.export_fmt, self.xl_filepath)
+        nb_rows = 0
+        for lot in lot_lst:
+            ws_name, tot_row = self.sheet_args(lot, lot_agg)
+            self.send_msg(exportxl_msg_txt[1].format(ws_name))
+            if lot in self.reused:
+                # Not changed since the previous export: its file is kept
+                self.xl_files.append(self.lot_filepath(lot))
+                continue
+            parc_rows = (col_exprs.values(parc) for parc in parc_buckets.rows(lot))
+            if self.export_split:
+                lot_filepath = self.lot_filepath(lot)
+                xl_writer = export_writer(self.export_fmt, lot_filepath)
+                xl_writer.add_sheet(ws_name, hd_text, parc_rows, tot_row, lot)
+                xl_writer.save()
+                self.xl_files.append(lot_filepath)
+                self.set_nb_rows(lot, xl_writer.nb_rows)
+                nb_rows += xl_writer.nb_rows
+            else:
+                nb_prev = self.xl_writer.nb_rows
+                self.xl_writer.add_sheet(ws_name, hd_text, parc_rows, tot_row, lot)
+                self.set_nb_rows(lot, self.xl_writer.nb_rows - nb_prev)
+        if self.xl_writer:
+            nb_rows = self.xl_writer.nb_rows
+        return nb_rows
+
+
+    def write_sheets_parallel(self, lot_lst, hd_fld_exp, hd_text, col_exprs, parc_buckets, lot_agg, nb_workers):
+        '''
+            Calculates the rows of the lots in worker processes, from snapshots of
+            the attributes (no QGIS object sent)
+            The sheets are added to the workbook here, in the order of the lots
+            (or each worker writes the file of its lot: export_split)
+            At most xl_lots_by_worker lots by worker are waiting, to bound the memory
+            The lots not changed since the previous export (reused) are not sent to the workers
+            Returns the number of rows written
+        '''
+        self.xl_writer = None if self.export_split else export_writer(self.export_fmt, self.xl_filepath)
+        flds_def = fields_snapshot(self.parclot_lyr.fields())
+        need_geom = col_exprs.needs_geometry()
+        nb_rows = 0
+        with ProcessPoolExecutor(max_workers=nb_workers, mp_context=get_mp_context()) as executor:
+            futures = []
+            calc_lots = [lot for lot in lot_lst if lot not in self.reused]
+            next_id = 0
+            for lot in lot_lst:
+                # Submits the next lots (bounded number of lots waiting)
+                while next_id < len(calc_lots) and len(futures) < nb_workers * xl_lots_by_worker:
+                    sub_lot = calc_lots[next_id]
+                    snapshot = lot_snapshot(parc_buckets.rows(sub_lot), need_geom)
+                    if self.export_split:
+                        ws_name, tot_row = self.sheet_args(sub_lot, lot_agg)
+                        future = executor.submit(render_lot, flds_def, hd_fld_exp, snapshot,
+                                                    self.lot_filepath(sub_lot), ws_name, hd_text, tot_row,
+                                                    self.export_fmt, sub_lot)
+                    else:
+                        future = executor.submit(render_lot, flds_def, hd_fld_exp, snapshot)
+                    futures.append(future)
+                    next_id += 1
+                ws_name, tot_row = self.sheet_args(lot, lot_agg)
+                self.send_msg(exportxl_msg_txt[1].format(ws_name))
+                if lot in self.reused:
+                    self.xl_files.append(self.lot_filepath(lot))
+                    continue
+                result = futures.pop(0).result()
+                if self.export_split:
+                    self.xl_files.append(self.lot_filepath(lot))
+                    self.set_nb_rows(lot, result)
+                    nb_rows += result
+                else:
+                    self.set_nb_rows(lot, len(result))
+                    self.xl_writer.add_sheet(ws_name, hd_text, result, tot_row, lot)
+        if self.xl_writer:
+            nb_rows = self.xl_writer.nb_rows
+        return nb_rows
+
+
+    def set_nb_rows(self, lot, nb_rows):
+        '''
+            Stores the number of rows of a written lot in the manifest (incremental export)
+        '''
+        if self.manifest:
+            self.manifest.set(lot, self.manifest.lots[str(lot)][0], nb_rows)
+
+
+    def send_msg(self, msg):
+        '''
+            Sends a message (if there is a message function)
+        '''
+        if self.msg_fnc:
+            self.msg_fnc(msg)
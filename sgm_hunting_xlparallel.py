@@ -0,0 +1,82 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        Parallel export
+    * Description:   Rows of the sheets of the lots calculated in worker
+    *                processes from snapshots of the attributes
+    * Specific lib:  openpyxl (XlStreamWriter), pyarrow (optional, Parquet)
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+from qgis.core import QgsFields, QgsField, QgsFeature
+from qgis.PyQt.QtCore import QVariant
+
+from .sgm_hunting_globalvars import *
+from .sgm_hunting_globalfnc import *
+from .sgm_hunting_exprcache import ColumnExprs
+from .sgm_hunting_exportfmt import export_writer
+
+
+def fields_snapshot(fields):
+    '''
+        Returns the definition of fields that can be sent to a worker process:
+        [(name, type), ...]
+    '''
+    return [(fld.name(), int(fld.type())) for fld in fields]
+
+
+def lot_snapshot(objs, need_geom=False):
+    '''
+        Returns the snapshot of the features of a lot that can be sent to a worker process:
+        [(attributes, WKB or None), ...]
+    '''
+    return [([py_val(val) for val in obj.attributes()],
+                bytes(obj.geometry().asWkb()) if need_geom and obj.hasGeometry() else None)
+            for obj in objs]
+
+
+def render_lot(flds_def, expr_txts, snapshot, xl_filepath=None, ws_name=None, hd_text=None, tot_row=None,
+                export_fmt='xlsx', lot=None):
+    '''
+        Calculates the rows of the sheet of a lot (run in a worker process)
+        flds_def: fields of the features (fields_snapshot)
+        expr_txts: expressions of the exported columns
+        snapshot: features of the lot (lot_snapshot)
+        Returns the rows (values lists), or, if xl_filepath is given, writes
+        the file of the lot (export_fmt) and returns its number of rows
+    '''
+    flds = QgsFields()
+    for name, qtype in flds_def:
+        flds.append(QgsField(name, QVariant.Type(qtype)))
+    col_exprs = ColumnExprs(expr_txts, flds)
+
+    def rows():
+        for atts, wkb in snapshot:
+            obj = QgsFeature(flds)
+            obj.setAttributes(atts)
+            if wkb:
+                obj.setGeometry(geom_from_wkb(wkb))
+            yield [py_val(val) for val in col_exprs.values(obj)]
+
+    if xl_filepath is None:
+        return list(rows())
+    xl_writer = export_writer(export_fmt, xl_filepath)
+    xl_writer.add_sheet(ws_name, hd_text, rows(), tot_row, lot)
+    xl_writer.save()
+    return xl_writer.nb_rows
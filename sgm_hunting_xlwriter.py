@@ -0,0 +1,167 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        XlStreamWriter class
+    * Description:   Excel file written in streaming (openpyxl write-only mode)
+    *                with the cell styles registered once
+    * Specific lib:  openpyxl
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter
+from openpyxl.styles import (NamedStyle,
+                             PatternFill,
+                             Border,
+                             Side,
+                             Alignment,
+                             Font)
+
+from .sgm_hunting_globalvars import *
+from .sgm_hunting_globalfnc import *
+
+
+def xl_named_style(name, fill_color, b):
+    '''
+        Returns the named style of the cells of the export
+        (centered, thin black border, fill_color background, b: bold text)
+    '''
+    brd = Side(style='thin', color='00000000')
+    return NamedStyle(  name=name,
+                        alignment=Alignment(horizontal='center', vertical='center'),
+                        fill=PatternFill(fill_type='solid', fgColor=fill_color),
+                        border=Border(left=brd, right=brd, top=brd, bottom=brd),
+                        font=Font(bold=b)
+                        )
+
+
+class ColWidths:
+    '''
+        Widths of the columns of a sheet, accumulated as the values are written
+        (max length of the texts of each column)
+        Only the first sample_cap data rows are measured (0: all the rows), the
+        header and the total row are measured apart (data=False)
+    '''
+
+    def __init__(self, sample_cap=0):
+
+        self.sample_cap = sample_cap
+        self.widths = []
+        self.nb_rows = 0
+
+
+    def sampling(self):
+        '''
+            Returns True while the rows are measured
+        '''
+        return not self.sample_cap or self.nb_rows < self.sample_cap
+
+
+    def add(self, vals, data=True):
+        '''
+            Measures a row (values list)
+            data: False for the header and the total row (not counted in the sample)
+        '''
+        widths = self.widths
+        for col, val in enumerate(vals):
+            length = len(as_text(val))
+            if col >= len(widths):
+                widths.append(length)
+            elif length > widths[col]:
+                widths[col] = length
+        if data:
+            self.nb_rows += 1
+
+
+    def apply(self, ws):
+        '''
+            Sets the widths of the columns of a sheet
+        '''
+        for col, width in enumerate(self.widths):
+            ws.column_dimensions[get_column_letter(col + 1)].width = width + col_delta_w
+
+
+class XlStreamWriter:
+    '''
+        Writes the Excel file of the export in write-only mode: the rows of each
+        sheet are appended to the file as they are produced, the workbook is not
+        kept in memory
+        The styles of the cells (xl_styles) are registered once as named styles
+    '''
+
+    def __init__(self, xl_filepath):
+
+        self.xl_filepath = xl_filepath
+        self.wb = Workbook(write_only=True)
+        for name, (fill_color, b) in xl_styles.items():
+            self.wb.add_named_style(xl_named_style(name, fill_color, b))
+        self.ws = None
+        self.nb_rows = 0
+
+
+    def cell(self, val, style='xl_cell'):
+        '''
+            Returns a cell of the current sheet with a named style (NULL: empty cell)
+        '''
+        cell = WriteOnlyCell(self.ws, value=py_val(val))
+        cell.style = style
+        return cell
+
+
+    def add_sheet(self, title, hd_text, rows, tot_row, lot=None):
+        '''
+            Writes a sheet: header (hd_text), rows (iterable of values lists),
+            one empty row and the total row (label, value)
+            lot: value of the lot (not used, interface of the export writers)
+            The widths of the columns are measured while the rows are produced (ColWidths)
+            and must be set before the first row of a write-only sheet: the rows are
+            kept until the end of the sampling (xl_width_sample), then streamed
+        '''
+        self.ws = self.wb.create_sheet(title)
+        col_widths = ColWidths(xl_width_sample)
+        col_widths.add(hd_text, False)
+        col_widths.add(tot_row, False)
+        rows = iter(rows)
+        sample_rows = []
+        for vals in rows:
+            vals = list(vals)
+            col_widths.add(vals)
+            sample_rows.append(vals)
+            if not col_widths.sampling():
+                break
+        col_widths.apply(self.ws)
+        self.ws.append([self.cell(val, 'xl_header') for val in hd_text])
+        for vals in sample_rows:
+            self.ws.append([self.cell(val) for val in vals])
+        self.nb_rows += len(sample_rows)
+        del sample_rows
+        # Rows after the sampling: written as they come
+        for vals in rows:
+            self.ws.append([self.cell(val) for val in vals])
+            self.nb_rows += 1
+        self.ws.append([])
+        self.ws.append([self.cell(tot_row[0], 'xl_total'), self.cell(tot_row[1], 'xl_total_val')])
+
+
+    def save(self):
+        '''
+            Writes the Excel file
+        '''
+        self.wb.save(self.xl_filepath)
@@ -0,0 +1,57 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        Tests fixtures
+    * Description:   Standalone QgsApplication and import of the plugin modules
+    *                (the tests run with the python of the QGIS install)
+    * Specific lib:  pytest
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+import importlib
+import os
+import sys
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def qgs_app():
+    '''
+        Standalone QgsApplication (without GUI)
+    '''
+    qgis_core = pytest.importorskip("qgis.core")
+    app = qgis_core.QgsApplication([], False)
+    app.initQgis()
+    yield app
+    app.exitQgis()
+
+
+@pytest.fixture(scope="session")
+def plugin_mod(qgs_app):
+    '''
+        Returns a function importing a module of the plugin
+        (the plugin is imported as a package: name of its directory)
+    '''
+    plugin_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.path.dirname(plugin_dir))
+
+    def import_mod(mod_name):
+        return importlib.import_module(os.path.basename(plugin_dir) + "." + mod_name)
+    return import_mod
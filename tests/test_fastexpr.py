@@ -0,0 +1,54 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        Fast expressions tests
+    * Description:   Compilation of the simple expressions into python functions
+    * Specific lib:  pytest
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+import pytest
+
+qgis_core = pytest.importorskip("qgis.core")
+from qgis.PyQt.QtCore import QVariant
+
+
+def str_fields(*names):
+    '''
+        Returns text fields
+    '''
+    flds = qgis_core.QgsFields()
+    for name in names:
+        flds.append(qgis_core.QgsField(name, QVariant.String))
+    return flds
+
+
+def test_concat_compiled(plugin_mod):
+    fastexpr = plugin_mod("sgm_hunting_fastexpr")
+    fnc = fastexpr.compile_expr(qgis_core.QgsExpression("concat(\"a\", '-', \"b\")"), str_fields("a", "b"))
+    assert fnc is not None
+    assert fnc(["x", "y"]) == "x-y"
+    assert fnc(["x", None]) == "x-"
+
+
+def test_round_integer(plugin_mod):
+    fastexpr = plugin_mod("sgm_hunting_fastexpr")
+    for res in (fastexpr.qgs_round(2.5), fastexpr.qgs_round(2.5, 0)):
+        assert res == 3 and isinstance(res, int)
+    assert fastexpr.qgs_round(-2.346, 2) == -2.35
@@ -0,0 +1,47 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        Proration tests
+    * Description:   Hunting contenance of the parcel pieces (largest remainder)
+    * Specific lib:  pytest
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+import pytest
+
+qgis_core = pytest.importorskip("qgis.core")
+
+
+@pytest.mark.parametrize("fnc_name", ["prorate_batch", "prorate_batch_py"])
+def test_largest_rem_exact_sum(plugin_mod, fnc_name):
+    prorata = plugin_mod("sgm_hunting_prorata")
+    prorate = getattr(prorata, fnc_name)
+    # Pieces covering the parcel: the contenance is fully shared out
+    surfs, conts, keep = prorate([333.4, 333.3, 333.3], [1000] * 3, [1003] * 3, [7, 7, 7], True)
+    assert sum(conts) == 1003
+    assert [int(cont) for cont in conts] == [335, 334, 334]
+
+
+@pytest.mark.parametrize("fnc_name", ["prorate_batch", "prorate_batch_py"])
+def test_largest_rem_unsorted_parcels(plugin_mod, fnc_name):
+    prorata = plugin_mod("sgm_hunting_prorata")
+    prorate = getattr(prorata, fnc_name)
+    # Pieces of the parcels not consecutive, parcel 2 partially covered
+    surfs, conts, keep = prorate([500.2, 10, 499.8], [1000, 50, 1000], [1003, 51, 1003], [1, 2, 1], True)
+    assert [int(cont) for cont in conts] == [502, 10, 501]
@@ -0,0 +1,54 @@
+﻿# -*- coding: utf-8 -*-
+
+"""
+    ***************************************************************************
+    * Plugin name:   SgmHunting
+    * Plugin type:   QGIS 3 plugin
+    * Module:        SnapCache tests
+    * Description:   Eviction of the snapped lots cache
+    * Specific lib:  pytest
+    * First release: 2023-09-01
+    * Last release:  2023-09-08
+    * Copyright:     (C)2023 SIGMOE
+    * Email:         em at sigmoe.fr
+    * License:       GPL
+    ***************************************************************************
+
+    ***************************************************************************
+    * This program is free software: you can redistribute it and/or modify
+    * it under the terms of the GNU General Public License as published by
+    * the Free Software Foundation, either version 3 of the License, or
+    * (at your option) any later version.
+    ***************************************************************************
+"""
+
+
+import time
+
+import pytest
+
+qgis_core = pytest.importorskip("qgis.core")
+
+
+def test_get_hits_then_evict_keeps_entries(plugin_mod, tmp_path):
+    '''
+        Entries only read (get) since a date older than snapcache_max_age
+        are used now: evict must keep them
+    '''
+    snap = plugin_mod("sgm_hunting_snap")
+    crs = qgis_core.QgsCoordinateReferenceSystem("EPSG:2154")
+    cache = snap.SnapCache(str(tmp_path / "cache.gpkg"), "parc", 1.0, crs)
+    geom = qgis_core.QgsGeometry.fromWkt("POLYGON((0 0, 10 0, 10 10, 0 10, 0 0))")
+    k = cache.key(geom)
+    cache.put({k: geom})
+    # Entry last used long ago (in the table and in memory)
+    used_id = cache.cache_lyr.fields().indexFromName("last_used")
+    old = time.time() - (snap.snapcache_max_age + 1) * 86400
+    cache.cache_lyr.dataProvider().changeAttributeValues({cache.entries[k][0]: {used_id: old}})
+    cache.load()
+
+    assert k in cache.get([k])
+    assert cache.evict() == 0
+    assert k in cache.entries
+    cache.load()
+    assert k in cache.entries